@@ -0,0 +1,79 @@
+import asyncio
+from typing import Any, List
+from fastapi import APIRouter, Body, HTTPException, Query
+from classes import annotations, logs, workers
+from classes.config import ANNOTATIONS_COMPACT_SECONDS
+
+router = APIRouter()
+logger = logs.get_logger(__name__)
+
+# Periodic WAL checkpoint of the annotation store (started from main.py's lifespan)
+_compact_task = None
+
+
+@router.post("/save_annotations")
+async def save_annotations(annotation: dict = Body(...)):
+    """
+    Save bounding box annotation data sent from the UI.
+    Expects JSON body: {"imageName": str, "x": int, "y": int, "width": int, "height": int}
+    Appends the annotation to the annotation store; nothing else is read or rewritten.
+    """
+    if not isinstance(annotation.get("imageName"), str) or not annotation["imageName"]:
+        raise HTTPException(status_code=400, detail="imageName is required")
+    try:
+        annotation = await workers.run_io(annotations.append, annotation)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to save the annotation: {str(e)}")
+    return {"message": "Annotation saved successfully", "annotation": annotation}
+
+
+@router.post("/annotations/batch")
+async def save_annotations_batch(
+    annotations_batch: List[Any] = Body(
+        ..., embed=True, alias="annotations",
+        description="Boxes for one or many images, each like the /save_annotations body",
+    ),
+):
+    """
+    Validate a batch of boxes against their images' dimensions and save the valid
+    ones in a single transaction. Invalid items are reported individually by index.
+    """
+    try:
+        saved, errors = await workers.run_io(annotations.save_batch, annotations_batch)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to save the annotations: {str(e)}")
+    return {
+        "message": f"Saved {len(saved)} of {len(annotations_batch)} annotations",
+        "saved": saved,
+        "errors": errors,
+    }
+
+
+@router.get("/annotations")
+async def get_annotations(image: str = Query(..., min_length=1, description="imageName the annotations were saved with")):
+    """
+    Return the annotations saved for one image, oldest first.
+    """
+    return {"image": image, "annotations": await workers.run_io(annotations.for_image, image)}
+
+
+async def compact_periodically():
+    while True:
+        await asyncio.sleep(ANNOTATIONS_COMPACT_SECONDS)
+        try:
+            await workers.run_io(annotations.compact)
+        except Exception as e:
+            logger.error("Annotation store compaction failed", extra={"error": str(e)})
+
+
+async def start_annotation_store():
+    global _compact_task
+    imported = await workers.run_io(annotations.import_legacy)
+    if imported:
+        logger.info("Imported annotations from annotations.json", extra={"count": imported})
+    _compact_task = asyncio.create_task(compact_periodically())
+
+
+def stop_annotation_store():
+    if _compact_task is not None:
+        _compact_task.cancel()
@@ -0,0 +1,100 @@
+"""
+Compare the deskew step in classes/preprocess.py with the previous implementation.
+
+    python benchmarks/deskew.py --iterations 5
+
+Synthetic text pages of several sizes are rotated by a known angle (some with
+vertical rules added) and both implementations estimate and correct the skew.
+The memoised angle is cleared between runs so every call does the full work.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from classes import preprocess  # noqa: E402
+
+
+def legacy_deskew(image):
+    """The full-resolution Hough transform and mean angle deskew used before."""
+    edges = cv2.Canny(image, 50, 150, apertureSize=3)
+    lines = cv2.HoughLinesP(edges, 1, np.pi / 180, threshold=100, minLineLength=100, maxLineGap=10)
+    angle = 0.0
+    if lines is not None:
+        for line in lines.reshape(-1, 4):
+            x1, y1, x2, y2 = line
+            angle += np.arctan2(y2 - y1, x2 - x1) * 180 / np.pi
+        angle /= len(lines)
+    (h, w) = image.shape[:2]
+    center = (w // 2, h // 2)
+    M = cv2.getRotationMatrix2D(center, angle, 1.0)
+    return cv2.warpAffine(image, M, (w, h)), angle
+
+
+def current_deskew(image):
+    preprocess._skew_angles.clear()
+    angle = preprocess.estimate_skew_angle(image)
+    return preprocess.deskew(image), angle
+
+
+def make_page(width, height, skew, rules):
+    page = np.full((height, width), 255, dtype=np.uint8)
+    font_scale = width / 1600
+    line_height = int(60 * font_scale)
+    for y in range(line_height * 2, height - line_height, line_height):
+        cv2.putText(page, "The quick brown fox jumps over the lazy dog 0123456789", (int(40 * font_scale), y),
+                    cv2.FONT_HERSHEY_SIMPLEX, font_scale, 0, max(1, int(2 * font_scale)))
+    if rules:
+        for x in (width // 3, 2 * width // 3):
+            cv2.line(page, (x, 0), (x, height - 1), 0, max(1, int(3 * font_scale)))
+    M = cv2.getRotationMatrix2D((width // 2, height // 2), -skew, 1.0)
+    return cv2.warpAffine(page, M, (width, height), borderValue=255)
+
+
+def measure(fn, image, iterations):
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        _, angle = fn(image)
+        timings.append((time.perf_counter() - started) * 1000)
+    return round(statistics.median(timings), 2), angle
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--skew", type=float, default=3.0, help="Applied rotation in degrees")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for width, height in ((1000, 1400), (2500, 3500), (4000, 5600)):
+        for rules in (False, True):
+            page = make_page(width, height, args.skew, rules)
+            for name, fn in (("legacy", legacy_deskew), ("current", current_deskew)):
+                median_ms, angle = measure(fn, page, args.iterations)
+                results.append({
+                    "size": f"{width}x{height}", "rules": rules, "implementation": name,
+                    "median_ms": median_ms, "angle": round(float(angle), 3),
+                    "error": round(abs(float(angle) - args.skew), 3),
+                })
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'size':<10} {'rules':<6} {'impl':<8} {'median ms':>10} {'angle':>8} {'error':>7}")
+    for result in results:
+        print(
+            f"{result['size']:<10} {str(result['rules']):<6} {result['implementation']:<8} "
+            f"{result['median_ms']:>10} {result['angle']:>8} {result['error']:>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
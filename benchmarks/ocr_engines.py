@@ -0,0 +1,95 @@
+"""
+Compare the OCR backends in classes/ocr_engine.py on synthetic images.
+
+    python benchmarks/ocr_engines.py --iterations 50 --lang eng
+
+Each backend OCRs the same small crop (where process start-up and traineddata
+loading dominate) and the same full page, after one warm-up call.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from PIL import Image, ImageDraw, ImageFont
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from classes import ocr_engine  # noqa: E402
+
+SAMPLE_LINES = [
+    "ANNA a thriller directed by Luc Besson",
+    "Running time 119 minutes  Rated R",
+    "Special features include deleted scenes",
+]
+
+
+def render(lines, width, font_size):
+    try:
+        font = ImageFont.truetype("DejaVuSans.ttf", font_size)
+    except OSError:
+        font = ImageFont.load_default()
+    line_height = int(font_size * 1.6)
+    image = Image.new("L", (width, line_height * len(lines) + font_size), 255)
+    draw = ImageDraw.Draw(image)
+    for index, line in enumerate(lines):
+        draw.text((font_size // 2, font_size // 2 + index * line_height), line, font=font, fill=0)
+    return image
+
+
+def measure(engine, image, lang, psm, iterations):
+    ocr_engine.image_to_string(image, lang=lang, psm=psm, engine=engine)
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        ocr_engine.image_to_string(image, lang=lang, psm=psm, engine=engine)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        "mean_ms": round(statistics.mean(timings), 2),
+        "p50_ms": round(timings[len(timings) // 2], 2),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--lang", default="eng")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    cases = {
+        "crop": (render(SAMPLE_LINES[:1], 420, 24), 7),
+        "page": (render(SAMPLE_LINES * 12, 1200, 28), None),
+    }
+    engines = ["pytesseract"]
+    if ocr_engine.tesserocr is None:
+        print("tesserocr is not installed; only pytesseract is measured", file=sys.stderr)
+    else:
+        engines.insert(0, "tesserocr")
+
+    results = []
+    for case, (image, psm) in cases.items():
+        for engine in engines:
+            result = measure(engine, image, args.lang, psm, args.iterations)
+            if engine == "tesserocr" and ocr_engine.backend(args.lang, psm) != "tesserocr":
+                # The handle could not be initialised, so these timings are pytesseract's
+                continue
+            results.append({"case": case, "engine": engine, "size": image.size, **result})
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'case':<6} {'engine':<12} {'size':<12} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9}")
+    for result in results:
+        size = "x".join(str(value) for value in result["size"])
+        print(
+            f"{result['case']:<6} {result['engine']:<12} {size:<12} "
+            f"{result['mean_ms']:>9} {result['p50_ms']:>9} {result['p95_ms']:>9}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,561 @@
+"""
+Benchmark the HTTP endpoints and the preprocessing steps on a synthetic corpus.
+
+    python benchmarks/suite.py --iterations 5 --output before.json
+    python benchmarks/suite.py --iterations 5 --output after.json
+    python benchmarks/suite.py --compare before.json after.json
+
+The corpus (rendered text pages at several sizes, skews and noise levels, and a
+DVD-sleeve-like cover using the text of Example_OCR_Output.json) is generated from
+--seed into a scratch IMAGE_DIR, so runs on different commits see the same input.
+Endpoints are called in process through FastAPI's TestClient, with the app's
+lifespan and worker pools running as they do under uvicorn. "cold" cases get a
+one-pixel variant of the image for every request, so no cache or memo is hit;
+"warm" cases repeat the same request. Pipeline steps are called directly on
+decoded images in this process.
+
+Each case reports latency percentiles, throughput and peak RSS (this process plus
+the worker processes, sampled from /proc; null elsewhere). Endpoint cases also
+report the mean per-stage times from their Server-Timing headers.
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PAGE_SIZES = {"small": (800, 600), "page": (1700, 2200), "large": (3400, 4400)}
+SKEWS = (0.0, 3.0, -7.0)
+NOISE_LEVELS = (0.0, 0.04, 0.12)
+# (size, skew, noise) of the pages in the default corpus; --corpus full uses every combination
+DEFAULT_PAGES = [
+    ("small", 0.0, 0.0),
+    ("page", 0.0, 0.0),
+    ("page", 3.0, 0.0),
+    ("page", 0.0, 0.04),
+    ("large", -7.0, 0.12),
+]
+
+PAGE_LINES = [
+    "The quick brown fox jumps over the lazy dog 0123456789",
+    "ANNA a thriller directed by Luc Besson, released in 2019",
+    "Running time approx. 119 minutes. Rated R for strong violence",
+    "Starring Sasha Luss, Helen Mirren, Luke Evans and Cillian Murphy",
+    "Plot summary: revenge has a new name",
+]
+
+# name -> (path, query parameters, cache modes); {image} in the path is replaced by
+# the image name, otherwise it is passed as image_name
+ENDPOINTS = {
+    "ocr": ("/ocr", {}, ("cold", "warm")),
+    "ocr_boxes": ("/ocr", {"boxes": "true"}, ("warm",)),
+    "bounding_boxes": ("/bounding-boxes", {}, ("cold",)),
+    "ocr_regions": ("/ocr/regions", {"source": "detected"}, ("cold",)),
+    "preprocess": ("/preprocess", {}, ("cold",)),
+    "grayscale": ("/grayscale", {}, ("cold",)),
+    "thresholding": ("/thresholding", {}, ("cold",)),
+    "remove_noise": ("/remove-noise", {}, ("cold",)),
+    "morphology": ("/morphology", {}, ("cold",)),
+    "deskew": ("/deskew", {}, ("cold",)),
+    "invert_colors": ("/invert-colors", {}, ("cold",)),
+    "equalize_hist": ("/equalize-hist", {}, ("cold",)),
+    "preprocess_for_ocr": ("/preprocess-for-ocr", {}, ("cold",)),
+    "thumbnail": ("/thumb/{image}", {}, ("cold", "warm")),
+}
+# Endpoints that don't take an image; run after the image endpoints so the text index has content
+GLOBAL_ENDPOINTS = {
+    "list": ("/list", {}),
+    "search_name": ("/search", {"query": "page"}),
+    "search_text": ("/search", {"query": "thriller", "mode": "text"}),
+    "metrics": ("/metrics", {}),
+}
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def load_font(size):
+    try:
+        return ImageFont.truetype("DejaVuSans.ttf", size)
+    except OSError:
+        try:
+            return ImageFont.load_default(size=size)
+        except TypeError:
+            return ImageFont.load_default()
+
+
+def add_noise(image, level, rng):
+    if level <= 0:
+        return image
+    noisy = image.astype(np.float32) + rng.normal(0, level * 255, image.shape)
+    # Scanner specks on top of sensor noise
+    specks = rng.random(image.shape[:2]) < level / 10
+    noisy[specks] = rng.choice([0.0, 255.0], size=(int(specks.sum()),) + image.shape[2:])
+    return np.clip(noisy, 0, 255).astype(np.uint8)
+
+
+def render_page(size, skew, noise, rng):
+    width, height = PAGE_SIZES[size]
+    font_size = max(12, width // 60)
+    font = load_font(font_size)
+    page = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(page)
+    line_height = int(font_size * 1.6)
+    for index, y in enumerate(range(font_size * 2, height - line_height, line_height)):
+        draw.text((font_size * 2, y), PAGE_LINES[index % len(PAGE_LINES)], font=font, fill="black")
+    image = np.asarray(page)[:, :, ::-1].copy()
+    if skew:
+        matrix = cv2.getRotationMatrix2D((width // 2, height // 2), -skew, 1.0)
+        image = cv2.warpAffine(image, matrix, (width, height), borderValue=(255, 255, 255))
+    return add_noise(image, noise, rng)
+
+
+def sleeve_text():
+    """Lines of mostly letters from the example OCR output."""
+    with open(os.path.join(ROOT, "Example_OCR_Output.json"), "r", encoding="utf-8") as f:
+        text = json.load(f)["extracted_text"]
+    lines = []
+    for line in text.splitlines():
+        line = line.strip()
+        letters = sum(char.isalpha() or char == " " for char in line)
+        if len(line) > 20 and letters / len(line) > 0.85:
+            lines.append(line)
+    return lines
+
+
+def render_sleeve(rng):
+    """A DVD back cover: photo-like background, title, blurb, and fine print on a white strip."""
+    width, height = 1400, 2000
+    photo = cv2.resize(rng.integers(0, 120, (12, 9, 3), dtype=np.uint8), (width, height), interpolation=cv2.INTER_CUBIC)
+    cover = Image.fromarray(photo[:, :, ::-1])
+    draw = ImageDraw.Draw(cover)
+    draw.text((80, 60), "ANNA", font=load_font(220), fill=(235, 235, 235))
+    draw.text((80, 330), "REVENGE HAS A NEW NAME", font=load_font(56), fill=(200, 40, 40))
+    lines = sleeve_text()
+    body = load_font(30)
+    for index, line in enumerate(lines[:12]):
+        draw.text((80, 460 + index * 46), line[:80], font=body, fill=(240, 240, 240))
+    draw.rectangle((0, height - 360, width, height), fill="white")
+    fine = load_font(16)
+    for index, line in enumerate(lines[12:] * 4):
+        y = height - 340 + index * 22
+        if y > height - 30:
+            break
+        draw.text((40, y), line[:150], font=fine, fill="black")
+    return np.asarray(cover)[:, :, ::-1].copy()
+
+
+def build_corpus(image_dir, full, seed):
+    rng = np.random.default_rng(seed)
+    pages = list(itertools.product(PAGE_SIZES, SKEWS, NOISE_LEVELS)) if full else DEFAULT_PAGES
+    corpus = []
+    for size, skew, noise in pages:
+        name = f"page-{size}-skew{skew:+g}-noise{noise:g}.png"
+        image = render_page(size, skew, noise, rng)
+        cv2.imwrite(os.path.join(image_dir, name), image)
+        corpus.append({"name": name, "kind": "page", "size": size, "skew": skew, "noise": noise})
+    sleeve = render_sleeve(rng)
+    cv2.imwrite(os.path.join(image_dir, "sleeve.png"), sleeve)
+    cv2.imwrite(os.path.join(image_dir, "sleeve.jpg"), sleeve, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    for name in ("sleeve.png", "sleeve.jpg"):
+        corpus.append({"name": name, "kind": "sleeve", "size": None, "skew": 0.0, "noise": 0.0})
+    for entry in corpus:
+        path = os.path.join(image_dir, entry["name"])
+        with Image.open(path) as image:
+            entry["width"], entry["height"] = image.size
+        entry["bytes"] = os.path.getsize(path)
+    return corpus
+
+
+def variant(image_dir, name, index):
+    """
+    Write a copy of name with its top-left corner stamped with index, so its content
+    hash (and any cache entry or memo keyed on it) is new. Returns the copy's name.
+    """
+    image = cv2.imread(os.path.join(image_dir, name), cv2.IMREAD_UNCHANGED)
+    # Flat 8x8 blocks, which survive JPEG compression
+    image[:8, :8] = index & 0xFF
+    image[:8, 8:16] = (index >> 8) & 0xFF
+    stem, ext = os.path.splitext(name)
+    copy_name = f"{stem}.v{index}{ext}"
+    params = [cv2.IMWRITE_JPEG_QUALITY, 90] if ext == ".jpg" else []
+    cv2.imwrite(os.path.join(image_dir, copy_name), image, params)
+    return copy_name
+
+
+class RssSampler:
+    """
+    Samples the resident set size of this process and its children (the worker
+    pool) in a background thread. Linux only: elsewhere every reading is None.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.available = os.path.exists("/proc/self/statm")
+        self.page_size = os.sysconf("SC_PAGE_SIZE") if self.available else 0
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _rss(self, pid):
+        try:
+            with open(f"/proc/{pid}/statm", "r") as f:
+                return int(f.read().split()[1]) * self.page_size
+        except (OSError, IndexError, ValueError):
+            return 0
+
+    def _children(self):
+        pids = set()
+        try:
+            for task in os.listdir("/proc/self/task"):
+                with open(f"/proc/self/task/{task}/children", "r") as f:
+                    pids.update(f.read().split())
+        except OSError:
+            pass
+        return pids
+
+    def current(self):
+        if not self.available:
+            return None
+        return self._rss("self") + sum(self._rss(pid) for pid in self._children())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            rss = self.current()
+            if self.peak is None or rss > self.peak:
+                self.peak = rss
+
+    def start(self):
+        if self.available:
+            self._thread.start()
+        return self
+
+    def reset(self):
+        """Start a new measurement window; returns the RSS at its start."""
+        self.peak = self.current()
+        return self.peak
+
+    def stop(self):
+        self._stop.set()
+
+
+def percentile(ordered, q):
+    if len(ordered) == 1:
+        return ordered[0]
+    position = (len(ordered) - 1) * q / 100
+    low, high = math.floor(position), math.ceil(position)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def latency_summary(seconds):
+    ordered = sorted(value * 1000 for value in seconds)
+    summary = {"min": ordered[0], "mean": statistics.mean(ordered), "max": ordered[-1]}
+    summary.update((f"p{q}", percentile(ordered, q)) for q in PERCENTILES)
+    return {key: round(value, 3) for key, value in summary.items()}
+
+
+def parse_server_timing(header):
+    stages = {}
+    for entry in header.split(","):
+        match = re.match(r"\s*([^;]+);dur=([0-9.]+)", entry)
+        if match:
+            stages[match.group(1)] = float(match.group(2))
+    return stages
+
+
+def run_endpoint_case(client, sampler, path, params, iterations, concurrency):
+    """
+    Send one warm-up request, then iterations of them with up to concurrency in flight.
+    path and params are lists, one per request (the first is the warm-up).
+    """
+    def send(index):
+        started = time.perf_counter()
+        response = client.get(path[index], params=params[index])
+        return time.perf_counter() - started, response
+
+    send(0)
+    sampler.reset()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(send, range(1, iterations + 1)))
+    wall = time.perf_counter() - started
+
+    status = {}
+    stages = {}
+    for _, response in outcomes:
+        status[str(response.status_code)] = status.get(str(response.status_code), 0) + 1
+        for stage, duration in parse_server_timing(response.headers.get("server-timing", "")).items():
+            stages.setdefault(stage, []).append(duration)
+    return {
+        "requests": iterations,
+        "concurrency": concurrency,
+        "status": status,
+        "errors": sum(count for code, count in status.items() if not code.startswith("2")),
+        "latency_ms": latency_summary([seconds for seconds, _ in outcomes]),
+        "throughput_rps": round(iterations / wall, 3),
+        "peak_rss_bytes": sampler.peak,
+        # Averaged over the responses that carried the stage
+        "stages_ms": {stage: round(statistics.mean(values), 3) for stage, values in stages.items()},
+    }
+
+
+def run_endpoints(client, sampler, image_dir, corpus, args, selected):
+    results = []
+    counter = itertools.count(1)
+    for entry, (name, (path, params, modes)) in itertools.product(corpus, ENDPOINTS.items()):
+        for mode in modes:
+            case = f"{name}:{mode}"
+            if not selected(case):
+                continue
+            images = [entry["name"]] * (args.iterations + 1)
+            if mode == "cold":
+                images = [variant(image_dir, entry["name"], next(counter)) for _ in images]
+            if "{image}" in path:
+                paths = [path.format(image=image) for image in images]
+                request_params = [params] * len(images)
+            else:
+                paths = [path] * len(images)
+                request_params = [{**params, "image_name": image} for image in images]
+            result = run_endpoint_case(client, sampler, paths, request_params, args.iterations, args.concurrency)
+            results.append({"case": case, "endpoint": path, "cache": mode, "image": entry["name"], **result})
+            report(results[-1])
+            if mode == "cold":
+                for image in set(images):
+                    os.remove(os.path.join(image_dir, image))
+    for name, (path, params) in GLOBAL_ENDPOINTS.items():
+        if not selected(name):
+            continue
+        count = args.iterations + 1
+        result = run_endpoint_case(client, sampler, [path] * count, [params] * count, args.iterations, args.concurrency)
+        results.append({"case": name, "endpoint": path, "cache": None, "image": None, **result})
+        report(results[-1])
+    return results
+
+
+def step_cases(image_path):
+    """
+    (name, function, input) for every pipeline step and parameter value, plus
+    decoding, encoding and the built-in OCR preprocessing. Inputs are decoded the
+    way a one-step plan would decode them.
+    """
+    from classes import ocr_engine, pipeline, preprocess
+
+    def enhance(_):
+        with Image.open(image_path) as image:
+            return preprocess.enhance_for_ocr(image)
+
+    # The skew angle is memoised per content, so clear it to measure the estimate itself
+    def estimate_skew(image):
+        preprocess._skew_angles.clear()
+        return preprocess.estimate_skew_angle(image)
+
+    def deskew(image):
+        preprocess._skew_angles.clear()
+        return preprocess.deskew(image)
+
+    color = preprocess.read_image(image_path, cv2.IMREAD_COLOR)
+    gray = preprocess.read_image(image_path, cv2.IMREAD_GRAYSCALE)
+    cases = [
+        ("decode", lambda _: preprocess.read_image(image_path, cv2.IMREAD_COLOR), None),
+        ("decode_gray", lambda _: preprocess.read_image(image_path, cv2.IMREAD_GRAYSCALE), None),
+        ("encode_png", lambda image: cv2.imencode(".png", image), color),
+        ("enhance_for_ocr", enhance, None),
+        ("choose_ocr_scale", preprocess.choose_ocr_scale, gray),
+        ("estimate_skew_angle", estimate_skew, gray),
+    ]
+    for name, (function, allowed) in pipeline.STEPS.items():
+        for values in itertools.product(*allowed.values()):
+            params = dict(zip(allowed, values))
+            plan = pipeline.compile_plan([{"name": name, "params": params}])
+            label = ":".join([name, *values])
+            # A one-step grayscale plan would be done by the decoder, so give the step colour
+            source = gray if plan["read_flags"] == cv2.IMREAD_GRAYSCALE and name != "grayscale" else color
+            if name == "deskew":
+                function = deskew
+            cases.append((label, lambda image, function=function, params=params: function(image, **params), source))
+    cases.append(("ocr", ocr_engine.image_to_data, enhance(None)))
+    return cases, color.shape[1] * color.shape[0]
+
+
+def run_steps(sampler, image_dir, corpus, args, selected):
+    results = []
+    for entry in corpus:
+        cases, pixels = step_cases(os.path.join(image_dir, entry["name"]))
+        for name, function, source in cases:
+            if not selected(name):
+                continue
+            try:
+                function(source)
+            except Exception as e:
+                results.append({"case": name, "image": entry["name"], "error": str(e)})
+                report(results[-1])
+                continue
+            baseline = sampler.reset()
+            timings = []
+            for _ in range(args.iterations):
+                started = time.perf_counter()
+                function(source)
+                timings.append(time.perf_counter() - started)
+            mean = statistics.mean(timings)
+            results.append({
+                "case": name,
+                "image": entry["name"],
+                "iterations": args.iterations,
+                "latency_ms": latency_summary(timings),
+                "throughput_ops": round(1 / mean, 3) if mean else None,
+                "megapixels_per_second": round(pixels / 1e6 / mean, 3) if mean else None,
+                "peak_rss_delta_bytes": None if baseline is None else sampler.peak - baseline,
+            })
+            report(results[-1])
+    return results
+
+
+def report(result):
+    if "error" in result:
+        print(f"{result['case']:<32} {result['image']:<40} error: {result['error']}", file=sys.stderr)
+        return
+    latency = result["latency_ms"]
+    rate = result.get("throughput_rps", result.get("throughput_ops"))
+    print(
+        f"{result['case']:<32} {str(result['image']):<40} p50 {latency['p50']:>10.2f} ms  "
+        f"p95 {latency['p95']:>10.2f} ms  {rate:>9.2f}/s",
+        file=sys.stderr,
+    )
+
+
+def git_revision():
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, capture_output=True, text=True
+        ).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return revision + ("-dirty" if dirty else "")
+
+
+def environment(args):
+    import PIL
+    from classes import config, ocr_engine
+
+    return {
+        "git_revision": git_revision(),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "cpu_workers": config.CPU_WORKERS,
+        "ocr_backend": ocr_engine.backend("eng"),
+        "versions": {"numpy": np.__version__, "opencv": cv2.__version__, "pillow": PIL.__version__},
+        "args": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+    }
+
+
+def compare(old_path, new_path, threshold):
+    """Print p50/p95 latency and throughput changes for the cases present in both files."""
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, "r", encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{old['meta']['git_revision']} -> {new['meta']['git_revision']}")
+    print(f"{'case':<32} {'image':<40} {'p50 ms':>23}  {'p95 ms':>23}  {'rate /s':>17}")
+    regressions = 0
+    for section in ("steps", "endpoints"):
+        previous = {(r["case"], r["image"]): r for r in old.get(section, []) if "latency_ms" in r}
+        for result in new.get(section, []):
+            before = previous.get((result["case"], result["image"]))
+            if before is None or "latency_ms" not in result:
+                continue
+            columns = []
+            for key in ("p50", "p95"):
+                a, b = before["latency_ms"][key], result["latency_ms"][key]
+                columns.append(f"{a:>8.2f} {b:>8.2f} {change(a, b):>+4.0f}%")
+            rate_key = "throughput_rps" if section == "endpoints" else "throughput_ops"
+            columns.append(f"{before[rate_key]:>8.2f} {result[rate_key]:>8.2f}")
+            slower = change(before["latency_ms"]["p50"], result["latency_ms"]["p50"]) > threshold
+            regressions += slower
+            flags = ("  !" if slower else "") + ("  errors" if before.get("errors") or result.get("errors") else "")
+            print(f"{result['case']:<32} {str(result['image']):<40} {'  '.join(columns)}{flags}")
+    print(f"{regressions} case(s) more than {threshold:g}% slower at p50")
+
+
+def change(before, after):
+    return (after - before) / before * 100 if before else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=5, help="Measured calls per case (after one warm-up)")
+    parser.add_argument("--concurrency", type=int, default=1, help="Endpoint requests in flight at once")
+    parser.add_argument("--corpus", choices=("default", "full"), default="default",
+                        help="full renders every size x skew x noise combination")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", help="Regular expression; only cases whose name matches are run")
+    parser.add_argument("--skip-endpoints", action="store_true")
+    parser.add_argument("--skip-steps", action="store_true")
+    parser.add_argument("--workdir", help="Directory for the corpus and server state (default: a temporary one, removed afterwards)")
+    parser.add_argument("--output", help="Write the JSON results here instead of stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two result files and exit")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Percent p50 slowdown flagged by --compare")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare, args.threshold)
+        return
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="image-server-bench-")
+    image_dir = os.path.join(workdir, "images")
+    os.makedirs(image_dir, exist_ok=True)
+    # The server reads its configuration at import time, so this has to come first
+    os.environ["IMAGE_DIR"] = image_dir
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    pattern = re.compile(args.only) if args.only else None
+
+    def selected(case):
+        return pattern is None or pattern.search(case) is not None
+
+    sampler = RssSampler().start()
+    try:
+        corpus = build_corpus(image_dir, args.corpus == "full", args.seed)
+        results = {"meta": environment(args), "corpus": corpus, "steps": [], "endpoints": []}
+        if not args.skip_steps:
+            results["steps"] = run_steps(sampler, image_dir, corpus, args, selected)
+        if not args.skip_endpoints:
+            from fastapi.testclient import TestClient
+            import main as server
+
+            # Entering the client runs the lifespan: worker pools, catalog, job workers
+            with TestClient(server.app) as client:
+                results["endpoints"] = run_endpoints(client, sampler, image_dir, corpus, args, selected)
+    finally:
+        sampler.stop()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
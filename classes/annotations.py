@@ -0,0 +1,212 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from PIL import Image
+from classes import logs
+from classes.catalog import connect
+from classes.config import ANNOTATIONS_PATH, IMAGE_DIR, LEGACY_ANNOTATIONS_PATH
+
+# Bounding boxes saved from the annotator UI. Each save is a single-row INSERT into
+# a WAL-mode SQLite table, so saves are O(1), atomic and safe to run concurrently,
+# and boxes for one image are read through an index instead of the whole history.
+
+logger = logs.get_logger(__name__)
+_lock = threading.RLock()
+_conn = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS annotations (
+    id INTEGER PRIMARY KEY,
+    image_name TEXT NOT NULL,
+    data TEXT NOT NULL,
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS annotations_by_image ON annotations (image_name, id);
+"""
+
+# PRAGMA user_version once annotations.json has been imported
+LEGACY_IMPORTED = 1
+
+# (path, size, mtime_ns) -> (width, height), so a batch of boxes on one image opens it once
+_dimensions = OrderedDict()
+DIMENSIONS_MEMO_SIZE = 4096
+BOX_FIELDS = ("x", "y", "width", "height")
+
+
+def get_connection():
+    global _conn
+    with _lock:
+        if _conn is None:
+            _conn = connect(ANNOTATIONS_PATH)
+            _conn.executescript(SCHEMA)
+        return _conn
+
+
+def import_legacy(path=LEGACY_ANNOTATIONS_PATH):
+    """
+    Copy the records of the old annotations.json into the store, once. The file
+    itself is left in place. Returns the number of records imported.
+    """
+    with _lock:
+        conn = get_connection()
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= LEGACY_IMPORTED:
+            return 0
+        records = []
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    records = json.load(f)
+            except Exception as e:
+                logger.warning("Could not read legacy annotations, skipping import", extra={"path": path, "error": str(e)})
+            if not isinstance(records, list):
+                records = []
+        rows = [
+            _row_values(record, record.get("timestamp") or datetime.now().isoformat())
+            for record in records
+            if isinstance(record, dict)
+        ]
+        conn.execute("BEGIN")
+        try:
+            conn.executemany("INSERT INTO annotations (image_name, data, timestamp) VALUES (?, ?, ?)", rows)
+            conn.execute(f"PRAGMA user_version = {LEGACY_IMPORTED}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    return len(rows)
+
+
+def _row_values(annotation, timestamp):
+    annotation = {**annotation, "timestamp": timestamp}
+    return (str(annotation.get("imageName", "")), json.dumps(annotation), timestamp)
+
+
+def append(annotation):
+    """
+    Store one annotation and return it with its id and timestamp.
+    """
+    image_name, data, timestamp = _row_values(annotation, datetime.now().isoformat())
+    with _lock:
+        cursor = get_connection().execute(
+            "INSERT INTO annotations (image_name, data, timestamp) VALUES (?, ?, ?)",
+            (image_name, data, timestamp),
+        )
+    return {"id": cursor.lastrowid, **json.loads(data)}
+
+
+def append_many(items):
+    """
+    Store several annotations in one transaction; returns them with ids and timestamps.
+    """
+    timestamp = datetime.now().isoformat()
+    rows = [_row_values(annotation, timestamp) for annotation in items]
+    saved = []
+    with _lock:
+        conn = get_connection()
+        conn.execute("BEGIN")
+        try:
+            for row in rows:
+                cursor = conn.execute("INSERT INTO annotations (image_name, data, timestamp) VALUES (?, ?, ?)", row)
+                saved.append({"id": cursor.lastrowid, **json.loads(row[1])})
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    return saved
+
+
+def image_dimensions(image_path):
+    """
+    Return (width, height) from the image header; PIL does not decode pixels for this.
+    """
+    stat = os.stat(image_path)
+    memo_key = (image_path, stat.st_size, stat.st_mtime_ns)
+    with _lock:
+        if memo_key in _dimensions:
+            _dimensions.move_to_end(memo_key)
+            return _dimensions[memo_key]
+    with Image.open(image_path) as image:
+        size = image.size
+    with _lock:
+        _dimensions[memo_key] = size
+        if len(_dimensions) > DIMENSIONS_MEMO_SIZE:
+            _dimensions.popitem(last=False)
+    return size
+
+
+def validate(annotation, image_dir=IMAGE_DIR):
+    """
+    Return None if the annotation is a box that lies inside its image, otherwise
+    a message describing the problem. An optional "subfolder" locates the image.
+    """
+    if not isinstance(annotation, dict):
+        return "Annotation must be an object"
+    image_name = annotation.get("imageName")
+    if not isinstance(image_name, str) or not image_name:
+        return "imageName is required"
+    for field in BOX_FIELDS:
+        value = annotation.get(field)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return f"{field} must be a number"
+    if annotation["x"] < 0 or annotation["y"] < 0:
+        return "x and y must not be negative"
+    if annotation["width"] <= 0 or annotation["height"] <= 0:
+        return "width and height must be positive"
+
+    subfolder = annotation.get("subfolder") or ""
+    if not isinstance(subfolder, str):
+        return "subfolder must be a string"
+    image_path = os.path.normpath(os.path.join(image_dir, subfolder, image_name))
+    if not image_path.startswith(os.path.normpath(image_dir) + os.sep):
+        return "Invalid image path"
+    try:
+        width, height = image_dimensions(image_path)
+    except FileNotFoundError:
+        return f"Image not found: {image_name}"
+    except Exception as e:
+        return f"Failed to read the image: {str(e)}"
+    if annotation["x"] + annotation["width"] > width or annotation["y"] + annotation["height"] > height:
+        return f"Box exceeds the image bounds ({width}x{height})"
+    return None
+
+
+def save_batch(items):
+    """
+    Validate every item, then store the valid ones in a single transaction.
+    Returns (saved annotations, [{"index", "imageName", "error"}]).
+    """
+    valid = []
+    errors = []
+    for index, annotation in enumerate(items):
+        error = validate(annotation)
+        if error is None:
+            valid.append(annotation)
+        else:
+            image_name = annotation.get("imageName") if isinstance(annotation, dict) else None
+            errors.append({"index": index, "imageName": image_name, "error": error})
+    return append_many(valid) if valid else [], errors
+
+
+def for_image(image_name):
+    """
+    Return the annotations saved for one image, oldest first.
+    """
+    with _lock:
+        rows = get_connection().execute(
+            "SELECT id, data FROM annotations WHERE image_name = ? ORDER BY id", (image_name,)
+        ).fetchall()
+    return [{"id": row["id"], **json.loads(row["data"])} for row in rows]
+
+
+def compact():
+    """
+    Fold the write-ahead log back into the database file and truncate it, so the
+    log does not grow without bound between restarts.
+    """
+    with _lock:
+        conn = get_connection()
+        busy, _, _ = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        conn.execute("PRAGMA optimize")
+    return not busy
@@ -0,0 +1,531 @@
+import base64
+import json
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from classes.config import IMAGE_DIR, CATALOG_PATH
+
+# The catalog keeps one row per file under IMAGE_DIR so that /list and /search
+# never have to walk the tree. It is built once at startup, updated by the
+# upload/rename handlers and reconciled periodically against file mtimes.
+
+_lock = threading.RLock()
+_conn = None
+_has_trigram = False
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    parent_folder TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_by_name ON files (name, path);
+CREATE INDEX IF NOT EXISTS files_by_mtime ON files (mtime, path);
+CREATE INDEX IF NOT EXISTS files_by_size ON files (size, path);
+CREATE INDEX IF NOT EXISTS files_by_folder ON files (parent_folder, path);
+"""
+
+# Columns /list can be ordered by. Every ordering is tie-broken on path so that
+# cursors stay stable while files are added or removed between pages.
+SORT_COLUMNS = {"name": "name", "mtime": "mtime", "size": "size", "path": "path"}
+
+# Trigram index over file names so substring searches don't scan the table
+TRIGRAM_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS file_names USING fts5(
+    name, content='files', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS files_ai AFTER INSERT ON files BEGIN
+    INSERT INTO file_names(rowid, name) VALUES (new.id, new.name);
+END;
+CREATE TRIGGER IF NOT EXISTS files_ad AFTER DELETE ON files BEGIN
+    INSERT INTO file_names(file_names, rowid, name) VALUES ('delete', old.id, old.name);
+END;
+CREATE TRIGGER IF NOT EXISTS files_au AFTER UPDATE OF name ON files BEGIN
+    INSERT INTO file_names(file_names, rowid, name) VALUES ('delete', old.id, old.name);
+    INSERT INTO file_names(rowid, name) VALUES (new.id, new.name);
+END;
+"""
+
+# Text extracted by /ocr, keyed by image path and the mtime the text was read from.
+# ocr_index is a full-text index over the text and the matched category keywords.
+OCR_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ocr_text (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    lang TEXT NOT NULL,
+    text TEXT NOT NULL,
+    categories TEXT NOT NULL,
+    category_terms TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS ocr_index USING fts5(
+    text, category_terms, content='ocr_text', content_rowid='rowid',
+    tokenize='porter unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS ocr_text_ai AFTER INSERT ON ocr_text BEGIN
+    INSERT INTO ocr_index(rowid, text, category_terms)
+    VALUES (new.rowid, new.text, new.category_terms);
+END;
+CREATE TRIGGER IF NOT EXISTS ocr_text_ad AFTER DELETE ON ocr_text BEGIN
+    INSERT INTO ocr_index(ocr_index, rowid, text, category_terms)
+    VALUES ('delete', old.rowid, old.text, old.category_terms);
+END;
+CREATE TRIGGER IF NOT EXISTS ocr_text_au AFTER UPDATE ON ocr_text BEGIN
+    INSERT INTO ocr_index(ocr_index, rowid, text, category_terms)
+    VALUES ('delete', old.rowid, old.text, old.category_terms);
+    INSERT INTO ocr_index(rowid, text, category_terms)
+    VALUES (new.rowid, new.text, new.category_terms);
+END;
+CREATE TRIGGER IF NOT EXISTS files_ad_ocr AFTER DELETE ON files BEGIN
+    DELETE FROM ocr_text WHERE path = old.path;
+END;
+"""
+
+
+def connect(db_path):
+    """
+    Open a SQLite connection shared between the event loop and worker threads.
+    """
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def init_catalog(db_path=CATALOG_PATH):
+    """
+    Open the catalog database and create its schema if needed.
+    """
+    global _conn, _has_trigram
+    with _lock:
+        if _conn is not None:
+            return _conn
+        conn = connect(db_path)
+        conn.executescript(SCHEMA)
+        _migrate(conn)
+        conn.executescript(OCR_SCHEMA)
+        try:
+            conn.executescript(TRIGRAM_SCHEMA)
+            _has_trigram = True
+        except sqlite3.OperationalError:
+            # SQLite builds older than 3.34 have no trigram tokenizer; fall back to LIKE scans
+            _has_trigram = False
+        _conn = conn
+        return conn
+
+
+def _migrate(conn):
+    """
+    Add columns introduced after the files table was first created.
+    """
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(files)")}
+    if "content_hash" not in columns:
+        # SHA-256 of the file contents, when known (set by /upload; cleared when the file changes)
+        conn.execute("ALTER TABLE files ADD COLUMN content_hash TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS files_by_hash ON files (content_hash)")
+
+
+def get_connection():
+    return _conn if _conn is not None else init_catalog()
+
+
+def is_empty():
+    with _lock:
+        return get_connection().execute("SELECT 1 FROM files LIMIT 1").fetchone() is None
+
+
+def _relative_path(file_path, image_dir=IMAGE_DIR):
+    """
+    Return the catalog key for a file, or None if it lives outside the image directory.
+    """
+    rel_path = os.path.relpath(os.path.abspath(file_path), os.path.abspath(image_dir))
+    if rel_path.startswith(".."):
+        return None
+    rel_path = rel_path.replace(os.sep, "/")
+    if any(part.startswith(".") for part in rel_path.split("/")):
+        return None
+    return rel_path
+
+
+def _row_values(rel_path, stat, image_dir=IMAGE_DIR):
+    root = os.path.dirname(os.path.join(image_dir, rel_path))
+    return (
+        rel_path,
+        os.path.basename(rel_path),
+        os.path.basename(root),
+        stat.st_size,
+        stat.st_mtime,
+    )
+
+
+def _scan(image_dir):
+    """
+    Yield (relative path, stat) for every non-hidden file under image_dir.
+    Uses scandir so each file costs a single stat call.
+    """
+    stack = [image_dir]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file():
+                    rel_path = os.path.relpath(entry.path, image_dir).replace(os.sep, "/")
+                    yield rel_path, entry.stat()
+            except OSError:
+                continue
+
+
+def reconcile(image_dir=IMAGE_DIR):
+    """
+    Bring the catalog in line with the filesystem. Only files whose size or
+    mtime changed are rewritten, and rows for vanished files are removed.
+    """
+    conn = get_connection()
+    with _lock:
+        known = {
+            row["path"]: (row["size"], row["mtime"])
+            for row in conn.execute("SELECT path, size, mtime FROM files")
+        }
+
+    changed = []
+    for rel_path, stat in _scan(image_dir):
+        previous = known.pop(rel_path, None)
+        if previous is None or previous != (stat.st_size, stat.st_mtime):
+            changed.append(_row_values(rel_path, stat, image_dir))
+    removed = [(rel_path,) for rel_path in known]
+
+    with _lock:
+        conn.execute("BEGIN")
+        try:
+            _upsert_many(conn, changed)
+            conn.executemany("DELETE FROM files WHERE path = ?", removed)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    return {"updated": len(changed), "removed": len(removed)}
+
+
+def _upsert_many(conn, rows):
+    """
+    rows are _row_values() tuples, optionally followed by the content hash.
+    A row without a hash clears any stored one, since the file has changed.
+    """
+    conn.executemany(
+        """
+        INSERT INTO files (path, name, parent_folder, size, mtime, content_hash) VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(path) DO UPDATE SET
+            size = excluded.size, mtime = excluded.mtime, content_hash = excluded.content_hash
+        """,
+        [row if len(row) == 6 else row + (None,) for row in rows],
+    )
+
+
+def upsert_path(file_path, image_dir=IMAGE_DIR, content_hash=None):
+    """
+    Record a file that was just written (e.g. by /upload).
+    """
+    rel_path = _relative_path(file_path, image_dir)
+    if rel_path is None:
+        return
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        remove_path(file_path, image_dir)
+        return
+    with _lock:
+        _upsert_many(get_connection(), [_row_values(rel_path, stat, image_dir) + (content_hash,)])
+
+
+def stored_hash(file_path, stat, image_dir=IMAGE_DIR):
+    """
+    Return the catalogued content hash of a file if the catalog row still matches
+    the file's size and mtime, otherwise None.
+    """
+    rel_path = _relative_path(file_path, image_dir)
+    if rel_path is None:
+        return None
+    with _lock:
+        row = get_connection().execute(
+            "SELECT size, mtime, content_hash FROM files WHERE path = ?", (rel_path,)
+        ).fetchone()
+    if row is None or (row["size"], row["mtime"]) != (stat.st_size, stat.st_mtime):
+        return None
+    return row["content_hash"]
+
+
+def find_by_hash(content_hash, size, image_dir=IMAGE_DIR):
+    """
+    Return absolute paths of catalogued files with the given contents.
+    """
+    with _lock:
+        rows = get_connection().execute(
+            "SELECT path FROM files WHERE content_hash = ? AND size = ?", (content_hash, size)
+        ).fetchall()
+    return [os.path.join(image_dir, row["path"]) for row in rows]
+
+
+def remove_path(file_path, image_dir=IMAGE_DIR):
+    rel_path = _relative_path(file_path, image_dir)
+    if rel_path is None:
+        return
+    with _lock:
+        get_connection().execute("DELETE FROM files WHERE path = ?", (rel_path,))
+
+
+def rename_path(old_path, new_path, image_dir=IMAGE_DIR):
+    """
+    Record a rename (e.g. by /rename) as a delete of the old key and an insert of the new one.
+    """
+    old_key = _relative_path(old_path, image_dir)
+    new_key = _relative_path(new_path, image_dir)
+    with _lock:
+        if old_key is not None and new_key is not None:
+            # Extracted text follows the file, so a rename doesn't require another OCR pass
+            conn = get_connection()
+            conn.execute("DELETE FROM ocr_text WHERE path = ?", (new_key,))
+            conn.execute("UPDATE ocr_text SET path = ? WHERE path = ?", (new_key, old_key))
+        remove_path(old_path, image_dir)
+        upsert_path(new_path, image_dir)
+
+
+def to_response(row, image_dir=IMAGE_DIR):
+    """
+    Shape a catalog row like the entries /list and /search have always returned.
+    """
+    return {
+        "name": row["name"],
+        "url": os.path.join(image_dir, row["path"]),
+        "parent_folder": row["parent_folder"],
+        "size": row["size"],
+        "last_modified": datetime.fromtimestamp(row["mtime"]).strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+
+def encode_cursor(sort, order, row):
+    """
+    Build an opaque cursor pointing just past the given row.
+    """
+    payload = {"s": sort, "o": order, "v": row[SORT_COLUMNS[sort]], "p": row["path"]}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor, sort, order):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        value, path = payload["v"], payload["p"]
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if payload.get("s") != sort or payload.get("o") != order:
+        raise ValueError("Cursor was issued for a different sort order")
+    return value, path
+
+
+def list_page(limit, cursor=None, sort="name", order="asc", parent_folder=None):
+    """
+    Return one page of catalog entries and the cursor for the next page (None on the last page).
+    Pages are fetched with keyset pagination, so every page costs the same regardless of depth.
+    """
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f"Invalid sort. Use one of: {', '.join(SORT_COLUMNS)}")
+    if order not in ("asc", "desc"):
+        raise ValueError("Invalid order. Use 'asc' or 'desc'.")
+    column = SORT_COLUMNS[sort]
+    direction = "ASC" if order == "asc" else "DESC"
+    comparison = ">" if order == "asc" else "<"
+
+    clauses, params = [], []
+    if parent_folder is not None:
+        clauses.append("parent_folder = ?")
+        params.append(parent_folder)
+    if cursor:
+        value, path = decode_cursor(cursor, sort, order)
+        if column == "path":
+            clauses.append(f"path {comparison} ?")
+            params.append(path)
+        else:
+            clauses.append(f"({column}, path) {comparison} (?, ?)")
+            params.extend([value, path])
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    sql = f"""
+        SELECT path, name, parent_folder, size, mtime FROM files {where}
+        ORDER BY {column} {direction}, path {direction}
+        LIMIT ?
+    """
+    # Fetch one extra row to learn whether another page exists
+    with _lock:
+        rows = get_connection().execute(sql, params + [limit + 1]).fetchall()
+    next_cursor = encode_cursor(sort, order, rows[limit - 1]) if len(rows) > limit else None
+    return [to_response(row) for row in rows[:limit]], next_cursor
+
+
+def iter_entries(sort="name", order="asc", parent_folder=None, batch_size=500):
+    """
+    Yield every catalog entry in order, holding at most one batch in memory.
+    """
+    cursor = None
+    while True:
+        entries, cursor = list_page(batch_size, cursor, sort, order, parent_folder)
+        yield from entries
+        if cursor is None:
+            return
+
+
+def list_paths(folder=None, recursive=False):
+    """
+    Return the catalog keys of files inside folder ('' or None for the image root).
+    Non-recursive listings only include files directly inside the folder.
+    """
+    prefix = folder.strip("/") + "/" if folder and folder.strip("/") else ""
+    with _lock:
+        if prefix:
+            # '0' sorts right after '/', so this range covers exactly the paths below prefix
+            rows = get_connection().execute(
+                "SELECT path FROM files WHERE path >= ? AND path < ? ORDER BY path",
+                (prefix, prefix[:-1] + "0"),
+            ).fetchall()
+        else:
+            rows = get_connection().execute("SELECT path FROM files ORDER BY path").fetchall()
+    paths = [row["path"] for row in rows]
+    if not recursive:
+        paths = [path for path in paths if "/" not in path[len(prefix):]]
+    return paths
+
+
+def search_entries(query):
+    """
+    Case-insensitive substring match on file names.
+    """
+    needs_escape = any(char in query for char in "\\%_")
+    pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    if _has_trigram and len(query) >= 3 and not needs_escape:
+        # The trigram index can only serve LIKE patterns without an ESCAPE clause
+        sql = """
+            SELECT path, name, parent_folder, size, mtime FROM files
+            WHERE id IN (SELECT rowid FROM file_names WHERE name LIKE ?)
+            ORDER BY path
+        """
+    else:
+        sql = """
+            SELECT path, name, parent_folder, size, mtime FROM files
+            WHERE name LIKE ? ESCAPE '\\'
+            ORDER BY path
+        """
+    with _lock:
+        rows = get_connection().execute(sql, (pattern,)).fetchall()
+    return [to_response(row) for row in rows]
+
+
+def index_ocr_text(file_path, lang, text, categories, image_dir=IMAGE_DIR):
+    """
+    Store the text extracted from an image so it can be found with search_text().
+    """
+    rel_path = _relative_path(file_path, image_dir)
+    if rel_path is None:
+        return
+    mtime = os.stat(file_path).st_mtime
+    category_terms = _category_terms(categories)
+    with _lock:
+        get_connection().execute(
+            """
+            INSERT INTO ocr_text (path, mtime, lang, text, categories, category_terms)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(path) DO UPDATE SET
+                mtime = excluded.mtime, lang = excluded.lang, text = excluded.text,
+                categories = excluded.categories, category_terms = excluded.category_terms
+            """,
+            (rel_path, mtime, lang, text, json.dumps(categories), category_terms),
+        )
+
+
+def _category_terms(categories):
+    return " ".join(f"{category} {keyword}" for category, keyword in categories.items())
+
+
+def iter_ocr_text(batch_size=500):
+    """
+    Yield lists of (rowid, text, categories) for all indexed OCR text, a batch at a time.
+    """
+    last = 0
+    while True:
+        with _lock:
+            rows = get_connection().execute(
+                "SELECT rowid, text, categories FROM ocr_text WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (last, batch_size),
+            ).fetchall()
+        if not rows:
+            return
+        last = rows[-1]["rowid"]
+        yield [(row["rowid"], row["text"], json.loads(row["categories"])) for row in rows]
+
+
+def update_ocr_categories(updates):
+    """
+    Replace the categories of indexed OCR text, given [(rowid, categories)], in one transaction.
+    """
+    with _lock:
+        conn = get_connection()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                "UPDATE ocr_text SET categories = ?, category_terms = ? WHERE rowid = ?",
+                [(json.dumps(categories), _category_terms(categories), rowid) for rowid, categories in updates],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def _fts_query(query):
+    """
+    Turn free text into an FTS5 query where every word must match as a prefix.
+    """
+    terms = re.findall(r"\w+", query.lower())
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def search_text(query, limit=50):
+    """
+    Ranked search over extracted OCR text and categories. Text indexed from an
+    older version of a file (mtime no longer matches the catalog) is skipped.
+    """
+    fts_query = _fts_query(query)
+    if not fts_query:
+        return []
+    # bm25 ranks better matches lower; category hits weigh twice as much as body text
+    sql = """
+        SELECT f.path, f.name, f.parent_folder, f.size, f.mtime, o.categories,
+               bm25(ocr_index, 1.0, 2.0) AS rank,
+               snippet(ocr_index, 0, '[', ']', '...', 12) AS snippet
+        FROM ocr_index
+        JOIN ocr_text o ON o.rowid = ocr_index.rowid
+        JOIN files f ON f.path = o.path AND f.mtime = o.mtime
+        WHERE ocr_index MATCH ?
+        ORDER BY rank
+        LIMIT ?
+    """
+    with _lock:
+        rows = get_connection().execute(sql, (fts_query, limit)).fetchall()
+    results = []
+    for row in rows:
+        entry = to_response(row)
+        entry["score"] = -row["rank"]
+        entry["snippet"] = row["snippet"]
+        entry["categories"] = json.loads(row["categories"])
+        results.append(entry)
+    return results
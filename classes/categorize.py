@@ -1,18 +1,186 @@
-def categorize_text(text):
-    categories = {
-        "genre": ["action", "thriller", "comedy", "drama"],
-        "director": ["director", "directed by"],
-        "runtime": ["runtime", "minutes"],
-        "title": ["title", "movie", "film"],
-        "release_year": ["release", "year", "released"],
-        "rating": ["rating", "rated"],
-        "cast": ["cast", "starring", "featuring"],
-        "plot": ["plot", "synopsis", "summary"],
+import json
+import os
+import re
+import threading
+from collections import Counter
+from classes.config import CATEGORIES_PATH
+
+# Keyword categorisation of OCR'd text. The keyword table is compiled once into a
+# single regex whose alternation is factored into a trie ("direct(?:ed by|or)"), so
+# the engine never tries more than one branch per character. It runs inside a
+# lookahead over the lowercased text: one pass finds the longest keyword starting
+# at every position, overlapping ones included. Matching is on substrings, as it
+# always was ("released" also counts as "release").
+#
+# The table can be replaced by a JSON object at CATEGORIES_PATH mapping each
+# category to its keywords in priority order; reload() picks up edits.
+
+DEFAULT_CATEGORIES = {
+    "genre": ["action", "thriller", "comedy", "drama"],
+    "director": ["director", "directed by"],
+    "runtime": ["runtime", "minutes"],
+    "title": ["title", "movie", "film"],
+    "release_year": ["release", "year", "released"],
+    "rating": ["rating", "rated"],
+    "cast": ["cast", "starring", "featuring"],
+    "plot": ["plot", "synopsis", "summary"],
+}
+
+_lock = threading.Lock()
+_compiled = None
+
+
+def validate_table(table):
+    """
+    Check a keyword table and return it with keywords lowercased and stripped.
+    Raises ValueError describing the first problem.
+    """
+    if not isinstance(table, dict) or not table:
+        raise ValueError("The category table must be a non-empty object of category -> keywords")
+    normalized = {}
+    for category, keywords in table.items():
+        if not isinstance(keywords, list) or not keywords:
+            raise ValueError(f"Category '{category}' must have a non-empty list of keywords")
+        if not all(isinstance(keyword, str) and keyword.strip() for keyword in keywords):
+            raise ValueError(f"Category '{category}': keywords must be non-empty strings")
+        normalized[category] = [keyword.strip().lower() for keyword in keywords]
+    return normalized
+
+
+def _trie_pattern(keywords):
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        # A keyword ends here but longer ones continue; the greedy ? prefers the longer
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+def compile_table(table):
+    """
+    Turn a keyword table into the pattern and lookups categorize() runs with.
+    """
+    table = validate_table(table)
+    # keyword -> categories it belongs to
+    owners = {}
+    for category, keywords in table.items():
+        for keyword in keywords:
+            owners.setdefault(keyword, []).append(category)
+    # A match of "released" is also an occurrence of "release"
+    contained = {keyword: [other for other in owners if other in keyword] for keyword in owners}
+    # Categories a match of the keyword scores for: its own and those of the shorter
+    # keywords it starts with, which the longest-match lookahead hides ("released" is
+    # also a "release"). Keywords further inside it are matched at their own position.
+    credited = {
+        keyword: list(dict.fromkeys(
+            category for other in owners if keyword.startswith(other) for category in owners[other]
+        ))
+        for keyword in owners
     }
-    results = {}
-    for category, keywords in categories.items():
+    # Checking the first character before entering the trie skips most positions cheaply
+    first_chars = "".join(re.escape(char) for char in sorted({keyword[0] for keyword in owners}))
+    pattern = f"(?=[{first_chars}])(?=({_trie_pattern(owners)}))"
+    return {
+        "table": table,
+        "pattern": re.compile(pattern),
+        # For text whose lowercase form has a different length (e.g. "İ"), so
+        # offsets have to come from the original text
+        "pattern_ignorecase": re.compile(pattern, re.IGNORECASE),
+        "owners": owners,
+        "contained": contained,
+        "credited": credited,
+        "keywords": {keyword.casefold(): keyword for keyword in owners},
+    }
+
+
+def load_table(path=CATEGORIES_PATH):
+    """
+    The keyword table from path if it exists, otherwise DEFAULT_CATEGORIES.
+    """
+    if not os.path.exists(path):
+        return DEFAULT_CATEGORIES
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def reload(path=CATEGORIES_PATH):
+    """
+    Re-read and compile the keyword table. The previous table stays in use if the
+    new one is invalid (ValueError) or unreadable.
+    """
+    global _compiled
+    compiled = compile_table(load_table(path))
+    with _lock:
+        _compiled = compiled
+    return compiled["table"]
+
+
+def get_compiled():
+    global _compiled
+    with _lock:
+        if _compiled is None:
+            _compiled = compile_table(load_table())
+        return _compiled
+
+
+def categorize(text, compiled=None, with_matches=True):
+    """
+    Find every keyword occurrence in one pass. Returns
+    {"categories": {category: keyword}, "scores": {category: matches}, "matches": [...]},
+    where categories holds each category's highest-priority keyword found (what
+    categorize_text returns) and matches are {"category", "keyword", "start", "end"}
+    with offsets into text. with_matches=False skips building the match list.
+    """
+    compiled = compiled or get_compiled()
+    text = text or ""
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        pattern, text = compiled["pattern"], lowered
+    else:
+        pattern = compiled["pattern_ignorecase"]
+
+    matches = []
+    if with_matches:
+        counts = Counter()
+        for match in pattern.finditer(text):
+            keyword = compiled["keywords"].get(match.group(1).casefold())
+            if keyword is None:
+                continue
+            counts[keyword] += 1
+            for category in compiled["owners"][keyword]:
+                matches.append({"category": category, "keyword": keyword, "start": match.start(), "end": match.end(1)})
+    else:
+        counts = Counter(compiled["keywords"].get(found.casefold()) for found in pattern.findall(text))
+        counts.pop(None, None)
+
+    found = set()
+    scores = {}
+    for keyword, count in counts.items():
+        found.update(compiled["contained"][keyword])
+        for category in compiled["credited"][keyword]:
+            scores[category] = scores.get(category, 0) + count
+    categories = {}
+    for category, keywords in compiled["table"].items():
         for keyword in keywords:
-            if keyword.lower() in text.lower():
-                results[category] = keyword
+            if keyword in found:
+                categories[category] = keyword
                 break
-    return results
\ No newline at end of file
+    return {"categories": categories, "scores": scores, "matches": matches}
+
+
+def categorize_text(text):
+    """
+    {category: keyword} for the categories mentioned in text, each with the first
+    of its keywords (in table order) that occurs.
+    """
+    return categorize(text, with_matches=False)["categories"]
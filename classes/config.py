@@ -0,0 +1,79 @@
+import os
+
+# Root directory served by the image server (mounted as a volume in docker-compose.yml)
+IMAGE_DIR = os.environ.get("IMAGE_DIR", "/images")
+
+# SQLite file backing the image catalog. Dotfiles in IMAGE_DIR are never catalogued.
+CATALOG_PATH = os.environ.get("CATALOG_PATH", os.path.join(IMAGE_DIR, ".catalog.sqlite3"))
+
+# How often (in seconds) the catalog is reconciled against the filesystem
+CATALOG_RECONCILE_SECONDS = int(os.environ.get("CATALOG_RECONCILE_SECONDS", "300"))
+
+# Content-addressed cache of OCR results (see classes/ocr_cache.py)
+OCR_CACHE_PATH = os.environ.get("OCR_CACHE_PATH", os.path.join(IMAGE_DIR, ".ocr_cache.sqlite3"))
+OCR_CACHE_MAX_BYTES = int(os.environ.get("OCR_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Worker pools (see classes/workers.py). CPU-bound OpenCV/Tesseract work runs in
+# CPU_WORKERS processes; once MAX_QUEUED_TASKS more are waiting, requests get a 503.
+CPU_WORKERS = int(os.environ.get("CPU_WORKERS", str(os.cpu_count() or 1)))
+IO_WORKERS = int(os.environ.get("IO_WORKERS", str(min(32, (os.cpu_count() or 1) + 4))))
+MAX_QUEUED_TASKS = int(os.environ.get("MAX_QUEUED_TASKS", str(2 * CPU_WORKERS)))
+# OpenMP threads per Tesseract/OpenCV call; keeps N workers from oversubscribing N cores
+OMP_THREADS_PER_WORKER = int(os.environ.get("OMP_THREADS_PER_WORKER", "1"))
+
+# Background OCR jobs (see classes/jobs.py and ocr_routes.py)
+JOBS_PATH = os.environ.get("JOBS_PATH", os.path.join(IMAGE_DIR, ".jobs.sqlite3"))
+OCR_JOB_CONCURRENCY = int(os.environ.get("OCR_JOB_CONCURRENCY", str(CPU_WORKERS)))
+OCR_JOB_MAX_ATTEMPTS = int(os.environ.get("OCR_JOB_MAX_ATTEMPTS", "3"))
+# Images OCR'd at once by all /ocr/batch requests together; the rest of the workers
+# and the queue stay free for interactive requests
+OCR_BATCH_CPU_SLOTS = int(os.environ.get("OCR_BATCH_CPU_SLOTS", str(max(1, CPU_WORKERS - 1))))
+
+# Named preprocessing pipeline presets registered through /presets
+PRESETS_PATH = os.environ.get("PRESETS_PATH", os.path.join(IMAGE_DIR, ".presets.json"))
+
+# Thumbnail/rendition disk cache (see classes/thumbnails.py)
+THUMB_CACHE_DIR = os.environ.get("THUMB_CACHE_DIR", os.path.join(IMAGE_DIR, ".thumbs"))
+THUMB_CACHE_MAX_BYTES = int(os.environ.get("THUMB_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Resumable upload sessions (see upload_images.py). Chunks are staged here until
+# the session is committed; sessions untouched for UPLOAD_SESSION_TTL_SECONDS are purged.
+UPLOAD_SESSION_DIR = os.environ.get("UPLOAD_SESSION_DIR", os.path.join(IMAGE_DIR, ".uploads"))
+UPLOAD_SESSION_TTL_SECONDS = int(os.environ.get("UPLOAD_SESSION_TTL_SECONDS", str(24 * 60 * 60)))
+UPLOAD_MAX_CHUNK_BYTES = int(os.environ.get("UPLOAD_MAX_CHUNK_BYTES", str(64 * 1024 * 1024)))
+# A commit lock older than this was left by a crashed commit and is ignored
+UPLOAD_COMMIT_TIMEOUT_SECONDS = int(os.environ.get("UPLOAD_COMMIT_TIMEOUT_SECONDS", "600"))
+
+# Browser caching of files served under /images (see classes/static_files.py)
+IMAGE_MAX_AGE_SECONDS = int(os.environ.get("IMAGE_MAX_AGE_SECONDS", "3600"))
+
+# Annotation store (see classes/annotations.py). The legacy annotations.json is
+# imported once; the WAL is checkpointed every ANNOTATIONS_COMPACT_SECONDS.
+ANNOTATIONS_PATH = os.environ.get("ANNOTATIONS_PATH", os.path.join(IMAGE_DIR, ".annotations.sqlite3"))
+LEGACY_ANNOTATIONS_PATH = os.path.join(IMAGE_DIR, "annotations.json")
+ANNOTATIONS_COMPACT_SECONDS = int(os.environ.get("ANNOTATIONS_COMPACT_SECONDS", "600"))
+
+# OCR backend (see classes/ocr_engine.py): "auto" uses tesserocr when it is installed
+# and falls back to pytesseract, "tesserocr" or "pytesseract" force one of them.
+OCR_ENGINE = os.environ.get("OCR_ENGINE", "auto")
+# Directory holding *.traineddata for tesserocr (default: libtesseract's built-in path)
+TESSDATA_DIR = os.environ.get("TESSDATA_DIR")
+
+# Adaptive OCR scaling (see classes/preprocess.py): images are resized so the median
+# glyph (roughly the x-height) is about OCR_TARGET_GLYPH_HEIGHT pixels tall, and never
+# beyond OCR_MAX_PIXELS.
+OCR_TARGET_GLYPH_HEIGHT = int(os.environ.get("OCR_TARGET_GLYPH_HEIGHT", "24"))
+OCR_MAX_PIXELS = int(os.environ.get("OCR_MAX_PIXELS", str(25_000_000)))
+
+# Memory ceiling for one OCR request (see classes/tiling.py). Images whose estimated
+# working set exceeds it are decoded straight to grayscale and processed in horizontal
+# strips; requests that would not fit even then are rejected with a 413.
+OCR_MEMORY_LIMIT_BYTES = int(os.environ.get("OCR_MEMORY_LIMIT_BYTES", str(1024 * 1024 * 1024)))
+
+# Keyword table for categorising OCR text (see classes/categorize.py): a JSON object
+# of category -> keywords. Without the file the built-in table is used.
+CATEGORIES_PATH = os.environ.get("CATEGORIES_PATH", os.path.join(IMAGE_DIR, ".categories.json"))
+
+# Logging (see classes/logs.py): "json" writes one JSON object per line, "text" plain lines
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
@@ -0,0 +1,181 @@
+import json
+import threading
+import time
+import uuid
+from classes.catalog import connect
+from classes.config import JOBS_PATH
+
+# A small durable job queue in SQLite. Jobs survive restarts: anything left
+# "running" by a previous process is put back in the queue on startup.
+
+_lock = threading.RLock()
+_conn = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    result TEXT,
+    error TEXT,
+    available_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_queued ON jobs (status, available_at, created_at);
+"""
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+def get_connection():
+    global _conn
+    with _lock:
+        if _conn is None:
+            _conn = connect(JOBS_PATH)
+            _conn.executescript(SCHEMA)
+        return _conn
+
+
+def recover():
+    """
+    Requeue jobs that were running when the previous process stopped.
+    """
+    with _lock:
+        get_connection().execute(
+            "UPDATE jobs SET status = ?, updated_at = ? WHERE status = ?",
+            (QUEUED, time.time(), RUNNING),
+        )
+
+
+def enqueue(kind, params, max_attempts):
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    with _lock:
+        get_connection().execute(
+            """
+            INSERT INTO jobs (id, kind, params, status, max_attempts, available_at, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (job_id, kind, json.dumps(params), QUEUED, max_attempts, now, now, now),
+        )
+    return job_id
+
+
+def claim():
+    """
+    Mark the oldest runnable job as running and return it, or None if the queue is empty.
+    """
+    now = time.time()
+    with _lock:
+        conn = get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                """
+                SELECT * FROM jobs WHERE status = ? AND available_at <= ?
+                ORDER BY available_at, created_at LIMIT 1
+                """,
+                (QUEUED, now),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (RUNNING, now, row["id"]),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    if row is None:
+        return None
+    job = to_response(row)
+    job["attempts"] += 1
+    return job
+
+
+def set_progress(job_id, progress):
+    with _lock:
+        get_connection().execute(
+            "UPDATE jobs SET progress = ?, updated_at = ? WHERE id = ?", (progress, time.time(), job_id)
+        )
+
+
+def succeed(job_id, result):
+    with _lock:
+        get_connection().execute(
+            "UPDATE jobs SET status = ?, progress = 1, result = ?, error = NULL, updated_at = ? WHERE id = ?",
+            (SUCCEEDED, json.dumps(result), time.time(), job_id),
+        )
+
+
+def fail(job_id, error, retry_delay=None):
+    """
+    Record a failed attempt. The job is requeued after retry_delay seconds
+    unless it has used up its attempts (or retry_delay is None).
+    """
+    now = time.time()
+    with _lock:
+        conn = get_connection()
+        row = conn.execute("SELECT attempts, max_attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return
+        if retry_delay is not None and row["attempts"] < row["max_attempts"]:
+            conn.execute(
+                "UPDATE jobs SET status = ?, progress = 0, error = ?, available_at = ?, updated_at = ? WHERE id = ?",
+                (QUEUED, error, now + retry_delay, now, job_id),
+            )
+        else:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                (FAILED, error, now, job_id),
+            )
+
+
+def release(job_id, delay):
+    """
+    Put a claimed job back in the queue without counting the attempt (e.g. the pool was full).
+    """
+    now = time.time()
+    with _lock:
+        get_connection().execute(
+            """
+            UPDATE jobs SET status = ?, progress = 0, attempts = attempts - 1, available_at = ?, updated_at = ?
+            WHERE id = ?
+            """,
+            (QUEUED, now + delay, now, job_id),
+        )
+
+
+def get(job_id):
+    with _lock:
+        row = get_connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return to_response(row) if row is not None else None
+
+
+def queue_depth():
+    with _lock:
+        return get_connection().execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+
+
+def to_response(row):
+    return {
+        "job_id": row["id"],
+        "kind": row["kind"],
+        "params": json.loads(row["params"]),
+        "status": row["status"],
+        "progress": row["progress"],
+        "attempts": row["attempts"],
+        "max_attempts": row["max_attempts"],
+        "result": json.loads(row["result"]) if row["result"] else None,
+        "error": row["error"],
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+    }
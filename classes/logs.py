@@ -0,0 +1,44 @@
+import json
+import logging
+from classes.config import LOG_FORMAT, LOG_LEVEL
+
+# Structured logging to stderr. In the default json format every record is one
+# JSON object; fields passed as extra={...} become keys next to the message, e.g.
+#   logger.warning("Failed to index OCR text", extra={"path": image_path, "error": str(e)})
+
+ROOT_LOGGER = "image_server"
+# Attributes every LogRecord has; anything else on a record came from extra=
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_FIELDS)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure():
+    root = logging.getLogger(ROOT_LOGGER)
+    if root.handlers:
+        return
+    handler = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+
+
+def get_logger(name):
+    configure()
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
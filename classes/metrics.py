@@ -0,0 +1,245 @@
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# In-process metrics rendered in the Prometheus text format by /metrics, plus the
+# per-request stage timings sent back in the Server-Timing header.
+#
+# Stages that run in the CPU worker processes (decode, preprocess.<step>, ocr,
+# encode, write) cannot update this process's registry, so there they are
+# appended to a log that workers.run_cpu ships back with the result and replays
+# here. Bytes read from and written to disk travel the same way.
+
+PREFIX = "image_server_"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# name -> (type, help, buckets)
+METRICS = {
+    "http_request_duration_seconds": ("histogram", "Request latency by route, method and status", LATENCY_BUCKETS),
+    "http_request_bytes_total": ("counter", "Request body bytes received, by route", None),
+    "http_response_bytes_total": ("counter", "Response body bytes sent, by route", None),
+    "stage_duration_seconds": ("histogram", "Time spent per processing stage", LATENCY_BUCKETS),
+    "disk_read_bytes_total": ("counter", "Bytes read from disk, by stage", None),
+    "disk_written_bytes_total": ("counter", "Bytes written to disk, by stage", None),
+}
+
+_lock = threading.Lock()
+# (name, labels) -> value, and (name, labels) -> [count per bucket..., +Inf count, sum]
+_counters = {}
+_histograms = {}
+# name -> (type, help, callback returning a number or {labels: number}); read at scrape time
+_callbacks = {}
+
+# Stage timings of the current request, for Server-Timing (set by MetricsMiddleware)
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+# Set while a worker process runs a task for workers.run_cpu
+_worker_log = None
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name, value, **labels):
+    buckets = METRICS[name][2]
+    key = (name, _labels(labels))
+    with _lock:
+        counts = _histograms.get(key)
+        if counts is None:
+            counts = _histograms[key] = [0] * (len(buckets) + 2)
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        else:
+            counts[len(buckets)] += 1
+        counts[-1] += value
+
+
+def register(name, metric_type, help_text, callback):
+    """
+    Expose a value owned by another module (a queue length, cache statistics);
+    callback returns a number or {(("label", "value"), ...): number}.
+    """
+    _callbacks[name] = (metric_type, help_text, callback)
+
+
+def record_stage(stage, seconds):
+    if _worker_log is not None:
+        _worker_log.append(("stage", stage, seconds))
+        return
+    observe("stage_duration_seconds", seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+def record_bytes(direction, stage, size):
+    """
+    Count bytes read from ("read") or written to ("written") disk by a stage.
+    """
+    if _worker_log is not None:
+        _worker_log.append((direction, stage, size))
+        return
+    inc(f"disk_{direction}_bytes_total", size, stage=stage)
+
+
+@contextmanager
+def stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def call_with_log(fn, submitted, *args, **kwargs):
+    """
+    Run fn in a worker process and return (result, log) where log holds the
+    stages and disk traffic recorded while it ran, including the time the task
+    spent queued since submitted (a time.time() taken by the parent).
+    """
+    global _worker_log
+    _worker_log = [("stage", "queue", max(0.0, time.time() - submitted))]
+    try:
+        return fn(*args, **kwargs), _worker_log
+    finally:
+        _worker_log = None
+
+
+def replay(log):
+    """
+    Record a worker's log in this process (and the current request's timings).
+    """
+    for kind, name, value in log:
+        if kind == "stage":
+            record_stage(name, value)
+        else:
+            record_bytes(kind, name, value)
+
+
+def server_timing(timings, total):
+    """
+    Server-Timing header value: each stage's total duration, then the whole request.
+    """
+    durations = {}
+    for stage_name, seconds in timings:
+        durations[stage_name] = durations.get(stage_name, 0.0) + seconds
+    entries = [f"{stage_name};dur={seconds * 1000:.1f}" for stage_name, seconds in durations.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """
+    All metrics in the Prometheus text exposition format (version 0.0.4).
+    """
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: list(counts) for key, counts in _histograms.items()}
+    lines = []
+    for name, (metric_type, help_text, buckets) in METRICS.items():
+        full_name = PREFIX + name
+        lines.append(f"# HELP {full_name} {help_text}")
+        lines.append(f"# TYPE {full_name} {metric_type}")
+        if metric_type == "counter":
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{full_name}{_format_labels(labels)} {_format_value(value)}")
+            continue
+        for (metric, labels), counts in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + (math.inf,), counts):
+                cumulative += count
+                bucket_labels = labels + (("le", _format_value(bound)),)
+                lines.append(f"{full_name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+            lines.append(f"{full_name}_sum{_format_labels(labels)} {_format_value(counts[-1])}")
+            lines.append(f"{full_name}_count{_format_labels(labels)} {cumulative}")
+
+    for name, (metric_type, help_text, callback) in _callbacks.items():
+        full_name = PREFIX + name
+        try:
+            values = callback()
+        except Exception:
+            continue
+        if not isinstance(values, dict):
+            values = {(): values}
+        lines.append(f"# HELP {full_name} {help_text}")
+        lines.append(f"# TYPE {full_name} {metric_type}")
+        for labels, value in values.items():
+            lines.append(f"{full_name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording per-route latency and body sizes, and adding a
+    Server-Timing header with the stages timed while handling the request.
+    Routes are labelled by their path template, so path parameters don't
+    create new series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        timings = []
+        token = _request_timings.set(timings)
+        state = {"status": 500, "received": 0, "sent": 0}
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                state["received"] += len(message.get("body", b""))
+            return message
+
+        async def timing_send(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                header = server_timing(timings, time.perf_counter() - started)
+                message = {**message, "headers": [*message.get("headers", []), (b"server-timing", header.encode("latin-1"))]}
+            elif message["type"] == "http.response.body":
+                state["sent"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, timing_send)
+        finally:
+            _request_timings.reset(token)
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            observe(
+                "http_request_duration_seconds", time.perf_counter() - started,
+                route=route, method=scope["method"], status=str(state["status"]),
+            )
+            inc("http_request_bytes_total", state["received"], route=route)
+            inc("http_response_bytes_total", state["sent"], route=route)
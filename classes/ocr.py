@@ -0,0 +1,313 @@
+import cv2
+import numpy as np
+import os
+from datetime import datetime
+from PIL import Image
+from classes import metrics, ocr_engine, tiling
+from classes.preprocess import preprocess_image, enhance_for_ocr, clean_text, read_image, write_image
+from classes.pipeline import load_with_plan
+
+# These functions run inside the worker processes started by classes/workers.py,
+# so they take and return plain picklable values and never touch the catalog or caches.
+
+
+def structure_from_data(data, scale_x=1.0, scale_y=1.0):
+    """
+    Derive words, lines and text from one image_to_data result. Coordinates are
+    divided by the scale so they refer to the source image, not the processed one.
+    Returns {"text", "words", "lines"}; text is cleaned like before.
+    """
+    words = []
+    lines = {}
+    for i, word in enumerate(data["text"]):
+        word = str(word).strip()
+        conf = float(data["conf"][i])
+        if not word or conf < 0:
+            continue
+        x = round(data["left"][i] / scale_x)
+        y = round(data["top"][i] / scale_y)
+        right = round((data["left"][i] + data["width"][i]) / scale_x)
+        bottom = round((data["top"][i] + data["height"][i]) / scale_y)
+        block, par, line = int(data["block_num"][i]), int(data["par_num"][i]), int(data["line_num"][i])
+        words.append({
+            "text": word, "conf": conf, "x": x, "y": y, "width": right - x, "height": bottom - y,
+            "block": block, "par": par, "line": line,
+        })
+        key = (block, par, line)
+        if key in lines:
+            entry = lines[key]
+            entry["words"].append(word)
+            entry["confs"].append(conf)
+            entry["box"] = [min(entry["box"][0], x), min(entry["box"][1], y),
+                            max(entry["box"][2], right), max(entry["box"][3], bottom)]
+        else:
+            lines[key] = {"words": [word], "confs": [conf], "box": [x, y, right, bottom]}
+
+    line_list = []
+    paragraphs = []
+    previous = None
+    for (block, par, line), entry in lines.items():
+        x0, y0, x1, y1 = entry["box"]
+        text = " ".join(entry["words"])
+        line_list.append({
+            "text": text, "conf": round(sum(entry["confs"]) / len(entry["confs"]), 2),
+            "x": x0, "y": y0, "width": x1 - x0, "height": y1 - y0,
+            "block": block, "par": par, "line": line,
+        })
+        if (block, par) != previous:
+            paragraphs.append([])
+            previous = (block, par)
+        paragraphs[-1].append(text)
+    raw_text = "\n\n".join("\n".join(paragraph) for paragraph in paragraphs)
+    return {"text": clean_text(raw_text), "words": words, "lines": line_list}
+
+
+def ocr_image(image_path, image_name, processed_dir, lang="eng", extract_text=True, plan=None, tiled=None):
+    """
+    Preprocess an image, save the processed copy and (optionally) run Tesseract on it.
+    plan is a compiled preset (see classes/presets.py); without one preprocess_image is used.
+    A single recognition pass yields the text, word boxes with confidences and lines.
+    Images too large to process within OCR_MEMORY_LIMIT_BYTES are processed and OCR'd
+    in strips (see classes/tiling.py); tiled forces either mode.
+    scale is the processed width over the source width (see enhance_for_ocr).
+    Returns {"text", "words", "lines", "scale", "processed_image_name", "processed_image_path"}.
+    """
+    # Save the processed image with a timestamp
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    processed_image_name = f"processed_{timestamp}_{image_name}"
+    processed_image_path = os.path.join(processed_dir, processed_image_name)
+
+    try:
+        tiled = tiling.needs_tiling(image_path, plan, tiled)
+    except tiling.ImageTooLarge:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"Failed to preprocess the image: {str(e)}")
+
+    if tiled:
+        try:
+            data, (source_width, source_height), (processed_width, processed_height) = tiling.ocr_tiled(
+                image_path, processed_image_path, lang, extract_text, plan
+            )
+        except tiling.ImageTooLarge:
+            raise
+        except Exception as e:
+            raise RuntimeError(f"Failed to process the image in strips: {str(e)}")
+        result = {"text": None, "words": None, "lines": None}
+        if data is not None:
+            result = structure_from_data(data, processed_width / source_width, processed_height / source_height)
+        return {
+            **result,
+            "scale": round(processed_width / source_width, 4),
+            "processed_image_name": processed_image_name,
+            "processed_image_path": processed_image_path,
+        }
+
+    # Preprocess the image
+    try:
+        if plan is None:
+            image = preprocess_image(image_path)
+            processed_width, processed_height = image.size
+        else:
+            image = load_with_plan(image_path, plan)
+            processed_height, processed_width = image.shape[:2]
+        with Image.open(image_path) as source:
+            source_width, source_height = source.size
+    except Exception as e:
+        raise RuntimeError(f"Failed to preprocess the image: {str(e)}")
+
+    # Perform OCR
+    result = {"text": None, "words": None, "lines": None}
+    if extract_text:
+        try:
+            data = ocr_engine.image_to_data(image, lang=lang)
+            result = structure_from_data(
+                data, processed_width / source_width, processed_height / source_height
+            )
+        except Exception as e:
+            raise RuntimeError(f"Failed to perform OCR: {str(e)}")
+
+    # Ensure the processed directory exists
+    os.makedirs(processed_dir, exist_ok=True)
+
+    # Save the processed image
+    try:
+        write_image(processed_image_path, image)
+    except Exception as e:
+        raise RuntimeError(f"Failed to save the processed image: {str(e)}")
+
+    return {
+        **result,
+        "scale": round(processed_width / source_width, 4),
+        "processed_image_name": processed_image_name,
+        "processed_image_path": processed_image_path,
+    }
+
+
+BOX_LEVELS = ("word", "line", "block")
+# Fast PNG encoding for overlays: they are throwaway previews, not archival copies
+OVERLAY_PNG_COMPRESSION = 1
+
+
+def select_boxes(words, min_conf=80, level="word"):
+    """
+    Keep the words (as stored by ocr_image) with confidence above min_conf and, for
+    level "line" or "block", merge the survivors into one box per line or block.
+    Works on NumPy arrays rather than per-word Python.
+    Returns (boxes as an (N, 4) int array of x0, y0, x1, y1, confidences).
+    """
+    if not words:
+        return np.empty((0, 4), dtype=np.int32), np.empty(0)
+    conf = np.fromiter((word["conf"] for word in words), dtype=np.float64, count=len(words))
+    fields = ("x", "y", "width", "height", "block", "par", "line")
+    table = np.array([[word[field] for field in fields] for word in words], dtype=np.int64)
+    # Same test as the original int(conf) > 80: a word at 80.7 is not above 80
+    mask = np.trunc(conf) > min_conf
+    conf, table = conf[mask], table[mask]
+    boxes = np.column_stack((table[:, 0], table[:, 1], table[:, 0] + table[:, 2], table[:, 1] + table[:, 3]))
+    if level == "word" or not len(boxes):
+        return boxes.astype(np.int32), conf
+
+    keys = table[:, 4:7] if level == "line" else table[:, 4:5]
+    _, groups = np.unique(keys, axis=0, return_inverse=True)
+    groups = groups.ravel()
+    count = groups.max() + 1
+    merged = np.empty((count, 4), dtype=np.int64)
+    merged[:, :2] = np.iinfo(np.int64).max
+    merged[:, 2:] = np.iinfo(np.int64).min
+    np.minimum.at(merged[:, 0], groups, boxes[:, 0])
+    np.minimum.at(merged[:, 1], groups, boxes[:, 1])
+    np.maximum.at(merged[:, 2], groups, boxes[:, 2])
+    np.maximum.at(merged[:, 3], groups, boxes[:, 3])
+    merged_conf = np.bincount(groups, weights=conf) / np.bincount(groups)
+    return merged.astype(np.int32), merged_conf
+
+
+def boxes_to_json(boxes, conf):
+    return [
+        {"x": int(x0), "y": int(y0), "width": int(x1 - x0), "height": int(y1 - y0), "conf": round(float(c), 2)}
+        for (x0, y0, x1, y1), c in zip(boxes.tolist(), conf.tolist())
+    ]
+
+
+def draw_bounding_boxes(image_path, output_image_path, words, min_conf=80, level="word"):
+    """
+    Draw boxes around confidently recognised words (the "words" of an ocr_image
+    result, in source image coordinates), or around their lines or blocks, and save
+    the result. No OCR happens here. Returns the number of boxes drawn.
+    """
+    # Load the image
+    try:
+        image = read_image(image_path)
+    except ValueError:
+        raise RuntimeError("Failed to load the image")
+
+    # Draw every bounding box in one call
+    boxes, _ = select_boxes(words, min_conf, level)
+    if len(boxes):
+        x0, y0, x1, y1 = boxes.T
+        polygons = np.stack([np.column_stack(corner) for corner in ((x0, y0), (x1, y0), (x1, y1), (x0, y1))], axis=1)
+        cv2.polylines(image, polygons, True, (0, 255, 0), 2)
+
+    # Save the image with bounding boxes
+    params = []
+    if output_image_path.lower().endswith(".png"):
+        params = [cv2.IMWRITE_PNG_COMPRESSION, OVERLAY_PNG_COMPRESSION]
+    try:
+        write_image(output_image_path, image, params)
+    except Exception:
+        raise RuntimeError("Failed to save the image")
+    return len(boxes)
+
+
+# Page segmentation modes used for regions: a single line, a single word, or a
+# uniform block of text (Tesseract's --psm 7, 8 and 6)
+PSM_SINGLE_LINE = 7
+PSM_SINGLE_WORD = 8
+PSM_BLOCK = 6
+# Regions at most this tall (in source pixels) are treated as one line of text
+MAX_LINE_HEIGHT = 80
+# Pixels of margin added around each region; Tesseract misreads glyphs touching the edge
+REGION_PADDING = 4
+
+
+def choose_psm(width, height):
+    """
+    Pick a page segmentation mode from a region's shape.
+    """
+    if height <= MAX_LINE_HEIGHT:
+        return PSM_SINGLE_LINE if width >= 2 * height else PSM_SINGLE_WORD
+    return PSM_BLOCK
+
+
+def detect_text_regions(image_path):
+    """
+    Find line-shaped text regions with OpenCV alone (no Tesseract pass): binarize,
+    smear neighbouring glyphs together horizontally and take the bounding boxes of
+    the resulting blobs. Returns [{"x", "y", "width", "height"}].
+    """
+    try:
+        gray = read_image(image_path, cv2.IMREAD_GRAYSCALE)
+    except ValueError:
+        raise RuntimeError("Failed to load the image")
+    height, width = gray.shape
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    # Dark text on a light background is the common case; flip if the page is mostly "ink"
+    if cv2.countNonZero(binary) > binary.size // 2:
+        binary = cv2.bitwise_not(binary)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(9, width // 80), 3))
+    smeared = cv2.dilate(binary, kernel, iterations=1)
+    contours, _ = cv2.findContours(smeared, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    regions = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        # Skip specks and blobs covering most of the image (borders, photos)
+        if w < 8 or h < 8 or w * h > 0.9 * width * height:
+            continue
+        regions.append([x, y, x + w, y + h])
+
+    # Join blobs on the same line separated by less than a line height (word gaps)
+    regions.sort(key=lambda box: (box[0], box[1]))
+    lines = []
+    for box in regions:
+        for line in lines:
+            overlap = min(line[3], box[3]) - max(line[1], box[1])
+            if overlap > 0.5 * min(line[3] - line[1], box[3] - box[1]) and box[0] - line[2] <= line[3] - line[1]:
+                line[:] = [min(line[0], box[0]), min(line[1], box[1]), max(line[2], box[2]), max(line[3], box[3])]
+                break
+        else:
+            lines.append(box)
+    return [{"x": int(x0), "y": int(y0), "width": int(x1 - x0), "height": int(y1 - y0)} for x0, y0, x1, y1 in lines]
+
+
+def ocr_regions(image_path, regions, lang="eng"):
+    """
+    Decode the image once, then crop, enhance and OCR each region with its own --psm.
+    Returns the regions with "psm", "scale" and "text" added.
+    """
+    try:
+        with metrics.stage("decode"):
+            image = Image.open(image_path)
+            image.load()
+        metrics.record_bytes("read", "decode", os.path.getsize(image_path))
+    except Exception as e:
+        raise RuntimeError(f"Failed to load the image: {str(e)}")
+
+    results = []
+    for region in regions:
+        x, y, w, h = region["x"], region["y"], region["width"], region["height"]
+        box = (
+            max(0, x - REGION_PADDING),
+            max(0, y - REGION_PADDING),
+            min(image.width, x + w + REGION_PADDING),
+            min(image.height, y + h + REGION_PADDING),
+        )
+        psm = region.get("psm") or choose_psm(w, h)
+        try:
+            crop = image.crop(box)
+            enhanced = enhance_for_ocr(crop)
+            text = clean_text(ocr_engine.image_to_string(enhanced, lang=lang, psm=psm))
+        except Exception as e:
+            raise RuntimeError(f"Failed to perform OCR: {str(e)}")
+        results.append({**region, "psm": psm, "scale": round(enhanced.width / crop.width, 4), "text": text})
+    return results
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from classes.config import OCR_CACHE_PATH, OCR_CACHE_MAX_BYTES
+from classes.catalog import connect
+
+# OCR results are cached by what actually determines them: the bytes of the
+# source image, the preprocessing pipeline, the language and the Tesseract
+# config. Renaming or re-uploading an unchanged file therefore still hits.
+
+_lock = threading.RLock()
+_conn = None
+_total_bytes = 0
+stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ocr_cache (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ocr_cache_by_access ON ocr_cache (last_access);
+"""
+
+# Hashing a large scan is not free, so remember hashes per (path, size, mtime)
+_hash_memo = OrderedDict()
+HASH_MEMO_SIZE = 10000
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def get_connection():
+    global _conn, _total_bytes
+    with _lock:
+        if _conn is None:
+            _conn = connect(OCR_CACHE_PATH)
+            _conn.executescript(SCHEMA)
+            _total_bytes = _conn.execute("SELECT COALESCE(SUM(size), 0) FROM ocr_cache").fetchone()[0]
+        return _conn
+
+
+def file_hash(file_path):
+    """
+    Return the SHA-256 of a file's contents, reusing the previous result while
+    the file's size and mtime are unchanged.
+    """
+    stat = os.stat(file_path)
+    memo_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    with _lock:
+        if memo_key in _hash_memo:
+            _hash_memo.move_to_end(memo_key)
+            return _hash_memo[memo_key]
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    content_hash = digest.hexdigest()
+    with _lock:
+        _hash_memo[memo_key] = content_hash
+        if len(_hash_memo) > HASH_MEMO_SIZE:
+            _hash_memo.popitem(last=False)
+    return content_hash
+
+
+def remember_hash(file_path, content_hash):
+    """
+    Seed the hash memo for a file whose hash is already known (e.g. computed during upload).
+    """
+    stat = os.stat(file_path)
+    with _lock:
+        _hash_memo[(os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)] = content_hash
+        if len(_hash_memo) > HASH_MEMO_SIZE:
+            _hash_memo.popitem(last=False)
+
+
+def cache_key(content_hash, pipeline, lang, config=""):
+    return hashlib.sha256("\0".join([content_hash, pipeline, lang, config]).encode("utf-8")).hexdigest()
+
+
+def get(key):
+    """
+    Return the cached value for key, or None on a miss.
+    """
+    conn = get_connection()
+    with _lock:
+        row = conn.execute("SELECT value FROM ocr_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            stats["misses"] += 1
+            return None
+        conn.execute("UPDATE ocr_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+        stats["hits"] += 1
+    return json.loads(row["value"])
+
+
+def put(key, value):
+    """
+    Store a JSON-serialisable value, evicting least recently used entries
+    until the cache fits in OCR_CACHE_MAX_BYTES.
+    """
+    global _total_bytes
+    blob = json.dumps(value)
+    conn = get_connection()
+    with _lock:
+        previous = conn.execute("SELECT size FROM ocr_cache WHERE key = ?", (key,)).fetchone()
+        conn.execute(
+            "INSERT OR REPLACE INTO ocr_cache (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+            (key, blob, len(blob), time.time()),
+        )
+        _total_bytes += len(blob) - (previous["size"] if previous else 0)
+        if _total_bytes > OCR_CACHE_MAX_BYTES:
+            _evict(conn)
+
+
+def _evict(conn):
+    global _total_bytes
+    rows = conn.execute("SELECT key, size FROM ocr_cache ORDER BY last_access")
+    evicted = []
+    for row in rows:
+        if _total_bytes <= OCR_CACHE_MAX_BYTES:
+            break
+        evicted.append((row["key"],))
+        _total_bytes -= row["size"]
+    conn.executemany("DELETE FROM ocr_cache WHERE key = ?", evicted)
+    stats["evictions"] += len(evicted)
+
+
+def lookup(file_path, pipeline, lang, config=""):
+    """
+    Convenience wrapper: hash file_path and look up its cached result.
+    Returns (key, value) so a miss can be filled with put(key, ...).
+    """
+    key = cache_key(file_hash(file_path), pipeline, lang, config)
+    return key, get(key)
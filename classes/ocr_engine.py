@@ -0,0 +1,152 @@
+import atexit
+import threading
+import numpy as np
+import pytesseract
+from PIL import Image
+from classes import logs, metrics
+from classes.config import OCR_ENGINE, TESSDATA_DIR
+
+# One interface over two Tesseract backends:
+# - tesserocr keeps initialised TessBaseAPI handles (one per language and page
+#   segmentation mode) alive for the lifetime of the worker process and hands
+#   image buffers to libtesseract directly,
+# - pytesseract starts /usr/bin/tesseract for every call, which writes the image
+#   to a temp file and reloads the traineddata each time.
+# tesserocr is optional; without it, or if it cannot load a language, calls fall
+# back to pytesseract.
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+logger = logs.get_logger(__name__)
+
+# Set the Tesseract executable path (optional if installed in the default path)
+pytesseract.pytesseract.tesseract_cmd = "/usr/bin/tesseract"
+
+# Tesseract's own default page segmentation mode (fully automatic)
+DEFAULT_PSM = 3
+DATA_COLUMNS = (
+    "level", "page_num", "block_num", "par_num", "line_num", "word_num",
+    "left", "top", "width", "height", "conf", "text",
+)
+
+# (lang, psm) -> (api, lock), kept per worker process
+_handles = {}
+_handles_lock = threading.Lock()
+# (lang, psm) combinations tesserocr failed to initialise
+_unavailable = set()
+
+
+def backend(lang="eng", psm=None):
+    """
+    Name of the backend that will serve a call for this language and psm.
+    """
+    if OCR_ENGINE == "pytesseract" or tesserocr is None:
+        return "pytesseract"
+    if OCR_ENGINE == "auto" and (lang, psm or DEFAULT_PSM) in _unavailable:
+        return "pytesseract"
+    return "tesserocr"
+
+
+def _handle(lang, psm):
+    key = (lang, psm)
+    with _handles_lock:
+        if key not in _handles:
+            kwargs = {"lang": lang, "psm": psm}
+            if TESSDATA_DIR:
+                kwargs["path"] = TESSDATA_DIR
+            _handles[key] = (tesserocr.PyTessBaseAPI(**kwargs), threading.Lock())
+        return _handles[key]
+
+
+def _set_image(api, image):
+    if isinstance(image, Image.Image):
+        api.SetImage(image)
+        return
+    image = np.ascontiguousarray(image)
+    if image.ndim == 2:
+        api.SetImageBytes(image.tobytes(), image.shape[1], image.shape[0], 1, image.strides[0])
+    else:
+        # OpenCV images are BGR; libtesseract expects RGB
+        rgb = np.ascontiguousarray(image[:, :, 2::-1])
+        api.SetImageBytes(rgb.tobytes(), rgb.shape[1], rgb.shape[0], 3, rgb.strides[0])
+
+
+def _run_tesserocr(image, lang, psm, read):
+    psm = psm or DEFAULT_PSM
+    if (lang, psm) in _unavailable:
+        return None
+    try:
+        api, lock = _handle(lang, psm)
+    except RuntimeError as e:
+        if OCR_ENGINE == "tesserocr":
+            raise
+        logger.warning("tesserocr could not load the language, using pytesseract", extra={"lang": lang, "error": str(e)})
+        _unavailable.add((lang, psm))
+        return None
+    with lock:
+        _set_image(api, image)
+        return read(api)
+
+
+def _pytesseract_config(psm):
+    return f"--psm {psm}" if psm else ""
+
+
+def parse_tsv(tsv):
+    """
+    Turn Tesseract TSV output (without a header row) into pytesseract's Output.DICT shape.
+    """
+    data = {column: [] for column in DATA_COLUMNS}
+    for line in tsv.splitlines():
+        values = line.split("\t")
+        if len(values) < len(DATA_COLUMNS) - 1:
+            continue
+        values += [""] * (len(DATA_COLUMNS) - len(values))
+        for column, value in zip(DATA_COLUMNS, values):
+            if column == "text":
+                data[column].append(value)
+            elif column == "conf":
+                data[column].append(float(value))
+            else:
+                data[column].append(int(value))
+    return data
+
+
+def image_to_string(image, lang="eng", psm=None, engine=None):
+    """
+    Recognise the text in a PIL image or ndarray. engine forces a backend (benchmarks).
+    """
+    with metrics.stage("ocr"):
+        if (engine or backend(lang, psm)) == "tesserocr":
+            text = _run_tesserocr(image, lang, psm, lambda api: api.GetUTF8Text())
+            if text is not None:
+                return text
+        return pytesseract.image_to_string(image, lang=lang, config=_pytesseract_config(psm))
+
+
+def image_to_data(image, lang="eng", psm=None, engine=None):
+    """
+    Word boxes and confidences, in the shape of pytesseract's image_to_data(output_type=DICT).
+    """
+    with metrics.stage("ocr"):
+        if (engine or backend(lang, psm)) == "tesserocr":
+            def read(api):
+                api.Recognize()
+                return parse_tsv(api.GetTSVText(0))
+            data = _run_tesserocr(image, lang, psm, read)
+            if data is not None:
+                return data
+        return pytesseract.image_to_data(
+            image, lang=lang, config=_pytesseract_config(psm), output_type=pytesseract.Output.DICT
+        )
+
+
+@atexit.register
+def _close_handles():
+    with _handles_lock:
+        for api, _ in _handles.values():
+            api.End()
+        _handles.clear()
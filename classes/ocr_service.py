@@ -0,0 +1,238 @@
+import asyncio
+import json
+import os
+from fastapi import HTTPException
+from classes import annotations, catalog, categorize, logs, metrics, ocr_cache, presets, tiling, workers
+from classes.config import CPU_WORKERS, IMAGE_DIR
+from classes.ocr import detect_text_regions, ocr_image, ocr_regions
+from classes.preprocess import PIPELINE_VERSION
+
+# Shared by /ocr and the background OCR job workers: cache lookup, OCR in the
+# process pool, categorisation and indexing of the text for /search.
+
+logger = logs.get_logger(__name__)
+
+
+# Cached /ocr results hold everything derived from the single image_to_data pass;
+# the format goes into the cache key so entries written before it are not reused
+OCR_RESULT_FORMAT = "data:2"
+OCR_RESULT_FIELDS = ("text", "words", "lines", "scale", "processed_image_path")
+# Cache namespace for /ocr/regions; the regions and psm go into the cache key's config
+REGIONS_PIPELINE = "regions:enhance_for_ocr:2"
+REGION_SOURCES = ("auto", "annotations", "detected")
+
+
+def resolve_image_path(image_name, subfolder=None):
+    if subfolder:
+        return os.path.join(IMAGE_DIR, subfolder, image_name)
+    return os.path.join(IMAGE_DIR, image_name)
+
+
+def resolve_plan(preset):
+    """
+    Return the compiled plan for a preset name (None means the built-in preprocess_image).
+    """
+    if preset is None:
+        return None
+    plan = presets.get_plan(preset)
+    if plan is None:
+        raise HTTPException(status_code=404, detail=f"Preset '{preset}' not found")
+    return plan
+
+
+async def run_ocr(image_path, image_name, lang="eng", progress=None, preset=None, include_boxes=False, tiled=None):
+    """
+    OCR one image and return the fields of the /ocr response.
+    progress, if given, is called with a fraction between 0 and 1 as stages finish.
+    preset selects a registered preprocessing pipeline instead of preprocess_image.
+    The text, word boxes and lines all come from one recognition pass and are cached
+    together; include_boxes adds "words" and "lines" to the returned fields.
+    tiled forces (True) or disables (False) strip-wise processing; by default only
+    images that would exceed OCR_MEMORY_LIMIT_BYTES are tiled.
+    """
+    report = progress or (lambda fraction: None)
+    plan = resolve_plan(preset)
+    if tiled and not tiling.tileable(plan):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Preset '{preset}' cannot be tiled; tileable steps are {', '.join(sorted(tiling.TILEABLE_STEPS))}",
+        )
+    pipeline = PIPELINE_VERSION if plan is None else f"plan:{plan['fingerprint']}"
+    # A forced mode gives slightly different results, so it is cached separately
+    result_format = OCR_RESULT_FORMAT if tiled is None else f"{OCR_RESULT_FORMAT}:tiled={tiled}"
+
+    # An unchanged image OCR'd with the same pipeline and language is served from the cache
+    try:
+        with metrics.stage("cache"):
+            cache_key, cached = await workers.run_io(ocr_cache.lookup, image_path, pipeline, lang, result_format)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to read the OCR cache: {str(e)}")
+    report(0.1)
+
+    if cached is not None and os.path.exists(cached["processed_image_path"]):
+        ocr_result = cached
+    else:
+        # Preprocess, OCR and save in a worker process; OCR is skipped if only the processed image went missing
+        try:
+            result = await workers.run_cpu(
+                ocr_image, image_path, image_name, os.path.join(IMAGE_DIR, "processed"), lang,
+                extract_text=cached is None, plan=plan, tiled=tiled,
+            )
+        except tiling.ImageTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except RuntimeError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        ocr_result = {
+            **(result if cached is None else cached),
+            "scale": result["scale"],
+            "processed_image_path": result["processed_image_path"],
+        }
+        await workers.run_io(
+            ocr_cache.put, cache_key, {field: ocr_result[field] for field in OCR_RESULT_FIELDS}
+        )
+    extracted_text = ocr_result["text"]
+    processed_image_path = ocr_result["processed_image_path"]
+    report(0.8)
+
+    # Categorize the text
+    try:
+        with metrics.stage("categorize"):
+            categorized = categorize.categorize(extracted_text, with_matches=False)
+        categories = categorized["categories"]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to categorize the text: {str(e)}")
+
+    # Index the text so /search?mode=text can find this image without another OCR pass
+    try:
+        with metrics.stage("index"):
+            await workers.run_io(catalog.index_ocr_text, image_path, lang, extracted_text, categories)
+    except Exception as e:
+        logger.warning("Failed to index OCR text", extra={"path": image_path, "error": str(e)})
+    report(1.0)
+
+    response = {
+        "image_name": image_name,
+        "extracted_text": extracted_text,
+        "categories": categories,
+        # Keyword occurrences per category
+        "category_scores": categorized["scores"],
+        "processed_image_name": os.path.basename(processed_image_path),
+        "processed_image_path": processed_image_path,
+        # Resize factor applied before OCR (adaptive for the built-in pipeline)
+        "scale": ocr_result["scale"],
+        "cached": cached is not None,
+    }
+    if include_boxes:
+        response["words"] = ocr_result["words"]
+        response["lines"] = ocr_result["lines"]
+    return response
+
+
+def recategorize_indexed_text(batch_size=500):
+    """
+    Re-run the categorizer over all OCR text stored in the catalog (no image is read)
+    and save the categories that changed. Returns (rows scanned, rows updated).
+    """
+    compiled = categorize.get_compiled()
+    scanned = updated = 0
+    for rows in catalog.iter_ocr_text(batch_size):
+        changes = []
+        for rowid, text, categories in rows:
+            new_categories = categorize.categorize(text, compiled, with_matches=False)["categories"]
+            if new_categories != categories:
+                changes.append((rowid, new_categories))
+        if changes:
+            catalog.update_ocr_categories(changes)
+        scanned += len(rows)
+        updated += len(changes)
+    return scanned, updated
+
+
+def annotated_regions(image_name, subfolder=None):
+    """
+    Boxes saved through /save_annotations for this image, without duplicates.
+    Annotations saved without a subfolder (as the UI does) match any subfolder.
+    """
+    regions = []
+    seen = set()
+    for annotation in annotations.for_image(image_name):
+        if (annotation.get("subfolder") or None) not in (None, subfolder or None):
+            continue
+        try:
+            box = tuple(int(round(annotation[field])) for field in annotations.BOX_FIELDS)
+        except (KeyError, TypeError, ValueError):
+            continue
+        if box in seen or box[2] <= 0 or box[3] <= 0:
+            continue
+        seen.add(box)
+        regions.append(dict(zip(annotations.BOX_FIELDS, box)))
+    return regions
+
+
+async def detected_regions(image_path, lang="eng"):
+    """
+    Text lines from an earlier /ocr or /bounding-boxes run in lang when one is
+    cached, otherwise from a quick OpenCV layout pass (no Tesseract).
+    """
+    _, cached = await workers.run_io(ocr_cache.lookup, image_path, PIPELINE_VERSION, lang, OCR_RESULT_FORMAT)
+    if cached is not None and cached["lines"]:
+        return [{field: line[field] for field in annotations.BOX_FIELDS} for line in cached["lines"]]
+    return await workers.run_cpu(detect_text_regions, image_path)
+
+
+def clip_regions(regions, width, height):
+    clipped = []
+    for region in regions:
+        x0, y0 = max(0, region["x"]), max(0, region["y"])
+        x1 = min(width, region["x"] + region["width"])
+        y1 = min(height, region["y"] + region["height"])
+        if x1 > x0 and y1 > y0:
+            clipped.append({"x": x0, "y": y0, "width": x1 - x0, "height": y1 - y0})
+    return clipped
+
+
+async def run_region_ocr(image_path, image_name, subfolder=None, lang="eng", source="auto", psm=None):
+    """
+    OCR only the annotated or detected text regions of an image, spread over the
+    worker processes, and return the per-region text with coordinates in reading order.
+    """
+    region_source = source
+    regions = []
+    if source in ("auto", "annotations"):
+        regions = await workers.run_io(annotated_regions, image_name, subfolder)
+        region_source = "annotations"
+    if source == "detected" or (source == "auto" and not regions):
+        regions = await detected_regions(image_path, lang)
+        region_source = "detected"
+    width, height = await workers.run_io(annotations.image_dimensions, image_path)
+    regions = sorted(clip_regions(regions, width, height), key=lambda region: (region["y"], region["x"]))
+    if psm is not None:
+        regions = [{**region, "psm": psm} for region in regions]
+
+    config = json.dumps(regions, sort_keys=True)
+    cache_key, results = await workers.run_io(ocr_cache.lookup, image_path, REGIONS_PIPELINE, lang, config)
+    cached = results is not None
+    if not cached and regions:
+        # Contiguous groups, one per worker, so each process decodes the image once
+        groups = min(len(regions), CPU_WORKERS)
+        while groups > 1 and not workers.has_capacity(groups):
+            groups -= 1
+        size = -(-len(regions) // groups)
+        try:
+            parts = await asyncio.gather(*[
+                workers.run_cpu(ocr_regions, image_path, regions[start:start + size], lang)
+                for start in range(0, len(regions), size)
+            ])
+        except RuntimeError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        results = [region for part in parts for region in part]
+        await workers.run_io(ocr_cache.put, cache_key, results)
+    results = results or []
+
+    return {
+        "image_name": image_name,
+        "region_source": region_source,
+        "regions": results,
+        "extracted_text": "\n".join(region["text"] for region in results if region["text"]),
+        "cached": cached,
+    }
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import cv2
+from classes import metrics
+from classes.preprocess import (
+    directory_names,
+    read_image,
+    write_image,
+    to_grayscale,
+    threshold,
+    denoise,
+    morph,
+    deskew,
+    detect_edges,
+    draw_contours,
+    invert,
+    equalize,
+)
+
+# A pipeline is a list of steps such as
+#   [{"name": "grayscale"}, {"name": "threshold", "params": {"type": "adaptive"}}]
+# Every step is a pure ndarray -> ndarray function, so the image is decoded once,
+# transformed in memory and encoded once. Intermediates only hit the disk when
+# a debug dump is requested.
+
+# name -> (function, {param: allowed values})
+STEPS = {
+    "grayscale": (to_grayscale, {}),
+    "threshold": (threshold, {"type": ("global", "adaptive")}),
+    "denoise": (denoise, {"type": ("Median", "Gaussian")}),
+    "morphology": (morph, {"order": ("1", "2")}),
+    "deskew": (deskew, {}),
+    "edges": (detect_edges, {}),
+    "contours": (draw_contours, {}),
+    "invert": (invert, {}),
+    "equalize": (equalize, {}),
+}
+
+# Bump when a step changes its output, so plan fingerprints (and the OCR results
+# cached under them) change too
+STEPS_VERSION = 3
+
+# The chain /preprocess-for-ocr has always applied
+DEFAULT_OCR_PIPELINE = [
+    {"name": "grayscale", "params": {}},
+    {"name": "threshold", "params": {"type": "adaptive"}},
+    {"name": "denoise", "params": {"type": "Median"}},
+    {"name": "deskew", "params": {}},
+    {"name": "invert", "params": {}},
+]
+
+
+def validate_steps(steps):
+    """
+    Check a pipeline definition and return it in canonical form.
+    Steps may be given as a bare name or as {"name": ..., "params": {...}}.
+    Raises ValueError describing the first invalid step.
+    """
+    if not isinstance(steps, list) or not steps:
+        raise ValueError("A pipeline must be a non-empty list of steps")
+    normalized = []
+    for index, step in enumerate(steps):
+        if isinstance(step, str):
+            step = {"name": step}
+        if not isinstance(step, dict) or "name" not in step:
+            raise ValueError(f"Step {index} must be a step name or an object with a 'name'")
+        name = step["name"]
+        if name not in STEPS:
+            raise ValueError(f"Step {index}: unknown step '{name}'. Use one of: {', '.join(STEPS)}")
+        params = step.get("params") or {}
+        allowed = STEPS[name][1]
+        for param, value in params.items():
+            if param not in allowed:
+                raise ValueError(f"Step {index} ({name}): unknown parameter '{param}'")
+            if value not in allowed[param]:
+                choices = ", ".join(repr(choice) for choice in allowed[param])
+                raise ValueError(f"Step {index} ({name}): '{param}' must be one of {choices}")
+        normalized.append({"name": name, "params": dict(params)})
+    return normalized
+
+
+# Steps whose output is single-channel, and steps that convert their input to
+# grayscale before doing anything else (so they can be fed a grayscale decode)
+GRAY_OUTPUT_STEPS = {"grayscale", "threshold", "edges", "equalize"}
+GRAY_INPUT_STEPS = {"grayscale", "threshold", "equalize"}
+# Steps that return a colour image whatever they are given
+COLOR_OUTPUT_STEPS = {"contours"}
+
+
+def compile_plan(steps):
+    """
+    Validate a pipeline once and turn it into an execution plan:
+    - a leading grayscale conversion (or a step that starts with one) is done by
+      the decoder via IMREAD_GRAYSCALE instead of decoding colour and converting,
+    - grayscale steps on an image that is already single-channel are dropped,
+    - pairs of consecutive inversions cancel out.
+    The plan is a plain dict so it can be handed to worker processes as-is.
+    """
+    steps = validate_steps(steps)
+    read_flags = cv2.IMREAD_COLOR
+    if steps[0]["name"] in GRAY_INPUT_STEPS:
+        read_flags = cv2.IMREAD_GRAYSCALE
+
+    fused = []
+    is_gray = read_flags == cv2.IMREAD_GRAYSCALE
+    for step in steps:
+        if step["name"] == "grayscale" and is_gray:
+            continue
+        if step["name"] == "invert" and fused and fused[-1]["name"] == "invert":
+            fused.pop()
+            continue
+        fused.append(step)
+        if step["name"] in GRAY_OUTPUT_STEPS:
+            is_gray = True
+        elif step["name"] in COLOR_OUTPUT_STEPS:
+            is_gray = False
+
+    # Identifies the plan's output, e.g. for OCR cache keys
+    fingerprint = hashlib.sha256(json.dumps([STEPS_VERSION, read_flags, fused], sort_keys=True).encode("utf-8")).hexdigest()
+    return {"steps": steps, "read_flags": read_flags, "execution": fused, "fingerprint": fingerprint[:16]}
+
+
+def load_with_plan(image_path, plan):
+    """
+    Decode an image the way a compiled plan expects and run its steps in memory.
+    """
+    image, _ = run_pipeline(read_image(image_path, plan["read_flags"]), plan["execution"])
+    return image
+
+
+def run_pipeline(image, steps, debug_dir=None, debug_name="image.png"):
+    """
+    Apply validated steps to an ndarray. When debug_dir is given every intermediate
+    is written there as <index>_<step>_<debug_name>; their paths are returned too.
+    """
+    debug_paths = []
+    for index, step in enumerate(steps):
+        function = STEPS[step["name"]][0]
+        with metrics.stage(f"preprocess.{step['name']}"):
+            image = function(image, **step["params"])
+        if debug_dir is not None:
+            os.makedirs(debug_dir, exist_ok=True)
+            debug_path = os.path.join(debug_dir, f"{index:02d}_{step['name']}_{debug_name}")
+            cv2.imwrite(debug_path, image)
+            debug_paths.append(debug_path)
+    return image, debug_paths
+
+
+def process_file(image_path, plan, output_path, debug=False):
+    """
+    Decode image_path once, run a compiled plan in memory and write only the result.
+    Runs in the worker pool.
+    """
+    image = read_image(image_path, plan["read_flags"])
+    debug_dir = directory_names["pipeline_debug"] if debug else None
+    image, debug_paths = run_pipeline(image, plan["execution"], debug_dir, os.path.basename(image_path))
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    write_image(output_path, image)
+    return {"processed_image_path": output_path, "debug_image_paths": debug_paths}
@@ -1,37 +1,132 @@
 from PIL import Image, ImageFilter, ImageOps
 import numpy as np
 import cv2
+import hashlib
+import io
 import os
 import re
+from collections import OrderedDict
+from classes import logs, metrics
+from classes.config import IMAGE_DIR, OCR_TARGET_GLYPH_HEIGHT, OCR_MAX_PIXELS
+
+logger = logs.get_logger(__name__)
 
 directory_names = {
-    "images": "/images",
-    "preprocessed": "/images/preprocessed",
-    "bounding": "/images/bounding",
-    "processing": "/images/processing",
-    "grayscale": "/images/grayscale",
-    "thresholding": "/images/thresholding",
-    "no_noise": "/images/no_noise",
-    "morphology": "/images/morphology",
-    "deskew": "/images/deskew",
-    "edge_detection": "/images/edge_detection",
-    "contours": "/images/contours",
-    "inverted": "/images/inverted",
-    "equalized": "/images/equalized",
+    "images": IMAGE_DIR,
+    "preprocessed": os.path.join(IMAGE_DIR, "preprocessed"),
+    "bounding": os.path.join(IMAGE_DIR, "bounding"),
+    "processing": os.path.join(IMAGE_DIR, "processing"),
+    "grayscale": os.path.join(IMAGE_DIR, "grayscale"),
+    "thresholding": os.path.join(IMAGE_DIR, "thresholding"),
+    "no_noise": os.path.join(IMAGE_DIR, "no_noise"),
+    "morphology": os.path.join(IMAGE_DIR, "morphology"),
+    "deskew": os.path.join(IMAGE_DIR, "deskew"),
+    "edge_detection": os.path.join(IMAGE_DIR, "edge_detection"),
+    "contours": os.path.join(IMAGE_DIR, "contours"),
+    "inverted": os.path.join(IMAGE_DIR, "inverted"),
+    "equalized": os.path.join(IMAGE_DIR, "equalized"),
+    "pipeline": os.path.join(IMAGE_DIR, "pipeline"),
+    "pipeline_debug": os.path.join(IMAGE_DIR, "pipeline", "debug"),
 }
 
+# Bump whenever preprocess_image changes its output so cached OCR results are not reused
+PIPELINE_VERSION = "preprocess_image:2"
+
+# Scale limits for enhance_for_ocr, and the long side images are shrunk to for the
+# glyph height estimate (glyphs stay several pixels tall even on large scans)
+MIN_OCR_SCALE = 0.25
+MAX_OCR_SCALE = 4.0
+GLYPH_ESTIMATE_SIDE = 1000
+
 def preprocess_image(image_path):
-    image = Image.open(image_path)
+    with metrics.stage("decode"):
+        image = Image.open(image_path)
+        image.load()
+    metrics.record_bytes("read", "decode", os.path.getsize(image_path))
+    return enhance_for_ocr(image)
+
+def estimate_glyph_height(gray):
+    """
+    Median height in pixels of the character-sized connected components of a
+    grayscale ndarray, or None if too few were found to be meaningful.
+    """
+    height, width = gray.shape
+    factor = min(1.0, GLYPH_ESTIMATE_SIDE / max(height, width))
+    if factor < 1.0:
+        gray = cv2.resize(gray, (max(1, int(width * factor)), max(1, int(height * factor))), interpolation=cv2.INTER_AREA)
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    # Text is assumed to be the minority colour
+    if cv2.countNonZero(binary) > binary.size // 2:
+        binary = cv2.bitwise_not(binary)
+    count, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    widths = stats[1:, cv2.CC_STAT_WIDTH]
+    # Drop specks, rules (too wide), thin bars and blobs nearly as tall as the image
+    glyphs = (heights >= 3) & (heights <= binary.shape[0] * 0.8) & (widths <= heights * 5) & (widths * 10 >= heights)
+    if np.count_nonzero(glyphs) < 5:
+        return None
+    return float(np.median(heights[glyphs])) / factor
+
+def choose_ocr_scale(gray, max_pixels=OCR_MAX_PIXELS):
+    """
+    Scale factor that brings the dominant glyph height to OCR_TARGET_GLYPH_HEIGHT,
+    capped so the result stays under max_pixels (None: no cap, for tiled processing).
+    Without a usable estimate small images get the old 2x upscale and large ones are
+    left as they are.
+    """
+    height, width = gray.shape
+    glyph_height = estimate_glyph_height(gray)
+    if glyph_height is None:
+        scale = 2.0 if max(height, width) < 2000 else 1.0
+    else:
+        scale = OCR_TARGET_GLYPH_HEIGHT / glyph_height
+    scale = min(max(scale, MIN_OCR_SCALE), MAX_OCR_SCALE)
+    if max_pixels is not None:
+        scale = min(scale, (max_pixels / (width * height)) ** 0.5)
+    # Resampling for a few percent isn't worth its cost or blur
+    if abs(scale - 1.0) < 0.1:
+        scale = 1.0
+    return scale
+
+# The steps of preprocess_image on an already loaded PIL image (e.g. a cropped region)
+def enhance_for_ocr(image):
     # Convert to grayscale
-    image = image.convert("L")
+    with metrics.stage("preprocess.grayscale"):
+        image = image.convert("L")
     # Apply thresholding
-    image = ImageOps.autocontrast(image)
-    # Resize the image (optional)
-    image = image.resize((image.width * 2, image.height * 2), Image.Resampling.LANCZOS)
+    with metrics.stage("preprocess.autocontrast"):
+        image = ImageOps.autocontrast(image)
+    # Resize so glyphs are the height Tesseract reads best
+    with metrics.stage("preprocess.resize"):
+        scale = choose_ocr_scale(np.asarray(image))
+        if scale != 1.0:
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            image = image.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0 if scale < 1 else None)
     # Apply filters to reduce noise
-    image = image.filter(ImageFilter.MedianFilter(size=3))
+    with metrics.stage("preprocess.median"):
+        image = image.filter(ImageFilter.MedianFilter(size=3))
     return image
 
+# Adaptive threshold, blur and 2x upscale used by the /preprocess endpoint
+def binarize_and_upscale(image_path, output_image_path):
+    # Load the image
+    image = read_image(image_path)
+
+    # Convert to grayscale
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    binary = cv2.adaptiveThreshold(
+        gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2
+    )
+
+    # Apply Gaussian blur to reduce noise
+    blurred = cv2.GaussianBlur(binary, (5, 5), 0)
+
+    # Resize the image (optional)
+    resized = cv2.resize(blurred, (0, 0), fx=2, fy=2)
+
+    # Save the preprocessed image
+    return write_image(output_image_path, resized)
+
 def clean_text(text):
     # Remove non-alphanumeric characters
     text = re.sub(r"[^a-zA-Z0-9\s.,]", "", text)
@@ -39,32 +134,64 @@ def clean_text(text):
     text = re.sub(r"\s+", " ", text).strip()
     return text
 
+# The steps below come in two flavours: pure ndarray -> ndarray functions that the
+# pipeline engine (classes/pipeline.py) composes in memory, and the original
+# path-based helpers used by the single-step endpoints, which read the image,
+# apply one pure step and save the result to that step's directory.
+
+def read_image(image_path, flags=cv2.IMREAD_COLOR):
+    """
+    Decode an image with OpenCV, counting the time and bytes read. Raises ValueError if it can't.
+    """
+    with metrics.stage("decode"):
+        image = cv2.imread(image_path, flags)
+    if image is None:
+        logger.warning("Failed to load image", extra={"path": image_path})
+        raise ValueError("Failed to load the image. Ensure the file exists and is a valid image.")
+    metrics.record_bytes("read", "decode", os.path.getsize(image_path))
+    return image
+
+def write_image(output_path, image, params=()):
+    """
+    Encode an ndarray or PIL image in the format of output_path's extension and write
+    it, timing encoding and the disk write separately. Raises ValueError if it can't.
+    """
+    extension = os.path.splitext(output_path)[1].lower()
+    with metrics.stage("encode"):
+        if isinstance(image, Image.Image):
+            if extension not in Image.registered_extensions():
+                raise ValueError(f"Unknown image file extension: '{extension}'")
+            buffer = io.BytesIO()
+            image.save(buffer, format=Image.registered_extensions()[extension])
+            data = buffer.getbuffer()
+        else:
+            encoded, data = cv2.imencode(extension, image, list(params))
+            if not encoded:
+                raise ValueError("OpenCV could not encode the image")
+    with metrics.stage("write"):
+        with open(output_path, "wb") as f:
+            f.write(data)
+    metrics.record_bytes("written", "write", len(data))
+    return output_path
+
+def _save(directory_name, prefix, image_path, image):
+    output_dir = directory_names[directory_name]
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, prefix + os.path.basename(image_path))
+    return write_image(output_path, image)
+
 # Tesseract works best with grayscale images. Converting the image to grayscale reduces noise and simplifies processing.
+def to_grayscale(image):
+    if image.ndim == 2:
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
 def convert_to_grayscale(image_path):
-    image = cv2.imread(image_path)
-    if image is None:
-        print(f"Failed to load image: {image_path}")
-        raise HTTPException(status_code=400, detail="Failed to load the image. Ensure the file exists and is a valid image.")
-    # create preprocessing directory if it doesn't exist
-    grayscale_dir = directory_names["grayscale"]
-    os.makedirs(grayscale_dir, exist_ok=True)
-    os.makedirs(os.path.dirname(grayscale_dir), exist_ok=True)
-    # Convert the image to grayscale
-    gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    gray_image_path = os.path.join(grayscale_dir, "gray_" + os.path.basename(image_path))
-    # Save the grayscale image
-    cv2.imwrite(gray_image_path, gray_image)
-
-    #return the path of the saved grayscale image
-    return gray_image_path
+    return _save("grayscale", "gray_", image_path, to_grayscale(read_image(image_path)))
 
 # Thresholding converts the image to black and white, which helps Tesseract focus on the text.
-def add_thresholding(image_path, type="global"):
-    image = cv2.imread(image_path)
-    # create thresholding directory if it doesn't exist
-    thresholding_dir = directory_names["thresholding"]
-    os.makedirs(os.path.dirname(thresholding_dir), exist_ok=True)
-    thresh_image = None
+def threshold(image, type="global"):
+    image = to_grayscale(image)
     if type == "global":
         # Apply global thresholding
         _, thresh_image = cv2.threshold(image, 127, 255, cv2.THRESH_BINARY)
@@ -75,151 +202,159 @@ def add_thresholding(image_path, type="global"):
         )
     else:
         raise ValueError("Invalid thresholding type. Use 'global' or 'adaptive'.")
-    # Save the thresholded image
-    thresholded_image_path = os.path.join(thresholding_dir, "thresh_" + os.path.basename(image_path))
-    cv2.imwrite(thresholded_image_path, thresh_image)
+    return thresh_image
 
-    # Return the path of the saved thresholded image
-    return thresholded_image_path
+def add_thresholding(image_path, type="global"):
+    return _save("thresholding", "thresh_", image_path, threshold(read_image(image_path), type))
 
 # Removing noise helps clean up the image and improves OCR accuracy:
-def remove_noise(image_path, type="Median"):
-    image = cv2.imread(image_path)
-    # create no_noise directory if it doesn't exist
-    no_noise_dir = directory_names["no_noise"]
-    os.makedirs(os.path.dirname(no_noise_dir), exist_ok=True)
-    no_noise_image = None
+def denoise(image, type="Median"):
     if type == "Median":
         # removes salt-and-pepper noise
-        no_noise_image = cv2.medianBlur(image, 5)
+        return cv2.medianBlur(image, 5)
     elif type == "Gaussian":
         # smoothens the image
-        no_noise_image = cv2.GaussianBlur(image, (5, 5), 0)
-    else:
-        raise ValueError("Invalid noise removal type. Use 'Median' or 'Gaussian'.")
-    # Save the processed image
-    no_noise_image_path = os.path.join(no_noise_dir, "no_noise_" + os.path.basename(image_path))
-    cv2.imwrite(no_noise_image_path, no_noise_image)
+        return cv2.GaussianBlur(image, (5, 5), 0)
+    raise ValueError("Invalid noise removal type. Use 'Median' or 'Gaussian'.")
 
-    # Return the path of the saved no noise image
-    return no_noise_image_path
+def remove_noise(image_path, type="Median"):
+    return _save("no_noise", "no_noise_", image_path, denoise(read_image(image_path), type))
 
 # Morphological operations can help clean up the image further:
-def morphology(image_path, order="1"):
-    image = cv2.imread(image_path)
-    # create processing directory if it doesn't exist
-    morphology_dir = directory_names["morphology"]
-    os.makedirs(os.path.dirname(morphology_dir), exist_ok=True)
+def morph(image, order="1"):
     kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5))
-    morphology_image = None
     if order == "1":
         # Apply closing operation to fill small holes in the text
-        morphology_image = cv2.morphologyEx(image, cv2.MORPH_CLOSE, kernel)
+        return cv2.morphologyEx(image, cv2.MORPH_CLOSE, kernel)
     elif order == "2":
         # Apply opening operation to remove small noise
-        morphology_image = cv2.morphologyEx(image, cv2.MORPH_OPEN, kernel)
-    else:
-        raise ValueError("Invalid morphology order. Use '1' or '2'.")
-    # Save the processed image
-    morphology_image_path = os.path.join(morphology_dir, "morph_" + os.path.basename(image_path))
-    cv2.imwrite(morphology_image_path, morphology_image)
+        return cv2.morphologyEx(image, cv2.MORPH_OPEN, kernel)
+    raise ValueError("Invalid morphology order. Use '1' or '2'.")
 
-    # Return the path of the saved morphology image
-    return morphology_image_path
+def morphology(image_path, order="1"):
+    return _save("morphology", "morph_", image_path, morph(read_image(image_path), order))
 
-# If the text in the image is skewed, deskewing can align it horizontally for better OCR results
-def deskew_image(image_path):
-    image = cv2.imread(image_path)
-    # create deskew directory if it doesn't exist
-    deskew_dir = directory_names["deskew"]
-    os.makedirs(os.path.dirname(deskew_dir), exist_ok=True)
-    # Apply edge detection
-    edges = cv2.Canny(image, 50, 150, apertureSize=3)
-    # Find lines in the image using Hough Transform
-    lines = cv2.HoughLinesP(edges, 1, np.pi / 180, threshold=100, minLineLength=100, maxLineGap=10)
-    # Calculate the angle of rotation
+# If the text in the image is skewed, deskewing can align it horizontally for better OCR results.
+# The angle is estimated on a copy downsampled to DESKEW_ESTIMATE_SIDE, and memoised per
+# image (keyed on a digest of that copy), so only the final rotation touches every pixel.
+DESKEW_ESTIMATE_SIDE = 1000
+# Skew is searched within +-DESKEW_MAX_ANGLE degrees; a page turned further is on its side,
+# which is an orientation problem (90 degree turns) rather than skew
+DESKEW_MAX_ANGLE = 45
+# (step in degrees, foreground pixels used) of a coarse search over the whole range and two
+# refinements around the best angle; larger pages use an evenly strided subset of their pixels
+DESKEW_SEARCH = ((0.5, 20_000), (0.05, 100_000), (0.01, 100_000))
+# Components thicker than this fraction of the copy's long side (area over longest bounding
+# box side, so rotation doesn't matter) are photos, logos or headline glyphs rather than text
+DESKEW_MAX_THICKNESS = 1 / 40
+# Rotations smaller than this (in degrees) are not worth resampling the image for
+DESKEW_MIN_ANGLE = 0.05
+_skew_angles = OrderedDict()
+SKEW_MEMO_SIZE = 1024
+
+def _profile_sharpness(xs, ys, angle):
+    # Project every point onto the normal of lines at this angle; text lines aligned
+    # with it pile up in a few rows, so adjacent rows differ sharply
+    theta = np.radians(angle)
+    offsets = ys * np.cos(theta) - xs * np.sin(theta)
+    offsets -= offsets.min()
+    # Split each point between its two nearest rows; rounding would alias with the
+    # pixel grid and favour diagonals such as 45 degrees
+    rows = offsets.astype(np.intp)
+    weights = offsets - rows
+    size = int(rows.max()) + 2
+    profile = np.bincount(rows, 1 - weights, size) + np.bincount(rows + 1, weights, size)
+    return float(np.square(np.diff(profile)).sum())
+
+def estimate_skew_angle(image):
+    """
+    Angle (degrees) of the text lines of a downsampled copy: the rotation whose
+    horizontal projection profile of the text pixels is sharpest.
+    """
+    gray = to_grayscale(image)
+    height, width = gray.shape
+    # An integer shrink factor keeps INTER_AREA on its fast path
+    step = -(-max(height, width) // DESKEW_ESTIMATE_SIDE)
+    if step > 1:
+        gray = cv2.resize(gray, (max(1, width // step), max(1, height // step)), interpolation=cv2.INTER_AREA)
+    memo_key = hashlib.blake2b(gray.tobytes(), digest_size=16).digest() + bytes(str(gray.shape), "ascii")
+    if memo_key in _skew_angles:
+        _skew_angles.move_to_end(memo_key)
+        return _skew_angles[memo_key]
+
+    _, text = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    # Light text on a dark background: the text is the minority
+    if cv2.countNonZero(text) > text.size // 2:
+        text = cv2.bitwise_not(text)
+    _, labels, stats, _ = cv2.connectedComponentsWithStats(text, connectivity=8)
+    thickness = stats[:, cv2.CC_STAT_AREA] / np.maximum(stats[:, cv2.CC_STAT_WIDTH], stats[:, cv2.CC_STAT_HEIGHT])
+    text_like = thickness <= max(2.0, max(gray.shape) * DESKEW_MAX_THICKNESS)
+    text_like[0] = False
+    ys, xs = np.nonzero(text_like[labels])
     angle = 0.0
-    if lines is not None:
-        for line in lines:
-            x1, y1, x2, y2 = line[0]
-            angle += np.arctan2(y2 - y1, x2 - x1) * 180 / np.pi
-        angle /= len(lines)
-    # Rotate the image to correct the skew
+    if xs.size:
+        xs, ys = xs.astype(np.float64), ys.astype(np.float64)
+        low, high = -DESKEW_MAX_ANGLE, DESKEW_MAX_ANGLE
+        for search_step, max_points in DESKEW_SEARCH:
+            stride = -(-xs.size // max_points)
+            candidates = np.arange(low, high + search_step / 2, search_step)
+            scores = [_profile_sharpness(xs[::stride], ys[::stride], candidate) for candidate in candidates]
+            angle = float(candidates[int(np.argmax(scores))])
+            low = max(-DESKEW_MAX_ANGLE, angle - search_step)
+            high = min(DESKEW_MAX_ANGLE, angle + search_step)
+
+    _skew_angles[memo_key] = angle
+    if len(_skew_angles) > SKEW_MEMO_SIZE:
+        _skew_angles.popitem(last=False)
+    return angle
+
+def deskew(image):
+    # Calculate the angle of rotation
+    angle = estimate_skew_angle(image)
+    if abs(angle) < DESKEW_MIN_ANGLE:
+        return image
+    # Rotate the full-resolution image once to correct the skew
     (h, w) = image.shape[:2]
     center = (w // 2, h // 2)
     M = cv2.getRotationMatrix2D(center, angle, 1.0)
-    rotated_image = cv2.warpAffine(image, M, (w, h))
-    # Save the processed image
-    deskewed_image_path = os.path.join(deskew_dir, "deskewed_" + os.path.basename(image_path))
-    cv2.imwrite(deskewed_image_path, rotated_image)
+    return cv2.warpAffine(image, M, (w, h))
 
-    # Return the path of the saved deskewed image
-    return deskewed_image_path
+def deskew_image(image_path):
+    return _save("deskew", "deskewed_", image_path, deskew(read_image(image_path)))
 
 # Edge detection can help highlight text and improve OCR accuracy:
-def edge_detection(image_path):
-    image = cv2.imread(image_path)
-    # create edge_detection directory if it doesn't exist
-    edge_dir = directory_names["edge_detection"]
-    os.makedirs(os.path.dirname(edge_dir), exist_ok=True)
+def detect_edges(image):
     # Apply Canny edge detection
-    edges = cv2.Canny(image, 100, 200)
-    # Save the processed image
-    edge_image_path = os.path.join(edge_dir, "edges_" + os.path.basename(image_path))
-    cv2.imwrite(edge_image_path, edges)
+    return cv2.Canny(image, 100, 200)
 
-    # Return the path of the saved edge detection image
-    return edge_image_path
+def edge_detection(image_path):
+    return _save("edge_detection", "edges_", image_path, detect_edges(read_image(image_path)))
 
 # Contours can help identify text regions in the image:
-def find_contours(image_path):
-    image = cv2.imread(image_path)
-    # create contours directory if it doesn't exist
-    contours_dir = directory_names["contours"]
-    os.makedirs(os.path.dirname(contours_dir), exist_ok=True)
-    # Convert the image to grayscale
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+def draw_contours(image):
     # Apply binary thresholding
-    _, thresh = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY_INV)
+    _, thresh = cv2.threshold(to_grayscale(image), 127, 255, cv2.THRESH_BINARY_INV)
     # Find contours in the thresholded image
     contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    # Draw contours on the original image
-    contour_image = image.copy()
+    # Draw contours on a colour copy of the image
+    contour_image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR) if image.ndim == 2 else image.copy()
     cv2.drawContours(contour_image, contours, -1, (0, 255, 0), 3)
-    # Save the processed image
-    contour_image_path = os.path.join(contours_dir, "contours_" + os.path.basename(image_path))
-    cv2.imwrite(contour_image_path, contour_image)
+    return contour_image
 
-    # Return the path of the saved contours image
-    return contour_image_path
+def find_contours(image_path):
+    return _save("contours", "contours_", image_path, draw_contours(read_image(image_path)))
 
 # Inverting colors can help improve OCR accuracy in some cases:
 # Especially useful for images with light text on a dark background.
+def invert(image):
+    return cv2.bitwise_not(image)
+
 def invert_colors(image_path):
-    image = cv2.imread(image_path)
-    # create inverted directory if it doesn't exist
-    invert_dir = directory_names["inverted"]
-    os.makedirs(os.path.dirname(invert_dir), exist_ok=True)
-    # Invert the colors of the image
-    inverted_image = cv2.bitwise_not(image)
-    # Save the processed image
-    inverted_image_path = os.path.join(invert_dir, "inverted_" + os.path.basename(image_path))
-    cv2.imwrite(inverted_image_path, inverted_image)
-
-    # Return the path of the saved inverted image
-    return inverted_image_path
+    return _save("inverted", "inverted_", image_path, invert(read_image(image_path)))
 
 # Histogram equalization can help improve the contrast of the image:
+def equalize(image):
+    return cv2.equalizeHist(to_grayscale(image))
+
 def equalize_hist(image_path):
-    image = cv2.imread(image_path)
-    # create equalized directory if it doesn't exist
-    equalized_dir = directory_names["equalized"]
-    os.makedirs(os.path.dirname(equalized_dir), exist_ok=True)
-    # Equalize the histogram
-    equalized_image = cv2.equalizeHist(image)
-    # Save the processed image
-    equalized_image_path = os.path.join(equalized_dir, "equalized_" + os.path.basename(image_path))
-    cv2.imwrite(equalized_image_path, equalized_image)
-
-    # Return the path of the saved equalized image
-    return equalized_image_path
\ No newline at end of file
+    return _save("equalized", "equalized_", image_path, equalize(read_image(image_path)))
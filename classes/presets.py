@@ -0,0 +1,119 @@
+import json
+import os
+import threading
+import cv2
+from classes import logs
+from classes.config import PRESETS_PATH
+from classes.pipeline import DEFAULT_OCR_PIPELINE, compile_plan
+
+# Named pipelines, stored as JSON and compiled once when registered or loaded.
+# Callers get the compiled plan back, so nothing is re-parsed per request.
+
+logger = logs.get_logger(__name__)
+
+_lock = threading.RLock()
+_presets = None  # name -> {"name", "description", "steps"}
+_plans = {}  # name -> compiled plan
+_invalid = {}  # name -> stored preset that failed to compile; kept in the file, not served
+
+BUILTIN_PRESETS = {
+    "default-ocr": {
+        "name": "default-ocr",
+        "description": "The chain applied by /preprocess-for-ocr",
+        "steps": DEFAULT_OCR_PIPELINE,
+    },
+}
+
+
+def _load():
+    global _presets
+    with _lock:
+        if _presets is not None:
+            return _presets
+        presets = dict(BUILTIN_PRESETS)
+        if os.path.exists(PRESETS_PATH):
+            with open(PRESETS_PATH, "r", encoding="utf-8") as f:
+                for preset in json.load(f):
+                    presets[preset["name"]] = preset
+        for name, preset in list(presets.items()):
+            # A stored preset that no longer validates (older step schema, hand edits)
+            # is skipped rather than breaking every other preset
+            try:
+                _plans[name] = compile_plan(preset.get("steps"))
+            except ValueError as e:
+                logger.warning("Skipping invalid preset", extra={"preset": name, "error": str(e)})
+                _invalid[name] = presets.pop(name)
+        _presets = presets
+        return _presets
+
+
+def _persist():
+    # Write to a temporary file and rename so a crash never leaves a truncated file
+    user_presets = [preset for name, preset in _presets.items() if name not in BUILTIN_PRESETS]
+    user_presets += _invalid.values()
+    os.makedirs(os.path.dirname(PRESETS_PATH) or ".", exist_ok=True)
+    temp_path = PRESETS_PATH + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(user_presets, f, indent=2)
+    os.replace(temp_path, PRESETS_PATH)
+
+
+def register(name, steps, description=""):
+    """
+    Validate, compile and persist a preset. Raises ValueError for invalid pipelines
+    or attempts to overwrite a built-in preset.
+    """
+    if name in BUILTIN_PRESETS:
+        raise ValueError(f"'{name}' is a built-in preset and cannot be changed")
+    plan = compile_plan(steps)
+    with _lock:
+        _load()
+        _presets[name] = {"name": name, "description": description, "steps": plan["steps"]}
+        _plans[name] = plan
+        _invalid.pop(name, None)
+        _persist()
+    return describe(name)
+
+
+def delete(name):
+    if name in BUILTIN_PRESETS:
+        raise ValueError(f"'{name}' is a built-in preset and cannot be deleted")
+    with _lock:
+        _load()
+        if name in _invalid:
+            del _invalid[name]
+        elif name in _presets:
+            del _presets[name]
+            del _plans[name]
+        else:
+            return False
+        _persist()
+    return True
+
+
+def get_plan(name):
+    """
+    Return the compiled plan for a preset, or None if it doesn't exist.
+    """
+    _load()
+    return _plans.get(name)
+
+
+def describe(name):
+    presets = _load()
+    if name not in presets:
+        return None
+    plan = _plans[name]
+    return {
+        **presets[name],
+        "builtin": name in BUILTIN_PRESETS,
+        "plan": {
+            "read_grayscale": plan["read_flags"] == cv2.IMREAD_GRAYSCALE,
+            "execution": plan["execution"],
+            "fingerprint": plan["fingerprint"],
+        },
+    }
+
+
+def list_presets():
+    return [describe(name) for name in sorted(_load())]
@@ -0,0 +1,76 @@
+import os
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse
+from classes import catalog, ocr_cache, workers
+from classes.config import IMAGE_MAX_AGE_SECONDS
+from classes.preprocess import directory_names
+
+# Cache-Control by top-level directory under /images. /ocr writes processed images
+# under timestamped names that are never rewritten, so those can be cached forever.
+# The other generated artifacts are overwritten in place whenever an endpoint is
+# re-run, so browsers must revalidate them (a 304 costs next to nothing).
+# Originals are cached for IMAGE_MAX_AGE_SECONDS.
+IMMUTABLE_DIRECTORIES = {"processed"}
+GENERATED_DIRECTORIES = {
+    os.path.basename(path) for name, path in directory_names.items() if name not in ("images", "pipeline_debug")
+}
+CACHE_CONTROL = {
+    "immutable": "public, max-age=31536000, immutable",
+    "generated": "no-cache",
+    "original": f"public, max-age={IMAGE_MAX_AGE_SECONDS}",
+}
+
+
+def cache_control(path):
+    top = path.split("/", 1)[0] if "/" in path else ""
+    if top in IMMUTABLE_DIRECTORIES:
+        return CACHE_CONTROL["immutable"]
+    if top in GENERATED_DIRECTORIES:
+        return CACHE_CONTROL["generated"]
+    return CACHE_CONTROL["original"]
+
+
+def content_etag(file_path, stat_result):
+    """
+    Strong ETag from the file's SHA-256. The hash stored in the catalog is used when
+    it is still current; otherwise it is computed once and written back.
+    """
+    content_hash = catalog.stored_hash(file_path, stat_result)
+    if content_hash is None:
+        content_hash = ocr_cache.file_hash(file_path)
+        catalog.upsert_path(file_path, content_hash=content_hash)
+    return f'"{content_hash}"'
+
+
+class ImageFileResponse(FileResponse):
+    # Larger reads for big TIFFs; servers offering the ASGI pathsend extension
+    # skip this entirely and send the file zero-copy
+    chunk_size = 1024 * 1024
+
+
+class ImageStaticFiles(StaticFiles):
+    """
+    StaticFiles with content-hash ETags, per-directory Cache-Control and hidden dotfiles
+    (catalog, caches and upload sessions live next to the images). Range and If-Range
+    requests are answered by FileResponse against the same ETag (Starlette >= 0.39).
+    """
+
+    async def get_response(self, path, scope):
+        if any(part.startswith(".") for part in path.replace("\\", "/").split("/")):
+            raise HTTPException(status_code=404)
+        response = await super().get_response(path, scope)
+        if not isinstance(response, FileResponse) or response.status_code != 200:
+            return response
+
+        response.headers["etag"] = await workers.run_io(content_etag, response.path, response.stat_result)
+        response.headers["cache-control"] = cache_control(path.replace("\\", "/"))
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        # Conditional requests are checked in get_response, once the real ETag is known
+        return ImageFileResponse(full_path, status_code=status_code, stat_result=stat_result)
@@ -0,0 +1,125 @@
+import hashlib
+import os
+import threading
+from PIL import Image
+from classes import metrics
+from classes.config import THUMB_CACHE_DIR, THUMB_CACHE_MAX_BYTES
+
+# Resized renditions live in a content-addressed disk cache: the file name is
+# derived from the source's content hash and the requested size/format, so a
+# changed source never serves a stale thumbnail and the name doubles as a strong ETag.
+# Hits refresh the file's mtime; eviction removes the least recently used files.
+
+# Bump when render_thumbnail changes its output
+THUMB_VERSION = "1"
+
+FORMATS = {
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", "image/jpeg", {"quality": 85, "optimize": True, "progressive": True}),
+}
+DEFAULT_SIZE = 256
+DEFAULT_FORMAT = "webp"
+
+_lock = threading.Lock()
+_total_bytes = None
+# Exposed by /metrics; misses count renditions written (requested or pregenerated)
+stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def thumbnail_key(content_hash, width, height, fmt):
+    raw = "\0".join([content_hash, str(width), str(height), fmt, THUMB_VERSION])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+def thumbnail_path(key, fmt):
+    return os.path.join(THUMB_CACHE_DIR, key[:2], f"{key}.{fmt}")
+
+
+def render_thumbnail(source_path, output_path, width, height, fmt):
+    """
+    Write a rendition of source_path that fits in width x height. Runs in the worker pool.
+    """
+    pil_format, _, save_options = FORMATS[fmt]
+    with metrics.stage("thumbnail"), Image.open(source_path) as image:
+        # Let the JPEG decoder downscale by a power of two while decoding
+        image.draft("RGB", (width, height))
+        image.thumbnail((width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        if image.mode not in ("RGB", "L") and not (fmt == "webp" and image.mode == "RGBA"):
+            image = image.convert("RGBA" if fmt == "webp" and "A" in image.getbands() else "RGB")
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        # Write under a temporary name so readers never see a partial file
+        temp_path = f"{output_path}.{os.getpid()}.tmp"
+        image.save(temp_path, pil_format, **save_options)
+    os.replace(temp_path, output_path)
+    size = os.path.getsize(output_path)
+    metrics.record_bytes("read", "thumbnail", os.path.getsize(source_path))
+    metrics.record_bytes("written", "thumbnail", size)
+    return size
+
+
+def _scan_total():
+    total = 0
+    for root, _, files in os.walk(THUMB_CACHE_DIR):
+        for file in files:
+            try:
+                total += os.path.getsize(os.path.join(root, file))
+            except OSError:
+                continue
+    return total
+
+
+def touch(path):
+    """
+    Mark a cached rendition as recently used.
+    """
+    stats["hits"] += 1
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def record_write(size):
+    """
+    Account for a newly written rendition and evict old ones if the cache is over its cap.
+    """
+    global _total_bytes
+    with _lock:
+        stats["misses"] += 1
+        if _total_bytes is None:
+            _total_bytes = _scan_total()
+        else:
+            _total_bytes += size
+        if _total_bytes <= THUMB_CACHE_MAX_BYTES:
+            return 0
+        return _evict()
+
+
+def _evict():
+    global _total_bytes
+    entries = []
+    for root, _, files in os.walk(THUMB_CACHE_DIR):
+        for file in files:
+            path = os.path.join(root, file)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort()
+    # Evict down to 90% of the cap so we don't rescan on every write
+    target = THUMB_CACHE_MAX_BYTES * 0.9
+    total = sum(size for _, size, _ in entries)
+    evicted = 0
+    for _, size, path in entries:
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        evicted += 1
+    _total_bytes = total
+    stats["evictions"] += evicted
+    return evicted
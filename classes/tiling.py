@@ -0,0 +1,237 @@
+import math
+import os
+import tempfile
+import cv2
+import numpy as np
+from PIL import Image, ImageFilter
+from classes import metrics, ocr_engine
+from classes.config import OCR_MAX_PIXELS, OCR_MEMORY_LIMIT_BYTES, OCR_TARGET_GLYPH_HEIGHT
+from classes.pipeline import GRAY_OUTPUT_STEPS, run_pipeline
+from classes.preprocess import MAX_OCR_SCALE, choose_ocr_scale, read_image
+
+# Memory-bounded OCR for very large scans. Instead of holding the decoded colour
+# image, its grayscale copy, the upscaled copy and Tesseract's working set at once,
+# the image is decoded straight to grayscale (OpenCV converts row by row while
+# decoding), the filter chain runs on horizontal strips written into a memory-mapped
+# scratch file, and Tesseract reads overlapping strips of that file one at a time.
+# Each strip only keeps the words whose centre lies in its half of the overlaps,
+# so words cut at a strip edge are taken from the neighbouring strip instead.
+
+# Rough working set per pixel Tesseract is given (its own grey, binary and
+# threshold images on top of ours); used to size strips
+TESSERACT_BYTES_PER_PIXEL = 12
+# Processed rows shared by neighbouring OCR strips: a few text lines at the target glyph height
+OVERLAP_ROWS = 8 * OCR_TARGET_GLYPH_HEIGHT
+# Source rows of context each neighbourhood filter in a preset needs above and
+# below a strip (adaptive threshold reads 11x11, the other filters 5x5)
+STEP_HALO = 8
+# Preset steps that only look at a pixel's neighbourhood, so they give the same
+# result strip by strip (equalize, deskew, edges and contours look at the whole image)
+TILEABLE_STEPS = {"grayscale", "threshold", "denoise", "morphology", "invert"}
+
+
+class ImageTooLarge(RuntimeError):
+    pass
+
+
+def tileable(plan):
+    """
+    Whether a compiled plan (None: the built-in pipeline) can run strip by strip.
+    """
+    return plan is None or all(step["name"] in TILEABLE_STEPS for step in plan["execution"])
+
+
+def image_header(image_path):
+    """
+    (width, height, bands) from the image header, or None if PIL refuses to open
+    an image that large (its decompression bomb limit).
+    """
+    try:
+        with Image.open(image_path) as image:
+            return image.width, image.height, len(image.getbands())
+    except Image.DecompressionBombError:
+        return None
+
+
+def whole_image_bytes(width, height, bands, plan=None):
+    """
+    Estimated peak memory of processing and OCR'ing the image in one piece.
+    """
+    pixels = width * height
+    if plan is None:
+        processed = min(pixels * MAX_OCR_SCALE ** 2, OCR_MAX_PIXELS)
+        # Decoded image, grayscale and autocontrast copies; resized and median-filtered copies
+        return pixels * (bands + 2) + processed * (2 + TESSERACT_BYTES_PER_PIXEL)
+    channels = 1 if plan["read_flags"] == cv2.IMREAD_GRAYSCALE else 3
+    return pixels * channels * (len(plan["execution"]) + 1) + pixels * TESSERACT_BYTES_PER_PIXEL
+
+
+def needs_tiling(image_path, plan=None, tiled=None):
+    """
+    Decide between whole-image and tiled processing. tiled forces a mode; by default
+    images are tiled when processing them whole would exceed OCR_MEMORY_LIMIT_BYTES.
+    """
+    if tiled is not None:
+        return tiled
+    header = image_header(image_path)
+    if header is not None and whole_image_bytes(*header, plan) <= OCR_MEMORY_LIMIT_BYTES:
+        return False
+    if not tileable(plan):
+        raise ImageTooLarge(
+            f"The image is too large to process within OCR_MEMORY_LIMIT_BYTES ({OCR_MEMORY_LIMIT_BYTES}) "
+            f"and the preset cannot be tiled; tileable steps are {', '.join(sorted(TILEABLE_STEPS))}"
+        )
+    return True
+
+
+def strip_rows(height, strip_height, overlap):
+    """
+    (top, bottom) row ranges of strip_height rows covering height, each sharing
+    overlap rows with the next.
+    """
+    if strip_height >= height:
+        return [(0, height)]
+    bounds = []
+    top = 0
+    while True:
+        bottom = min(height, top + strip_height)
+        bounds.append((top, bottom))
+        if bottom == height:
+            return bounds
+        top += strip_height - overlap
+
+
+def autocontrast_lut(gray):
+    """
+    The lookup table ImageOps.autocontrast builds for this image (no cutoff).
+    """
+    histogram = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel()
+    used = np.flatnonzero(histogram)
+    low, high = int(used[0]), int(used[-1])
+    if high <= low:
+        return np.arange(256, dtype=np.uint8)
+    scale = 255.0 / (high - low)
+    return np.clip((np.arange(256) * scale - low * scale).astype(np.int64), 0, 255).astype(np.uint8)
+
+
+def _enhanced_rows(gray, lut, out_size, top, bottom):
+    """
+    Rows [top, bottom) of enhance_for_ocr's output, computed from the source rows they depend on.
+    """
+    out_width, out_height = out_size
+    height, width = gray.shape
+    # The 3x3 median needs one processed row either side
+    y0, y1 = max(0, top - 1), min(out_height, bottom + 1)
+    if (out_width, out_height) == (width, height):
+        piece = Image.fromarray(cv2.LUT(gray[y0:y1], lut))
+    else:
+        # Source rows per processed row; Lanczos reads three processed rows' worth either side
+        ratio = height / out_height
+        support = math.ceil(3 * max(ratio, 1.0)) + 1
+        s0 = max(0, math.floor(y0 * ratio) - support)
+        s1 = min(height, math.ceil(y1 * ratio) + support)
+        piece = Image.fromarray(cv2.LUT(gray[s0:s1], lut)).resize(
+            (out_width, y1 - y0), Image.Resampling.LANCZOS, box=(0, y0 * ratio - s0, width, y1 * ratio - s0)
+        )
+    piece = piece.filter(ImageFilter.MedianFilter(size=3))
+    return np.asarray(piece)[top - y0:bottom - y0]
+
+
+def _planned_rows(image, execution, top, bottom):
+    """
+    Rows [top, bottom) of a tileable plan's output.
+    """
+    start = max(0, top - STEP_HALO * len(execution))
+    piece, _ = run_pipeline(image[start:bottom + STEP_HALO * len(execution)], execution)
+    return piece[top - start:bottom - start]
+
+
+def _ocr_strips(processed, strip_height, lang):
+    """
+    OCR overlapping strips of the processed image and merge their image_to_data
+    results into one, in processed image coordinates.
+    """
+    height = processed.shape[0]
+    bounds = strip_rows(height, strip_height, OVERLAP_ROWS)
+    merged = {column: [] for column in ocr_engine.DATA_COLUMNS}
+    block_offset = 0
+    for index, (top, bottom) in enumerate(bounds):
+        # This strip owns the rows up to the middle of its overlaps with its neighbours
+        own_top = 0 if index == 0 else (top + bounds[index - 1][1]) / 2
+        own_bottom = height if index == len(bounds) - 1 else (bounds[index + 1][0] + bottom) / 2
+        data = ocr_engine.image_to_data(np.ascontiguousarray(processed[top:bottom]), lang=lang)
+        blocks = 0
+        for i, text in enumerate(data["text"]):
+            blocks = max(blocks, int(data["block_num"][i]))
+            if not str(text).strip() or float(data["conf"][i]) < 0:
+                continue
+            centre = top + int(data["top"][i]) + int(data["height"][i]) / 2
+            if not own_top <= centre < own_bottom:
+                continue
+            for column in ocr_engine.DATA_COLUMNS:
+                merged[column].append(data[column][i])
+            merged["top"][-1] = top + int(data["top"][i])
+            # Keep blocks (and so lines) of different strips apart
+            merged["block_num"][-1] = block_offset + int(data["block_num"][i])
+        block_offset += blocks
+    return merged
+
+
+def ocr_tiled(image_path, processed_image_path, lang="eng", extract_text=True, plan=None):
+    """
+    Process an image strip by strip (the built-in enhance_for_ocr steps, or a tileable
+    plan), save the processed image and, if extract_text, OCR it in overlapping strips.
+    Returns (image_to_data result or None, source (width, height), processed (width, height)).
+    Raises ImageTooLarge when even a minimal strip would exceed OCR_MEMORY_LIMIT_BYTES.
+    """
+    image = read_image(image_path, cv2.IMREAD_GRAYSCALE if plan is None else plan["read_flags"])
+    height, width = image.shape[:2]
+    if plan is None:
+        # The processed image never exists in memory as a whole, so OCR_MAX_PIXELS does not apply
+        scale = choose_ocr_scale(image, max_pixels=None)
+        out_width, out_height = max(1, round(width * scale)), max(1, round(height * scale))
+        lut = autocontrast_lut(image)
+        channels = 1
+
+        def rows(top, bottom):
+            with metrics.stage("preprocess.enhance"):
+                return _enhanced_rows(image, lut, (out_width, out_height), top, bottom)
+    else:
+        out_width, out_height = width, height
+        gray = plan["read_flags"] == cv2.IMREAD_GRAYSCALE or any(
+            step["name"] in GRAY_OUTPUT_STEPS for step in plan["execution"]
+        )
+        channels = 1 if gray else 3
+
+        def rows(top, bottom):
+            return _planned_rows(image, plan["execution"], top, bottom)
+
+    # Whatever the decoded source leaves of the ceiling bounds the rows per strip
+    row_bytes = out_width * channels * (3 + TESSERACT_BYTES_PER_PIXEL)
+    strip_height = (OCR_MEMORY_LIMIT_BYTES - image.nbytes) // row_bytes
+    if strip_height < 2 * OVERLAP_ROWS:
+        raise ImageTooLarge(
+            f"The image is too large to process within OCR_MEMORY_LIMIT_BYTES ({OCR_MEMORY_LIMIT_BYTES}); "
+            f"it needs at least {image.nbytes + 2 * OVERLAP_ROWS * row_bytes} bytes"
+        )
+    # Tesseract also gets no more than OCR_MAX_PIXELS at a time
+    strip_height = min(strip_height, max(2 * OVERLAP_ROWS, OCR_MAX_PIXELS // out_width))
+
+    os.makedirs(os.path.dirname(processed_image_path), exist_ok=True)
+    fd, scratch_path = tempfile.mkstemp(prefix=".tiles-", dir=os.path.dirname(processed_image_path))
+    os.close(fd)
+    try:
+        shape = (out_height, out_width) if channels == 1 else (out_height, out_width, 3)
+        processed = np.memmap(scratch_path, dtype=np.uint8, mode="w+", shape=shape)
+        for top in range(0, out_height, strip_height):
+            processed[top:top + strip_height] = rows(top, min(out_height, top + strip_height))
+        data = _ocr_strips(processed, strip_height, lang) if extract_text else None
+        # Encoded straight from the map rather than through an in-memory buffer
+        with metrics.stage("write"):
+            if not cv2.imwrite(processed_image_path, processed):
+                raise ValueError("OpenCV could not encode the image")
+        metrics.record_bytes("written", "write", os.path.getsize(processed_image_path))
+        del processed
+    finally:
+        os.remove(scratch_path)
+    return data, (width, height), (out_width, out_height)
@@ -0,0 +1,208 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+from classes.config import UPLOAD_COMMIT_TIMEOUT_SECONDS, UPLOAD_SESSION_DIR, UPLOAD_SESSION_TTL_SECONDS
+
+# A session is a directory UPLOAD_SESSION_DIR/<id>/ holding session.json and one
+# file per received chunk, named <index>-<sha256>.part. Chunks are written to a
+# temporary name and renamed once complete and verified, so a listing of the
+# directory is always an accurate record of what can be resumed from.
+
+SESSION_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+CHUNK_PATTERN = re.compile(r"^(\d{8})-([0-9a-f]{64})\.part$")
+READ_SIZE = 1024 * 1024
+
+
+class ChunksChanged(Exception):
+    """A chunk was replaced or removed while the session was being assembled."""
+
+
+def session_dir(session_id):
+    if not SESSION_ID_PATTERN.match(session_id):
+        return None
+    return os.path.join(UPLOAD_SESSION_DIR, session_id)
+
+
+def create(file_path, chunk_count, total_size=None, content_hash=None):
+    """
+    Start a session that will be assembled into file_path from chunk_count chunks.
+    Returns the session metadata.
+    """
+    purge_expired()
+    session_id = uuid.uuid4().hex
+    directory = os.path.join(UPLOAD_SESSION_DIR, session_id)
+    os.makedirs(directory)
+    session = {
+        "session_id": session_id,
+        "file_path": file_path,
+        "chunk_count": chunk_count,
+        "total_size": total_size,
+        "sha256": content_hash,
+        "created": time.time(),
+    }
+    with open(os.path.join(directory, "session.json"), "w") as f:
+        json.dump(session, f)
+    return session
+
+
+def load(session_id):
+    """Return the session metadata, or None for an unknown or expired session."""
+    directory = session_dir(session_id)
+    if directory is None:
+        return None
+    try:
+        with open(os.path.join(directory, "session.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def received_chunks(session_id):
+    """Return {index: {"sha256", "size"}} for every chunk stored so far."""
+    directory = session_dir(session_id)
+    chunks = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            match = CHUNK_PATTERN.match(entry.name)
+            if match:
+                chunks[int(match.group(1))] = {"sha256": match.group(2), "size": entry.stat().st_size}
+    return chunks
+
+
+def open_chunk(session_id):
+    """Open a temporary file for an incoming chunk; returns (fd, temp_path)."""
+    return tempfile.mkstemp(dir=session_dir(session_id), prefix=".chunk-")
+
+
+def store_chunk(session_id, index, temp_path, chunk_hash):
+    """
+    Give a fully written chunk its final name, replacing any earlier upload of the
+    same index (a retried PUT). Returns False, storing nothing, if a commit has
+    started since the upload began.
+    """
+    if is_committing(session_id):
+        return False
+    directory = session_dir(session_id)
+    prefix = f"{index:08d}-"
+    final_name = f"{prefix}{chunk_hash}.part"
+    os.replace(temp_path, os.path.join(directory, final_name))
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name != final_name:
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+    # Keeps an active session from being purged
+    os.utime(os.path.join(directory, "session.json"))
+    return True
+
+
+def assemble(session_id, output_dir, chunks):
+    """
+    Concatenate the chunks listed in chunks (as validated by the caller, see
+    received_chunks) in order into a temporary file in output_dir, hashing on the
+    way. Returns (temp_path, sha256, size); the caller moves it into place.
+    Raises ChunksChanged if the chunks on disk no longer match that list.
+    """
+    directory = session_dir(session_id)
+    fd, temp_path = tempfile.mkstemp(dir=output_dir, prefix=".upload-")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for index in sorted(chunks):
+                chunk_path = os.path.join(directory, f"{index:08d}-{chunks[index]['sha256']}.part")
+                try:
+                    f = open(chunk_path, "rb")
+                except FileNotFoundError:
+                    raise ChunksChanged(f"Chunk {index} was replaced during the commit")
+                with f:
+                    while True:
+                        block = f.read(READ_SIZE)
+                        if not block:
+                            break
+                        digest.update(block)
+                        out.write(block)
+                        size += len(block)
+        # A PUT admitted before the commit started may have replaced a chunk after it was read
+        if received_chunks(session_id) != chunks:
+            raise ChunksChanged("Chunks were replaced during the commit")
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return temp_path, digest.hexdigest(), size
+
+
+def _commit_marker(session_id):
+    return os.path.join(session_dir(session_id), ".committing")
+
+
+def _marker_is_stale(path):
+    try:
+        return os.stat(path).st_mtime < time.time() - UPLOAD_COMMIT_TIMEOUT_SECONDS
+    except FileNotFoundError:
+        return False
+
+
+def lock_for_commit(session_id):
+    """
+    Mark the session as being committed. Returns False if another commit already
+    holds it, so two commits never assemble the same chunks. A marker older than
+    UPLOAD_COMMIT_TIMEOUT_SECONDS is left over from a crash and is taken over.
+    """
+    path = _commit_marker(session_id)
+    try:
+        os.close(os.open(path, os.O_CREAT | os.O_EXCL))
+    except FileExistsError:
+        if not _marker_is_stale(path):
+            return False
+        # Move the stale marker aside first; of two commits racing for it only one rename succeeds
+        stale_path = f"{path}.stale-{uuid.uuid4().hex}"
+        try:
+            os.rename(path, stale_path)
+        except FileNotFoundError:
+            return False
+        os.remove(stale_path)
+        return lock_for_commit(session_id)
+    return True
+
+
+def is_committing(session_id):
+    path = _commit_marker(session_id)
+    return os.path.exists(path) and not _marker_is_stale(path)
+
+
+def unlock(session_id):
+    try:
+        os.remove(_commit_marker(session_id))
+    except FileNotFoundError:
+        pass
+
+
+def remove(session_id):
+    directory = session_dir(session_id)
+    if directory is not None:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def purge_expired():
+    """Delete sessions that have not received a chunk within the TTL."""
+    if not os.path.isdir(UPLOAD_SESSION_DIR):
+        return
+    cutoff = time.time() - UPLOAD_SESSION_TTL_SECONDS
+    with os.scandir(UPLOAD_SESSION_DIR) as entries:
+        for entry in entries:
+            if not SESSION_ID_PATTERN.match(entry.name):
+                continue
+            try:
+                if os.stat(os.path.join(entry.path, "session.json")).st_mtime < cutoff:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            except FileNotFoundError:
+                # Half-created session; only give up on it once it is old too
+                if entry.stat().st_mtime < cutoff:
+                    shutil.rmtree(entry.path, ignore_errors=True)
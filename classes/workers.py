@@ -0,0 +1,140 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from fastapi import HTTPException
+from classes import logs, metrics
+from classes.config import CPU_WORKERS, IO_WORKERS, MAX_QUEUED_TASKS, OMP_THREADS_PER_WORKER
+
+# Blocking work must never run on the event loop, otherwise one OCR request
+# stalls every other request (including static files from /images).
+# CPU-bound work goes to a process pool, blocking file I/O to a thread pool.
+
+logger = logs.get_logger(__name__)
+
+_cpu_pool = None
+_io_pool = None
+_pool_lock = threading.Lock()
+# Number of CPU tasks admitted and not yet finished. Only touched from the event loop.
+_pending = 0
+
+
+class WorkerCrashed(Exception):
+    """
+    A worker process died while running a task (OOM kill, segfault in libtesseract).
+    Unlike a full queue this is not transient for the same input, so callers count
+    it as a failed attempt rather than retrying it right away.
+    """
+
+
+def _init_cpu_worker(omp_threads):
+    # Read by Tesseract when pytesseract forks it or tesserocr initialises a handle
+    os.environ["OMP_THREAD_LIMIT"] = str(omp_threads)
+    os.environ["OMP_NUM_THREADS"] = str(omp_threads)
+    import cv2
+    cv2.setNumThreads(omp_threads)
+
+
+def _new_cpu_pool():
+    # spawn rather than fork: the parent holds SQLite connections and threads
+    return ProcessPoolExecutor(
+        max_workers=CPU_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_cpu_worker,
+        initargs=(OMP_THREADS_PER_WORKER,),
+    )
+
+
+def start():
+    global _cpu_pool, _io_pool
+    with _pool_lock:
+        if _cpu_pool is None:
+            _cpu_pool = _new_cpu_pool()
+        if _io_pool is None:
+            _io_pool = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
+
+
+def _replace_cpu_pool(broken):
+    """
+    Swap in a fresh process pool after a worker died (OOM kill, segfault in
+    libtesseract). Only the first of the requests that saw the same broken pool replaces it.
+    """
+    global _cpu_pool
+    with _pool_lock:
+        if _cpu_pool is not broken:
+            return
+        logger.error("A CPU worker process died; restarting the process pool")
+        broken.shutdown(wait=False, cancel_futures=True)
+        _cpu_pool = _new_cpu_pool()
+
+
+def shutdown():
+    global _cpu_pool, _io_pool
+    with _pool_lock:
+        if _cpu_pool is not None:
+            _cpu_pool.shutdown(wait=False, cancel_futures=True)
+            _cpu_pool = None
+        if _io_pool is not None:
+            _io_pool.shutdown(wait=False, cancel_futures=True)
+            _io_pool = None
+
+
+def queue_depth():
+    """
+    CPU tasks waiting for a free worker.
+    """
+    return max(0, _pending - CPU_WORKERS)
+
+
+def pending():
+    """
+    CPU tasks admitted and not yet finished (running or waiting).
+    """
+    return _pending
+
+
+def has_capacity(count=1):
+    return _pending + count <= CPU_WORKERS + MAX_QUEUED_TASKS
+
+
+async def run_cpu(fn, *args, **kwargs):
+    """
+    Run fn in the process pool. fn and its arguments must be picklable, so it
+    has to be a module-level function. Raises a 503 when the queue is full
+    instead of letting latency pile up, and WorkerCrashed when a worker process
+    died (the pool is rebuilt for the next request). Stage timings recorded by
+    fn (see classes/metrics.py) are brought back and recorded here.
+    """
+    global _pending
+    if not has_capacity():
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy processing other images, retry shortly",
+            headers={"Retry-After": "1"},
+        )
+    start()
+    pool = _cpu_pool
+    _pending += 1
+    try:
+        result, log = await asyncio.get_running_loop().run_in_executor(
+            pool, partial(metrics.call_with_log, fn, time.time(), *args, **kwargs)
+        )
+    except BrokenProcessPool:
+        _replace_cpu_pool(pool)
+        raise WorkerCrashed("A worker process exited unexpectedly while processing the image")
+    finally:
+        _pending -= 1
+    metrics.replay(log)
+    return result
+
+
+async def run_io(fn, *args, **kwargs):
+    """
+    Run a blocking file operation in the I/O thread pool.
+    """
+    start()
+    return await asyncio.get_running_loop().run_in_executor(_io_pool, partial(fn, *args, **kwargs))
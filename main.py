@@ -1,22 +1,53 @@
-from fastapi import FastAPI, Query, HTTPException, Body
-from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, Query, HTTPException
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from upload_images import router as upload_router  # Import the upload router
 from opencv_routes import router as opencv_router  # Import the OpenCV router
 from preprocessing_routes import router as preprocessing_router  # Import the preprocessing router
+from thumb_routes import router as thumb_router  # Import the thumbnail router
+from ocr_routes import router as ocr_router, start_job_workers, stop_job_workers  # Import the OCR job router
+from annotation_routes import router as annotation_router, start_annotation_store, stop_annotation_store  # Import the annotation router
 from PIL import Image
-import pytesseract
 import os
 import json
-from datetime import datetime
-from classes.preprocess import preprocess_image, clean_text  # Import the preprocess function
-from classes.categorize import categorize_text  # Import the categorize function
-
-# Set the Tesseract executable path (optional if installed in the default path)
-pytesseract.pytesseract.tesseract_cmd = "/usr/bin/tesseract"
-
-app = FastAPI()
+from classes.ocr_service import run_ocr  # Import the shared OCR pipeline
+from classes.config import CATALOG_RECONCILE_SECONDS, IMAGE_DIR
+from classes import catalog, jobs, logs, metrics, ocr_cache, thumbnails, workers
+from classes.static_files import ImageStaticFiles
+from contextlib import asynccontextmanager
+import asyncio
+
+logger = logs.get_logger(__name__)
+
+async def reconcile_catalog_periodically(run_immediately=True):
+    while True:
+        if run_immediately:
+            try:
+                await asyncio.to_thread(catalog.reconcile)
+            except Exception as e:
+                logger.error("Catalog reconcile failed", extra={"error": str(e)})
+        run_immediately = True
+        await asyncio.sleep(CATALOG_RECONCILE_SECONDS)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build the catalog before serving on first run; afterwards the snapshot on disk
+    # is served straight away and reconciled in the background
+    workers.start()
+    catalog.init_catalog()
+    built = catalog.is_empty()
+    if built:
+        await asyncio.to_thread(catalog.reconcile)
+    reconcile_task = asyncio.create_task(reconcile_catalog_periodically(run_immediately=not built))
+    await start_job_workers()
+    await start_annotation_store()
+    yield
+    stop_annotation_store()
+    stop_job_workers()
+    reconcile_task.cancel()
+    workers.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 # Allow all origins for CORS
 app.add_middleware(
@@ -27,87 +58,141 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
-app.mount("/images", StaticFiles(directory="/images"), name='images')
+# Per-route latency and body sizes, and the Server-Timing header
+app.add_middleware(metrics.MetricsMiddleware)
+
+
+def cache_stats(field):
+    return lambda: {
+        (("cache", "ocr"),): ocr_cache.stats[field],
+        (("cache", "thumbnails"),): thumbnails.stats[field],
+    }
+
+
+def cache_hit_ratios():
+    ratios = {}
+    for name, stats in (("ocr", ocr_cache.stats), ("thumbnails", thumbnails.stats)):
+        lookups = stats["hits"] + stats["misses"]
+        ratios[(("cache", name),)] = stats["hits"] / lookups if lookups else 0.0
+    return ratios
+
+
+metrics.register("cpu_tasks_pending", "gauge", "CPU tasks admitted and not finished", workers.pending)
+metrics.register("cpu_queue_depth", "gauge", "CPU tasks waiting for a worker process", workers.queue_depth)
+metrics.register("ocr_jobs_queued", "gauge", "OCR jobs waiting to run", jobs.queue_depth)
+metrics.register("cache_hits_total", "counter", "Cache hits", cache_stats("hits"))
+metrics.register("cache_misses_total", "counter", "Cache misses", cache_stats("misses"))
+metrics.register("cache_evictions_total", "counter", "Cache entries evicted", cache_stats("evictions"))
+metrics.register("cache_hit_ratio", "gauge", "Hits over lookups since start", cache_hit_ratios)
+
+app.mount("/images", ImageStaticFiles(directory=IMAGE_DIR), name='images')
 
 # Include the upload route from upload.py
 app.include_router(upload_router)
 app.include_router(opencv_router)
 app.include_router(preprocessing_router)
+app.include_router(ocr_router)
+app.include_router(thumb_router)
+app.include_router(annotation_router)
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Metrics in the Prometheus text format.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/search")
-async def search_images(query: str = Query(..., min_length=1)):
-    image_dir = "/images"
-    matching_files = []
-    for root, dirs, files in os.walk(image_dir):
-        for file in files:
-            print(file)
-            file_path = os.path.join(root, file)
-            parent_folder = os.path.basename(root)
-            last_modified = datetime.fromtimestamp(os.path.getmtime(file_path)).strftime('%Y-%m-%d %H:%M:%S')
-            if query.lower() in file.lower():
-                matching_files.append({
-                    "name": file,
-                    "url": file_path,
-                    "parent_folder": parent_folder,
-                    "size": os.path.getsize(file_path),
-                    "last_modified": last_modified
-                })
-    return {"matching_files": matching_files}
+async def search_images(
+    query: str = Query(..., min_length=1),
+    mode: str = Query("name", description="'name' matches file names, 'text' searches text extracted by /ocr"),
+    limit: int = Query(50, ge=1, le=1000, description="Maximum number of results for mode=text"),
+):
+    if mode == "name":
+        return {"matching_files": await workers.run_io(catalog.search_entries, query)}
+    if mode == "text":
+        return {"matching_files": await workers.run_io(catalog.search_text, query, limit)}
+    raise HTTPException(status_code=400, detail="Invalid mode. Use 'name' or 'text'.")
 
 @app.get("/list")
-async def list_images():
-    image_dir = "/images"
-    image_list = []
-    for root, dirs, files in os.walk(image_dir):
-        for file in files:
-            file_path = os.path.join(root, file)
-            parent_folder = os.path.basename(root)
-            last_modified = datetime.fromtimestamp(os.path.getmtime(file_path)).strftime('%Y-%m-%d %H:%M:%S')
-            image_list.append({
-                "name": file,
-                "url": file_path,
-                "parent_folder": parent_folder,
-                "size": os.path.getsize(file_path),
-                "last_modified": last_modified
-            })
-    return {"images": image_list}
+async def list_images(
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of images to return"),
+    cursor: str = Query(None, description="next_cursor from the previous page"),
+    sort: str = Query("name", description="Sort key: 'name', 'mtime', 'size' or 'path'"),
+    order: str = Query("asc", description="Sort order: 'asc' or 'desc'"),
+    parent_folder: str = Query(None, description="Only list images directly inside this folder"),
+):
+    """
+    List one page of images. Pass the returned next_cursor back to get the following page.
+    """
+    try:
+        images, next_cursor = await workers.run_io(catalog.list_page, limit, cursor, sort, order, parent_folder)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"images": images, "next_cursor": next_cursor}
+
+@app.get("/list/stream")
+async def stream_images(
+    sort: str = Query("name", description="Sort key: 'name', 'mtime', 'size' or 'path'"),
+    order: str = Query("asc", description="Sort order: 'asc' or 'desc'"),
+    parent_folder: str = Query(None, description="Only list images directly inside this folder"),
+):
+    """
+    Stream every image as newline-delimited JSON, one object per line.
+    """
+    if sort not in catalog.SORT_COLUMNS or order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="Invalid sort or order")
+    entries = catalog.iter_entries(sort, order, parent_folder)
+    return StreamingResponse(
+        (json.dumps(entry) + "\n" for entry in entries),
+        media_type="application/x-ndjson",
+    )
+
+def move_image(current_path, new_path, make_dirs):
+    """Rename a file on disk and in the catalog (runs in the I/O pool)."""
+    if make_dirs:
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+    
+    if not os.path.exists(current_path):
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    if os.path.exists(new_path):
+        raise HTTPException(status_code=400, detail="New file name already exists")
+    
+    os.rename(current_path, new_path)
+    catalog.rename_path(current_path, new_path)
 
 @app.post("/rename")
 async def rename_image(current_name: str = Query(...), new_name: str = Query(...), subfolder: str = Query(None)):
-    image_dir = "/images"
+    image_dir = IMAGE_DIR
     current_path = os.path.join(image_dir, current_name)
     
     if subfolder:
         new_path = os.path.join(image_dir, subfolder, new_name)
-        os.makedirs(os.path.dirname(new_path), exist_ok=True)
     else:
         new_path = os.path.join(image_dir, new_name)
     
-    if not os.path.exists(current_path):
-        raise HTTPException(status_code=404, detail="File not found")
-    
-    if os.path.exists(new_path):
-        raise HTTPException(status_code=400, detail="New file name already exists")
-    
-    os.rename(current_path, new_path)
+    await workers.run_io(move_image, current_path, new_path, bool(subfolder))
     return {"message": "File renamed successfully", "new_path": new_path}
 
 @app.get("/ocr")
 async def perform_ocr(
     image_name: str = Query(..., description="Name of the image file to process"),
     subfolder: str = Query(None, description="Subfolder to save the output image"),
-    lang: str = Query("eng", description="Language for OCR (default: 'eng')")
+    lang: str = Query("eng", description="Language for OCR (default: 'eng')"),
+    preset: str = Query(None, description="Preprocessing preset registered via /presets (default: built-in pipeline)"),
+    boxes: bool = Query(False, description="Also return word boxes with confidences and text lines"),
+    tiled: bool = Query(None, description="Process in strips (true) or whole (false); default: only images too large for OCR_MEMORY_LIMIT_BYTES"),
 ):
     """
     Perform OCR on the specified image file and return the extracted text.
     """
     # Get language from query parameter (default to English)
-    image_dir = "/images"
+    image_dir = IMAGE_DIR
     image_path = os.path.join(image_dir, image_name)
     # Check if a subfolder is provided
     if subfolder:
         image_path = os.path.join(image_dir, subfolder, image_name)
-        print(image_path)
     # extracted_text = pytesseract.image_to_string(image)
     # extracted_text = pytesseract.image_to_string(image, lang=lang)
 
@@ -122,77 +207,9 @@ async def perform_ocr(
         raise HTTPException(status_code=404, detail="Image not found")
 
     try:
-        # Initialize the image variable
-        image = None
-
-         # Preprocess the image
-        try:
-            image = preprocess_image(image_path)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Failed to preprocess the image: {str(e)}")
-
-        # Perform OCR
-        try:
-            extracted_text_unclean = pytesseract.image_to_string(image, lang=lang)
-            extracted_text = clean_text(extracted_text_unclean)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Failed to perform OCR: {str(e)}")
-
-        # Save the processed image with a timestamp
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        processed_image_name = f"processed_{timestamp}_{image_name}"
-        processed_image_path = os.path.join(image_dir + "/processed", processed_image_name)
-        
-        # Ensure the processed directory exists
-        os.makedirs(os.path.dirname(processed_image_path), exist_ok=True)
-
-        # Save the processed image
-        try:
-            image.save(processed_image_path)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Failed to save the processed image: {str(e)}")
-
-        # Categorize the text
-        try:
-            categories = categorize_text(extracted_text)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Failed to categorize the text: {str(e)}")
-
-        return {
-            "message": "OCR performed successfully",
-            "image_name": image_name,
-            "extracted_text": extracted_text,
-            "categories": categories,
-            "processed_image_name": processed_image_name,
-            "processed_image_path": processed_image_path,
-        }
+        result = await run_ocr(image_path, image_name, lang, preset=preset, include_boxes=boxes, tiled=tiled)
+        return {"message": "OCR performed successfully", **result}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to process the image: {str(e)}")
-
-@app.post("/save_annotations")
-async def save_annotations(annotation: dict = Body(...)):
-    """
-    Save bounding box annotation data sent from the UI.
-    Expects JSON body: {"imageName": str, "x": int, "y": int, "width": int, "height": int}
-    Appends the annotation to a JSON file (annotations.json) in the /images directory.
-    """
-    annotations_path = os.path.join("/images", "annotations.json")
-    # Load existing annotations if file exists
-    if os.path.exists(annotations_path):
-        with open(annotations_path, "r", encoding="utf-8") as f:
-            try:
-                annotations = json.load(f)
-            except Exception:
-                annotations = []
-    else:
-        annotations = []
-
-    # Add timestamp to annotation
-    annotation["timestamp"] = datetime.now().isoformat()
-    annotations.append(annotation)
-
-    # Save back to file
-    with open(annotations_path, "w", encoding="utf-8") as f:
-        json.dump(annotations, f, indent=2)
-
-    return {"message": "Annotation saved successfully", "annotation": annotation}
@@ -0,0 +1,299 @@
+import asyncio
+import fnmatch
+import json
+import os
+import time
+from fastapi import APIRouter, Body, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from classes import catalog, categorize, jobs, logs, workers
+from classes.config import IMAGE_DIR, CPU_WORKERS, OCR_BATCH_CPU_SLOTS, OCR_JOB_CONCURRENCY, OCR_JOB_MAX_ATTEMPTS
+from classes.ocr_service import (
+    REGION_SOURCES, recategorize_indexed_text, resolve_image_path, resolve_plan, run_ocr, run_region_ocr,
+)
+
+router = APIRouter()
+logger = logs.get_logger(__name__)
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp", ".webp", ".gif"}
+
+# Background workers that drain the OCR job queue (started from main.py's lifespan)
+_worker_tasks = []
+_wakeup = None
+# Shared by every /ocr/batch request (created on first use, inside the event loop)
+_batch_slots = None
+# Longest pause of a job worker after repeated unexpected errors (e.g. a locked database)
+MAX_WORKER_BACKOFF_SECONDS = 30
+
+
+@router.post("/ocr/jobs", status_code=202)
+async def create_ocr_job(
+    image_name: str = Body(..., description="Name of the image file to process"),
+    subfolder: str = Body(None, description="Subfolder containing the image"),
+    lang: str = Body("eng", description="Language for OCR (default: 'eng')"),
+    preset: str = Body(None, description="Preprocessing preset registered via /presets"),
+    max_attempts: int = Body(OCR_JOB_MAX_ATTEMPTS, ge=1, le=10, description="Attempts before the job is marked failed"),
+):
+    """
+    Queue an OCR job and return its ID immediately. Poll GET /ocr/jobs/{job_id} for the result.
+    """
+    image_path = resolve_image_path(image_name, subfolder)
+    if not os.path.exists(image_path):
+        raise HTTPException(status_code=404, detail="Image not found")
+    resolve_plan(preset)
+    params = {"image_name": image_name, "subfolder": subfolder, "lang": lang, "preset": preset}
+    job_id = await workers.run_io(jobs.enqueue, "ocr", params, max_attempts)
+    if _wakeup is not None:
+        _wakeup.set()
+    return {"message": "OCR job queued", "job_id": job_id, "status": jobs.QUEUED}
+
+
+@router.get("/ocr/jobs/{job_id}")
+async def get_ocr_job(job_id: str):
+    """
+    Return the status, progress and (once finished) the result of an OCR job.
+    """
+    job = await workers.run_io(jobs.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.get("/ocr/regions")
+async def ocr_regions(
+    image_name: str = Query(..., description="Name of the image file to process"),
+    subfolder: str = Query(None, description="Subfolder containing the image"),
+    lang: str = Query("eng", description="Language for OCR (default: 'eng')"),
+    source: str = Query("auto", description="'annotations', 'detected', or 'auto' (annotations if any were saved)"),
+    psm: int = Query(None, ge=0, le=13, description="Tesseract --psm for every region (default: chosen per region)"),
+):
+    """
+    OCR only the regions of an image that contain text: the boxes saved via
+    /save_annotations, or text lines found by /bounding-boxes or a quick layout pass.
+    Returns each region's coordinates and text, in reading order.
+    """
+    if source not in REGION_SOURCES:
+        raise HTTPException(status_code=400, detail=f"Invalid source. Use one of: {', '.join(REGION_SOURCES)}")
+    image_path = resolve_image_path(image_name, subfolder)
+    if not os.path.exists(image_path):
+        raise HTTPException(status_code=404, detail="Image not found")
+    try:
+        result = await run_region_ocr(image_path, image_name, subfolder, lang, source, psm)
+        return {"message": "OCR performed successfully", **result}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to process the image: {str(e)}")
+
+
+@router.post("/ocr/batch")
+async def ocr_batch(
+    subfolder: str = Body(None, description="Folder to process (defaults to the image root)"),
+    pattern: str = Body("*", description="Glob matched against file names, e.g. '*.png'"),
+    recursive: bool = Body(False, description="Also process images in nested folders"),
+    lang: str = Body("eng", description="Language for OCR (default: 'eng')"),
+    preset: str = Body(None, description="Preprocessing preset registered via /presets"),
+    concurrency: int = Body(
+        CPU_WORKERS, ge=1, le=256,
+        description="Images processed at the same time (OCR itself is limited to OCR_BATCH_CPU_SLOTS across all batches)",
+    ),
+):
+    """
+    OCR every image in a folder in parallel, streaming one NDJSON line per image as it
+    completes and a final summary line with the aggregate throughput.
+    Images with a valid cached result are returned without running Tesseract again.
+    """
+    global _batch_slots
+    if _batch_slots is None:
+        _batch_slots = asyncio.Semaphore(OCR_BATCH_CPU_SLOTS)
+    resolve_plan(preset)
+    rel_paths = await workers.run_io(catalog.list_paths, subfolder, recursive)
+    rel_paths = [
+        rel_path for rel_path in rel_paths
+        if os.path.splitext(rel_path)[1].lower() in IMAGE_EXTENSIONS
+        and fnmatch.fnmatch(os.path.basename(rel_path), pattern)
+    ]
+    if not rel_paths:
+        raise HTTPException(status_code=404, detail="No images matched")
+
+    async def process(rel_path):
+        image_path = os.path.join(IMAGE_DIR, rel_path)
+        while True:
+            try:
+                async with _batch_slots:
+                    result = await run_ocr(image_path, os.path.basename(rel_path), lang, preset=preset)
+                return {"path": rel_path, "status": "cached" if result["cached"] else "processed", **result}
+            except HTTPException as e:
+                if e.status_code == 503:
+                    # Interactive requests have the pool full; wait for a free slot. A crashed
+                    # worker raises WorkerCrashed instead and fails the image below.
+                    await asyncio.sleep(0.5)
+                    continue
+                return {"path": rel_path, "status": "failed", "error": e.detail}
+            except Exception as e:
+                return {"path": rel_path, "status": "failed", "error": str(e)}
+
+    async def stream():
+        started = time.perf_counter()
+        counts = {"processed": 0, "cached": 0, "failed": 0}
+        pending = set()
+        remaining = iter(rel_paths)
+        try:
+            while True:
+                for rel_path in remaining:
+                    pending.add(asyncio.create_task(process(rel_path)))
+                    if len(pending) >= concurrency:
+                        break
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    counts[result["status"]] += 1
+                    yield json.dumps(result) + "\n"
+        finally:
+            # The client went away; don't keep OCR'ing for nobody
+            for task in pending:
+                task.cancel()
+        elapsed = time.perf_counter() - started
+        summary = {
+            "total": len(rel_paths),
+            **counts,
+            "elapsed_seconds": round(elapsed, 3),
+            "images_per_second": round(len(rel_paths) / elapsed, 3) if elapsed > 0 else None,
+        }
+        yield json.dumps({"summary": summary}) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@router.post("/ocr/recategorize")
+async def recategorize(
+    reload: bool = Body(True, embed=True, description="Re-read the keyword table from CATEGORIES_PATH first"),
+):
+    """
+    Recompute the categories of every image whose OCR text is indexed, from the
+    stored text alone (no image is read or OCR'd), and update /search accordingly.
+    """
+    started = time.perf_counter()
+    try:
+        table = await workers.run_io(categorize.reload) if reload else categorize.get_compiled()["table"]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid category table: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to load the category table: {str(e)}")
+    try:
+        scanned, updated = await workers.run_io(recategorize_indexed_text)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to recategorize: {str(e)}")
+    return {
+        "message": f"Recategorized {scanned} images, {updated} changed",
+        "scanned": scanned,
+        "updated": updated,
+        "elapsed_seconds": round(time.perf_counter() - started, 3),
+        "categories": table,
+    }
+
+
+class ProgressWriter:
+    """
+    Progress callback for run_ocr that stores updates through the I/O pool. Writes
+    happen one at a time and only the latest fraction is written, so they never
+    block the event loop or land out of order.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.latest = None
+        self.task = None
+
+    def __call__(self, fraction):
+        self.latest = fraction
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._write())
+
+    async def _write(self):
+        while self.latest is not None:
+            fraction, self.latest = self.latest, None
+            await workers.run_io(jobs.set_progress, self.job_id, fraction)
+
+    async def flush(self):
+        """Wait for pending writes, so they can't overwrite the job's final state."""
+        if self.task is not None:
+            try:
+                await self.task
+            except Exception as e:
+                logger.warning("Failed to store job progress", extra={"job_id": self.job_id, "error": str(e)})
+
+
+async def run_job(job):
+    job_id = job["job_id"]
+    params = job["params"]
+    image_path = resolve_image_path(params["image_name"], params.get("subfolder"))
+    if not os.path.exists(image_path):
+        await workers.run_io(jobs.fail, job_id, "Image not found")
+        return
+    progress = ProgressWriter(job_id)
+    try:
+        result = await run_ocr(
+            image_path, params["image_name"], params["lang"], progress=progress, preset=params.get("preset"),
+        )
+    except HTTPException as e:
+        await progress.flush()
+        if e.status_code == 503:
+            # The process pool is saturated by interactive requests; try again shortly
+            # without counting an attempt (workers.run_cpu only answers 503 on admission)
+            await workers.run_io(jobs.release, job_id, 1.0)
+        else:
+            await workers.run_io(jobs.fail, job_id, e.detail, 2 ** job["attempts"])
+        return
+    except workers.WorkerCrashed as e:
+        # Likely to crash again on the same image, so it counts towards max_attempts
+        await progress.flush()
+        await workers.run_io(jobs.fail, job_id, str(e), 2 ** job["attempts"])
+        return
+    except Exception as e:
+        await progress.flush()
+        await workers.run_io(jobs.fail, job_id, f"Failed to process the image: {str(e)}", 2 ** job["attempts"])
+        return
+    await progress.flush()
+    await workers.run_io(jobs.succeed, job_id, result)
+
+
+async def run_next_job():
+    _wakeup.clear()
+    job = await workers.run_io(jobs.claim)
+    if job is None:
+        # Sleep until a job is submitted, or poll again for retries that became due
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=1.0)
+        except asyncio.TimeoutError:
+            pass
+        return
+    await run_job(job)
+
+
+async def job_worker():
+    # An unexpected error must not end the task, or the queue loses a worker for good
+    failures = 0
+    while True:
+        try:
+            await run_next_job()
+            failures = 0
+        except Exception:
+            failures += 1
+            logger.exception("OCR job worker failed, retrying")
+            await asyncio.sleep(min(MAX_WORKER_BACKOFF_SECONDS, 2 ** failures))
+
+
+async def start_job_workers():
+    global _wakeup
+    _wakeup = asyncio.Event()
+    await workers.run_io(jobs.recover)
+    for _ in range(OCR_JOB_CONCURRENCY):
+        _worker_tasks.append(asyncio.create_task(job_worker()))
+
+
+def stop_job_workers():
+    for task in _worker_tasks:
+        task.cancel()
+    _worker_tasks.clear()
@@ -1,7 +1,10 @@
-import cv2
 import os
-import pytesseract
 from fastapi import APIRouter, HTTPException, Query
+from classes import workers
+from classes.config import IMAGE_DIR
+from classes.ocr import BOX_LEVELS, boxes_to_json, draw_bounding_boxes, select_boxes
+from classes.ocr_service import resolve_image_path, run_ocr
+from classes.preprocess import binarize_and_upscale
 
 router = APIRouter()
 
@@ -10,7 +13,7 @@ async def preprocess_image(image_name: str = Query(..., description="Name of the
     """
     Preprocess the image for OCR by applying filters and resizing.
     """
-    image_dir = "/images"
+    image_dir = IMAGE_DIR
     processed_dir = os.path.join(image_dir, "preprocessed")
     os.makedirs(processed_dir, exist_ok=True)
     image_path = os.path.join(image_dir, image_name)
@@ -22,25 +25,10 @@ async def preprocess_image(image_name: str = Query(..., description="Name of the
         raise HTTPException(status_code=404, detail="Image not found")
 
     try:
-        # Load the image
-        image = cv2.imread(image_path)
-
-        # Convert to grayscale
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        binary = cv2.adaptiveThreshold(
-            gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2
-        )
-
-        # Apply Gaussian blur to reduce noise
-        blurred = cv2.GaussianBlur(binary, (5, 5), 0)
-
-        # Resize the image (optional)
-        resized = cv2.resize(blurred, (0, 0), fx=2, fy=2)
-
         # Save the preprocessed image
         output_image_name = f"processed_{image_name}"
         output_image_path = os.path.join(processed_dir, output_image_name)
-        cv2.imwrite(output_image_path, resized)
+        await workers.run_cpu(binarize_and_upscale, image_path, output_image_path)
 
         return {
             "message": "Image preprocessed successfully",
@@ -48,21 +36,29 @@ async def preprocess_image(image_name: str = Query(..., description="Name of the
             "output_image": output_image_name,
             "output_image_path": output_image_path,
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to process the image: {str(e)}")
 
 @router.get("/bounding-boxes")
 async def bounding_boxes(
     image_name: str = Query(..., description="Name of the image file to process"),
-    subfolder: str = Query(None, description="Subfolder to save the output image")
+    subfolder: str = Query(None, description="Subfolder to save the output image"),
+    lang: str = Query("eng", description="Language for OCR (default: 'eng')"),
+    min_conf: float = Query(80, ge=0, le=100, description="Words whose whole-number confidence (0-100) is above this get a box"),
+    level: str = Query("word", description="Box per 'word', or merged per 'line' or 'block'"),
+    render: bool = Query(True, description="Save an overlay image; with false only the boxes are returned as JSON"),
 ):
     """
     Detect text fields in the specified image and draw bounding boxes around them.
     """
-    image_dir = "/images"
+    if level not in BOX_LEVELS:
+        raise HTTPException(status_code=400, detail=f"Invalid level. Use one of: {', '.join(BOX_LEVELS)}")
+    image_dir = IMAGE_DIR
     bounding_dir = os.path.join(image_dir, "bounding")
     os.makedirs(bounding_dir, exist_ok=True)
-    image_path = os.path.join(image_dir, subfolder, image_name)
+    image_path = resolve_image_path(image_name, subfolder)
 
     # Ensure the output directory exists
     os.makedirs(bounding_dir, exist_ok=True)
@@ -71,31 +67,37 @@ async def bounding_boxes(
         raise HTTPException(status_code=404, detail="Image not found")
 
     try:
-        # Load the image
-        image = cv2.imread(image_path)
-
-        # Convert the image to grayscale
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-        # Perform OCR with bounding box detection
-        data = pytesseract.image_to_data(gray, output_type=pytesseract.Output.DICT)
-
-        # Draw bounding boxes around detected text
-        for i in range(len(data["text"])):
-            if int(data["conf"][i]) > 80:  # Only consider text with confidence > 80
-                x, y, w, h = data["left"][i], data["top"][i], data["width"][i], data["height"][i]
-                cv2.rectangle(image, (x, y), (x + w, y + h), (0, 255, 0), 2)
-
-        # Save the image with bounding boxes
+        # The same single-pass result /ocr uses (and caches); the overlay is drawn from
+        # its stored word boxes, so an image OCR'd before is not recognised again
+        result = await run_ocr(image_path, image_name, lang, include_boxes=True)
+
+        if not render:
+            # JSON only: no image is decoded or encoded
+            boxes, conf = await workers.run_io(select_boxes, result["words"], min_conf, level)
+            return {
+                "message": "Bounding boxes detected successfully",
+                "original_image": image_name,
+                "level": level,
+                "boxes": boxes_to_json(boxes, conf),
+                "cached": result["cached"],
+            }
+
+        # Draw the boxes and save the image in a worker process
         output_image_name = f"bounding_boxes_{image_name}"
         output_image_path = os.path.join(bounding_dir, output_image_name)
-        cv2.imwrite(output_image_path, image)
+        box_count = await workers.run_cpu(
+            draw_bounding_boxes, image_path, output_image_path, result["words"], min_conf, level
+        )
 
         return {
             "message": "Bounding boxes created successfully",
             "original_image": image_name,
             "output_image": output_image_name,
             "output_image_path": output_image_path,
+            "box_count": box_count,
+            "cached": result["cached"],
         }
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to process the image: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Failed to process the image: {str(e)}")
@@ -1,6 +1,9 @@
-import cv2
 import os
-from fastapi import APIRouter, HTTPException, Query
+from typing import Any, List
+from fastapi import APIRouter, Body, HTTPException, Query
+from classes import presets, workers
+from classes.config import IMAGE_DIR
+from classes.pipeline import compile_plan, process_file
 from classes.preprocess import (
     convert_to_grayscale,
     add_thresholding,
@@ -11,12 +14,11 @@ from classes.preprocess import (
     find_contours,
     invert_colors,
     equalize_hist,
+    directory_names,
 )
 
 router = APIRouter()
 
-IMAGE_DIR = "/images"
-
 @router.get("/grayscale")
 async def grayscale(image_name: str = Query(..., description="Name of the image file to process")):
     """
@@ -26,8 +28,10 @@ async def grayscale(image_name: str = Query(..., description="Name of the image
     if not os.path.exists(image_path):
         raise HTTPException(status_code=404, detail="Image not found")
     try:
-        processed_image_path = convert_to_grayscale(image_path)
+        processed_image_path = await workers.run_cpu(convert_to_grayscale, image_path)
         return {"message": "Grayscale conversion successful", "processed_image_path": processed_image_path}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to process the image: {str(e)}")
 
@@ -44,8 +48,10 @@ async def thresholding(
     if not os.path.exists(image_path):
         raise HTTPException(status_code=404, detail="Image not found")
     try:
-        processed_image_path = add_thresholding(image_path, type)
+        processed_image_path = await workers.run_cpu(add_thresholding, image_path, type)
         return {"message": "Thresholding successful", "processed_image_path": processed_image_path}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to process the image: {str(e)}")
 
@@ -62,8 +68,10 @@ async def remove_noise_endpoint(
     if not os.path.exists(image_path):
         raise HTTPException(status_code=404, detail="Image not found")
     try:
-        processed_image_path = remove_noise(image_path, type)
+        processed_image_path = await workers.run_cpu(remove_noise, image_path, type)
         return {"message": "Noise removal successful", "processed_image_path": processed_image_path}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to process the image: {str(e)}")
 
@@ -80,8 +88,10 @@ async def morphology_endpoint(
     if not os.path.exists(image_path):
         raise HTTPException(status_code=404, detail="Image not found")
     try:
-        processed_image_path = morphology(image_path, order)
+        processed_image_path = await workers.run_cpu(morphology, image_path, order)
         return {"message": "Morphology successful", "processed_image_path": processed_image_path}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to process the image: {str(e)}")
 
@@ -95,8 +105,10 @@ async def deskew(image_name: str = Query(..., description="Name of the image fil
     if not os.path.exists(image_path):
         raise HTTPException(status_code=404, detail="Image not found")
     try:
-        processed_image_path = deskew_image(image_path)
+        processed_image_path = await workers.run_cpu(deskew_image, image_path)
         return {"message": "Deskewing successful", "processed_image_path": processed_image_path}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to process the image: {str(e)}")
 
@@ -110,8 +122,10 @@ async def invert_colors_endpoint(image_name: str = Query(..., description="Name
     if not os.path.exists(image_path):
         raise HTTPException(status_code=404, detail="Image not found")
     try:
-        processed_image_path = invert_colors(image_path)
+        processed_image_path = await workers.run_cpu(invert_colors, image_path)
         return {"message": "Color inversion successful", "processed_image_path": processed_image_path}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to process the image: {str(e)}")
 
@@ -125,28 +139,106 @@ async def equalize_hist_endpoint(image_name: str = Query(..., description="Name
     if not os.path.exists(image_path):
         raise HTTPException(status_code=404, detail="Image not found")
     try:
-        processed_image_path = equalize_hist(image_path)
+        processed_image_path = await workers.run_cpu(equalize_hist, image_path)
         return {"message": "Histogram equalization successful", "processed_image_path": processed_image_path}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to process the image: {str(e)}")
 
 
-@router.get("/preprocess-for-ocr")
-async def preprocess_for_ocr(image_name: str = Query(..., description="Name of the image file to process")):
+async def run_preprocessing_pipeline(image_name, steps, debug):
     """
-    Apply a series of preprocessing steps to prepare the image for OCR.
+    steps is either a raw pipeline definition or an already compiled plan (from a preset).
     """
     image_path = os.path.join(IMAGE_DIR, image_name)
     if not os.path.exists(image_path):
         raise HTTPException(status_code=404, detail="Image not found")
+    if isinstance(steps, dict):
+        plan = steps
+    else:
+        try:
+            plan = compile_plan(steps)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     try:
-        # Apply preprocessing steps in a logical order
-        grayscale_image_path = convert_to_grayscale(image_path)
-        thresholded_image_path = add_thresholding(grayscale_image_path, "adaptive")
-        denoised_image_path = remove_noise(thresholded_image_path, "Median")
-        deskewed_image_path = deskew_image(denoised_image_path)
-        final_image_path = invert_colors(deskewed_image_path)
-
-        return {"message": "Preprocessing for OCR successful", "processed_image_path": final_image_path}
+        # Decode once, apply every step in memory and encode only the final image
+        output_path = os.path.join(directory_names["pipeline"], "pipeline_" + os.path.basename(image_name))
+        result = await workers.run_cpu(process_file, image_path, plan, output_path, debug)
+        return {"message": "Preprocessing for OCR successful", "steps": plan["steps"], **result}
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to preprocess the image: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Failed to preprocess the image: {str(e)}")
+
+
+@router.get("/preprocess-for-ocr")
+async def preprocess_for_ocr(
+    image_name: str = Query(..., description="Name of the image file to process"),
+    preset: str = Query("default-ocr", description="Name of a registered pipeline preset"),
+    debug: bool = Query(False, description="Also save every intermediate image"),
+):
+    """
+    Apply a series of preprocessing steps to prepare the image for OCR.
+    """
+    # Apply preprocessing steps in a logical order (the default preset is DEFAULT_OCR_PIPELINE)
+    plan = presets.get_plan(preset)
+    if plan is None:
+        raise HTTPException(status_code=404, detail="Preset not found")
+    return await run_preprocessing_pipeline(image_name, plan, debug)
+
+
+@router.post("/preprocess-for-ocr")
+async def preprocess_with_pipeline(
+    image_name: str = Body(..., description="Name of the image file to process"),
+    steps: List[Any] = Body(..., description="Pipeline steps, e.g. [\"grayscale\", {\"name\": \"threshold\", \"params\": {\"type\": \"adaptive\"}}]"),
+    debug: bool = Body(False, description="Also save every intermediate image"),
+):
+    """
+    Apply a caller-defined pipeline of preprocessing steps in a single pass.
+    """
+    return await run_preprocessing_pipeline(image_name, steps, debug)
+
+
+@router.get("/presets")
+async def list_presets():
+    """
+    List the registered pipeline presets with their compiled execution plans.
+    """
+    return {"presets": presets.list_presets()}
+
+
+@router.get("/presets/{name}")
+async def get_preset(name: str):
+    preset = presets.describe(name)
+    if preset is None:
+        raise HTTPException(status_code=404, detail="Preset not found")
+    return preset
+
+
+@router.post("/presets")
+async def register_preset(
+    name: str = Body(..., min_length=1, description="Preset name, e.g. 'dvd-sleeve'"),
+    steps: List[Any] = Body(..., description="Pipeline steps, same format as POST /preprocess-for-ocr"),
+    description: str = Body("", description="What the preset is for"),
+):
+    """
+    Register (or replace) a named pipeline. It is validated and compiled once here,
+    then reused by /preprocess-for-ocr, /ocr and the batch/job endpoints via ?preset=.
+    """
+    try:
+        preset = await workers.run_io(presets.register, name, steps, description)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"message": "Preset saved successfully", "preset": preset}
+
+
+@router.delete("/presets/{name}")
+async def delete_preset(name: str):
+    try:
+        deleted = await workers.run_io(presets.delete, name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Preset not found")
+    return {"message": "Preset deleted successfully", "name": name}
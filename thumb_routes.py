@@ -0,0 +1,83 @@
+import os
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response
+from classes import logs, thumbnails, workers
+from classes.config import IMAGE_DIR
+from classes.ocr_cache import file_hash
+
+router = APIRouter()
+logger = logs.get_logger(__name__)
+
+# Renditions are addressed by content, but the URL is addressed by path, so clients
+# may cache briefly and then revalidate cheaply with If-None-Match.
+THUMB_CACHE_CONTROL = "public, max-age=3600"
+
+
+def resolve_source(path):
+    # Catalog, caches and upload sessions live in dotfiles next to the images
+    if any(part.startswith(".") for part in path.replace("\\", "/").split("/")):
+        raise HTTPException(status_code=404, detail="Image not found")
+    image_dir = os.path.realpath(IMAGE_DIR)
+    source_path = os.path.realpath(os.path.join(image_dir, path))
+    if os.path.commonpath([image_dir, source_path]) != image_dir or not os.path.isfile(source_path):
+        raise HTTPException(status_code=404, detail="Image not found")
+    return source_path
+
+
+async def ensure_thumbnail(source_path, width, height, fmt):
+    """
+    Return (thumbnail path, key), rendering the thumbnail in the worker pool on a cache miss.
+    """
+    content_hash = await workers.run_io(file_hash, source_path)
+    key = thumbnails.thumbnail_key(content_hash, width, height, fmt)
+    output_path = thumbnails.thumbnail_path(key, fmt)
+    if os.path.exists(output_path):
+        await workers.run_io(thumbnails.touch, output_path)
+    else:
+        size = await workers.run_cpu(thumbnails.render_thumbnail, source_path, output_path, width, height, fmt)
+        await workers.run_io(thumbnails.record_write, size)
+    return output_path, key
+
+
+async def pregenerate_thumbnails(file_paths):
+    """
+    Render the default thumbnail for freshly uploaded files. Runs after the upload
+    response is sent; files are skipped rather than queued when the pool is busy.
+    """
+    for file_path in file_paths:
+        if not workers.has_capacity():
+            continue
+        try:
+            await ensure_thumbnail(
+                file_path, thumbnails.DEFAULT_SIZE, thumbnails.DEFAULT_SIZE, thumbnails.DEFAULT_FORMAT
+            )
+        except Exception as e:
+            logger.warning("Failed to pregenerate thumbnail", extra={"path": file_path, "error": str(e)})
+
+
+@router.get("/thumb/{path:path}")
+async def get_thumbnail(
+    request: Request,
+    path: str,
+    w: int = Query(thumbnails.DEFAULT_SIZE, ge=16, le=2048, description="Maximum width in pixels"),
+    h: int = Query(thumbnails.DEFAULT_SIZE, ge=16, le=2048, description="Maximum height in pixels"),
+    fmt: str = Query(thumbnails.DEFAULT_FORMAT, description="Output format: 'webp' or 'jpeg'"),
+):
+    """
+    Serve a resized rendition of an image, keeping its aspect ratio.
+    """
+    if fmt not in thumbnails.FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid format. Use 'webp' or 'jpeg'.")
+    source_path = resolve_source(path)
+    try:
+        output_path, key = await ensure_thumbnail(source_path, w, h, fmt)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to create the thumbnail: {str(e)}")
+
+    etag = f'"{key}"'
+    headers = {"ETag": etag, "Cache-Control": THUMB_CACHE_CONTROL}
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(output_path, media_type=thumbnails.FORMATS[fmt][1], headers=headers)
@@ -8,21 +8,40 @@ function App() {
   const [crop, setCrop] = useState({ aspect: 16 / 9 });
   const [completedCrop, setCompletedCrop] = useState(null);
   const [imageRef, setImageRef] = useState(null);
-
-  useEffect(() => {
-    // Fetch images from the backend
-    fetch('http://localhost:8082/list') // Assuming the FastAPI backend serves images at /images
+  const [nextCursor, setNextCursor] = useState(null);
+  const [savedAnnotations, setSavedAnnotations] = useState([]);
+
+  // The backend returns images one page at a time; next_cursor is null on the last page
+  const fetchImages = (cursor) => {
+    const params = new URLSearchParams({ limit: '100' });
+    if (cursor) {
+      params.set('cursor', cursor);
+    }
+    fetch(`http://localhost:8082/list?${params.toString()}`)
       .then(res => res.json())
       .then(data => {
-        console.log(data)
-        setImages(data.images)
-      }) // Assuming the API returns { "images": ["image1.jpg", "image2.png"] }
+        setImages(prevImages => (cursor ? [...prevImages, ...data.images] : data.images));
+        setNextCursor(data.next_cursor);
+      }) // The API returns { "images": [{ name, url, ... }], "next_cursor": "..." }
       .catch(err => console.error("Failed to fetch images:", err));
+  };
+
+  useEffect(() => {
+    fetchImages(null);
   }, []);
 
+  // Only the boxes for this image are fetched, not the whole annotation history
+  const fetchAnnotations = (imageName) => {
+    fetch(`http://localhost:8082/annotations?image=${encodeURIComponent(imageName)}`)
+      .then(res => res.json())
+      .then(data => setSavedAnnotations(data.annotations))
+      .catch(err => console.error("Failed to fetch annotations:", err));
+  };
+
   const handleImageSelect = (imageName) => {
     setSelectedImage(`/images/${imageName}`); // Assuming images are served directly from the /images route
     setCompletedCrop(null); // Reset crop when new image is selected
+    fetchAnnotations(imageName);
   };
 
   const onImageLoaded = image => {
@@ -112,6 +131,7 @@ function App() {
       .then(data => {
         alert(`Bounding Box Saved (for ${cropDataForBackend.imageName}):\nX: ${cropDataForBackend.x}, Y: ${cropDataForBackend.y}\nWidth: ${cropDataForBackend.width}, Height: ${cropDataForBackend.height}`);
         console.log('Annotation saved:', data);
+        setSavedAnnotations(prevAnnotations => [...prevAnnotations, data.annotation]);
       })
       .catch(error => {
         alert('Error saving annotation. See console for details.');
@@ -130,6 +150,13 @@ function App() {
             <ul>
               {images.map(imgName => (
                 <li key={imgName.url} onClick={() => handleImageSelect(imgName.name)} style={{cursor: 'pointer'}}>
+                  {/* Small server-side rendition instead of downloading the full-size original */}
+                  <img
+                    src={`http://localhost:8082/thumb/${imgName.url.replace(/^\/images\//, '')}?w=96&h=96`}
+                    alt={imgName.name}
+                    loading="lazy"
+                    style={{width: 96, height: 96, objectFit: 'contain', marginRight: '8px', verticalAlign: 'middle'}}
+                  />
                   {imgName.name}
                 </li>
               ))}
@@ -137,6 +164,11 @@ function App() {
           ) : (
             <p>Loading images or no images found in /images directory on the backend.</p>
           )}
+          {nextCursor && (
+            <button onClick={() => fetchImages(nextCursor)}>
+              Load more
+            </button>
+          )}
         </div>
 
         {selectedImage && (
@@ -152,6 +184,18 @@ function App() {
             <button onClick={handleSaveCrop} style={{marginTop: '10px'}}>
               Save Bounding Box
             </button>
+            {savedAnnotations.length > 0 && (
+              <div>
+                <h3>Saved Bounding Boxes:</h3>
+                <ul>
+                  {savedAnnotations.map(annotation => (
+                    <li key={annotation.id}>
+                      X: {annotation.x}, Y: {annotation.y}, Width: {annotation.width}, Height: {annotation.height}
+                    </li>
+                  ))}
+                </ul>
+              </div>
+            )}
           </div>
         )}
 
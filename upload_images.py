@@ -1,26 +1,270 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Body, Header, Request, UploadFile, File, Form, HTTPException
+import hashlib
 import os
+import re
+import tempfile
 from typing import List
+from classes import catalog, metrics, ocr_cache, upload_sessions, workers
+from classes.config import IMAGE_DIR, UPLOAD_MAX_CHUNK_BYTES
+from thumb_routes import pregenerate_thumbnails
 
 router = APIRouter()
 
+# Uploads are streamed to disk in chunks of this size, so memory use stays flat
+CHUNK_SIZE = 1024 * 1024
+
+def write_chunk(f, digest, chunk):
+    # Hash and write together in the I/O pool; both release the GIL for large buffers
+    digest.update(chunk)
+    f.write(chunk)
+    metrics.record_bytes("written", "upload", len(chunk))
+
+def finalize_upload(temp_path, file_path, content_hash, size):
+    """
+    Move a fully written temporary file into place. If identical content is already
+    stored, the new name becomes a hardlink to it and the temporary copy is dropped.
+    Returns True when the file was deduplicated.
+    """
+    deduplicated = False
+    for existing_path in catalog.find_by_hash(content_hash, size):
+        if os.path.abspath(existing_path) == os.path.abspath(file_path):
+            continue
+        try:
+            if os.path.getsize(existing_path) != size:
+                continue
+            link_path = temp_path + ".link"
+            os.link(existing_path, link_path)
+            os.replace(link_path, file_path)
+        except OSError:
+            # Missing file, other filesystem or no hardlink support; try the next copy
+            continue
+        os.remove(temp_path)
+        deduplicated = True
+        break
+    if not deduplicated:
+        # mkstemp creates files readable by the owner only; match a normal open()
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temp_path, 0o666 & ~umask)
+        os.replace(temp_path, file_path)
+
+    catalog.upsert_path(file_path, content_hash=content_hash)
+    ocr_cache.remember_hash(file_path, content_hash)
+    return deduplicated
+
+async def save_upload(file, file_path):
+    """
+    Stream an UploadFile to file_path through a temporary file in the same directory,
+    hashing it on the way, then rename it into place atomically.
+    Returns (content_hash, deduplicated).
+    """
+    fd, temp_path = await workers.run_io(
+        tempfile.mkstemp, dir=os.path.dirname(file_path) or ".", prefix=".upload-"
+    )
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                chunk = await file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                await workers.run_io(write_chunk, f, digest, chunk)
+        content_hash = digest.hexdigest()
+        deduplicated = await workers.run_io(finalize_upload, temp_path, file_path, content_hash, size)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return content_hash, deduplicated
+
 @router.post("/upload")
 async def upload_images(
+    background_tasks: BackgroundTasks,
     files: List[UploadFile] = File(...),
-    save_location: str = Form("/images")
+    save_location: str = Form(IMAGE_DIR)
 ):
     # Ensure the save location exists
     if not os.path.exists(save_location):
         os.makedirs(save_location)
 
     saved_files = []
+    deduplicated_files = []
     for file in files:
         file_path = os.path.join(save_location, file.filename)
         try:
-            with open(file_path, "wb") as f:
-                f.write(await file.read())
+            _, deduplicated = await save_upload(file, file_path)
             saved_files.append(file_path)
+            if deduplicated:
+                deduplicated_files.append(file_path)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Failed to save {file.filename}: {str(e)}")
 
-    return {"message": "Files uploaded successfully", "saved_files": saved_files}
\ No newline at end of file
+    # Render grid thumbnails once the response has been sent
+    background_tasks.add_task(pregenerate_thumbnails, saved_files)
+    return {
+        "message": "Files uploaded successfully",
+        "saved_files": saved_files,
+        "deduplicated_files": deduplicated_files,
+    }
+
+
+# Resumable uploads: POST /upload/sessions, then PUT every chunk (in any order and
+# in parallel), then POST .../commit. GET on the session lists the chunks already
+# received, so a client that lost its connection only resends what is missing.
+
+@router.post("/upload/sessions", status_code=201)
+async def create_upload_session(
+    filename: str = Body(..., min_length=1, description="Name of the file being uploaded"),
+    chunk_count: int = Body(..., ge=1, description="Number of chunks the file is split into"),
+    save_location: str = Body(IMAGE_DIR, description="Directory to save the assembled file in"),
+    total_size: int = Body(None, ge=0, description="Size of the whole file in bytes, checked on commit"),
+    sha256: str = Body(None, description="SHA-256 of the whole file, checked on commit"),
+):
+    """
+    Start a resumable upload session for one file.
+    """
+    if os.path.basename(filename) != filename or filename.startswith("."):
+        raise HTTPException(status_code=400, detail=f"Invalid file name: {filename}")
+    if sha256 is not None:
+        sha256 = sha256.lower()
+        if not re.fullmatch(r"[0-9a-f]{64}", sha256):
+            raise HTTPException(status_code=400, detail="sha256 must be 64 hexadecimal characters")
+    session = await workers.run_io(
+        upload_sessions.create, os.path.join(save_location, filename), chunk_count, total_size, sha256
+    )
+    return {**session, "max_chunk_bytes": UPLOAD_MAX_CHUNK_BYTES}
+
+def get_session_or_404(session_id):
+    session = upload_sessions.load(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    return session
+
+@router.get("/upload/sessions/{session_id}")
+async def get_upload_session(session_id: str):
+    """
+    Report which chunks have been received, so an interrupted upload can resume.
+    """
+    session = get_session_or_404(session_id)
+    chunks = await workers.run_io(upload_sessions.received_chunks, session_id)
+    missing = [index for index in range(session["chunk_count"]) if index not in chunks]
+    return {
+        **session,
+        "received_chunks": [{"index": index, **chunks[index]} for index in sorted(chunks)],
+        "missing_chunks": missing,
+    }
+
+@router.put("/upload/sessions/{session_id}/chunks/{index}")
+async def put_upload_chunk(
+    session_id: str,
+    index: int,
+    request: Request,
+    x_chunk_sha256: str = Header(None, description="SHA-256 of the chunk body; the chunk is rejected on mismatch"),
+):
+    """
+    Store one chunk (the raw request body). Re-sending a chunk replaces it.
+    """
+    session = get_session_or_404(session_id)
+    if not 0 <= index < session["chunk_count"]:
+        raise HTTPException(status_code=400, detail=f"Chunk index must be between 0 and {session['chunk_count'] - 1}")
+    if upload_sessions.is_committing(session_id):
+        raise HTTPException(status_code=409, detail="Upload session is being committed")
+
+    fd, temp_path = await workers.run_io(upload_sessions.open_chunk, session_id)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in request.stream():
+                if not chunk:
+                    continue
+                size += len(chunk)
+                if size > UPLOAD_MAX_CHUNK_BYTES:
+                    raise HTTPException(status_code=413, detail=f"Chunks may be at most {UPLOAD_MAX_CHUNK_BYTES} bytes")
+                await workers.run_io(write_chunk, f, digest, chunk)
+        chunk_hash = digest.hexdigest()
+        if x_chunk_sha256 is not None and x_chunk_sha256.lower() != chunk_hash:
+            raise HTTPException(
+                status_code=422,
+                detail=f"Checksum mismatch for chunk {index}: expected {x_chunk_sha256}, received {chunk_hash}",
+            )
+        if not await workers.run_io(upload_sessions.store_chunk, session_id, index, temp_path, chunk_hash):
+            raise HTTPException(status_code=409, detail="Upload session is being committed")
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return {"index": index, "size": size, "sha256": chunk_hash}
+
+@router.post("/upload/sessions/{session_id}/commit")
+async def commit_upload_session(session_id: str, background_tasks: BackgroundTasks):
+    """
+    Assemble the received chunks in order and save the file like /upload does.
+    """
+    session = get_session_or_404(session_id)
+    if not upload_sessions.lock_for_commit(session_id):
+        raise HTTPException(status_code=409, detail="Upload session is already being committed")
+    try:
+        chunks = await workers.run_io(upload_sessions.received_chunks, session_id)
+        missing = [index for index in range(session["chunk_count"]) if index not in chunks]
+        if missing:
+            raise HTTPException(status_code=409, detail=f"Missing chunks: {missing}")
+        total_size = sum(chunk["size"] for chunk in chunks.values())
+        if session["total_size"] is not None and total_size != session["total_size"]:
+            raise HTTPException(
+                status_code=422,
+                detail=f"Size mismatch: expected {session['total_size']} bytes, received {total_size}",
+            )
+
+        file_path = session["file_path"]
+        save_location = os.path.dirname(file_path)
+        if not os.path.exists(save_location):
+            os.makedirs(save_location)
+        try:
+            temp_path, content_hash, size = await workers.run_io(
+                upload_sessions.assemble, session_id, save_location, chunks
+            )
+        except upload_sessions.ChunksChanged as e:
+            raise HTTPException(status_code=409, detail=f"{str(e)}, commit again")
+        if session["sha256"] is not None and session["sha256"] != content_hash:
+            os.remove(temp_path)
+            raise HTTPException(
+                status_code=422,
+                detail=f"Checksum mismatch: expected {session['sha256']}, assembled file has {content_hash}",
+            )
+        try:
+            deduplicated = await workers.run_io(finalize_upload, temp_path, file_path, content_hash, size)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+    except HTTPException:
+        upload_sessions.unlock(session_id)
+        raise
+    except Exception as e:
+        upload_sessions.unlock(session_id)
+        raise HTTPException(status_code=500, detail=f"Failed to assemble {os.path.basename(session['file_path'])}: {str(e)}")
+
+    await workers.run_io(upload_sessions.remove, session_id)
+    background_tasks.add_task(pregenerate_thumbnails, [file_path])
+    return {
+        "message": "File uploaded successfully",
+        "file_path": file_path,
+        "size": size,
+        "sha256": content_hash,
+        "deduplicated": deduplicated,
+    }
+
+@router.delete("/upload/sessions/{session_id}")
+async def abort_upload_session(session_id: str):
+    """
+    Abandon a session and delete its chunks.
+    """
+    get_session_or_404(session_id)
+    # Held until the directory is gone, so a commit can't start while it is deleted
+    if not upload_sessions.lock_for_commit(session_id):
+        raise HTTPException(status_code=409, detail="Upload session is being committed")
+    await workers.run_io(upload_sessions.remove, session_id)
+    return {"message": "Upload session deleted", "session_id": session_id}